@@ -0,0 +1,349 @@
+"""代替gmsh和OpenFOAM的假命令, 用于没有安装OpenFOAM时测试和基准测试
+
+每个命令生成与真实命令格式相同的文件, 数据是解析函数, 大小由环境变量控制:
+    FAKE_FOAM_CELLS: 网格数量, 决定 {time}/{C,p,U} 的大小
+    FAKE_FOAM_RES: 没有system/points时采样点云的分辨率, 决定 cloud_p.xy 和 cloud_U.xy 的大小
+    FAKE_FOAM_ITERS: 求解器最多运行的迭代步数, 不超过controlDict中的endTime
+    FAKE_FOAM_STEP: 每步的耗时, 单位秒, 默认为0
+
+求解器每步检查controlDict中的stopAt, 为writeNow时写出当前时间步后退出.
+初始残差从0.1(均匀初值)或与初值误差成比例的值开始指数下降, 最后停在1e-5附近.
+
+用法: python -m airfoil_generator.bench.fake_foam <命令> [参数]
+"""
+import io
+import os
+import re
+import shutil
+import sys
+import time
+
+import numpy as np
+
+FOAM_HEADER = """/*--------------------------------*- C++ -*----------------------------------*\\
+  =========                 |
+  \\\\      /  F ield         | OpenFOAM: The Open Source CFD Toolbox
+   \\\\    /   O peration     |
+    \\\\  /    A nd           | fake_foam
+     \\\\/     M anipulation  |
+\\*---------------------------------------------------------------------------*/
+FoamFile
+{{
+    version     2.0;
+    format      ascii;
+    class       {cls};
+    location    "{location}";
+    object      {name};
+}}
+// * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * * //
+
+dimensions      {dims};
+
+"""
+
+BOUNDARY = """FoamFile
+{
+    version     2.0;
+    format      ascii;
+    class       polyBoundaryMesh;
+    location    "constant/polyMesh";
+    object      boundary;
+}
+
+4
+(
+    inlet
+    {
+        type            patch;
+        nFaces          0;
+        startFace       0;
+    }
+    front
+    {
+        type            patch;
+        nFaces          0;
+        startFace       0;
+    }
+    back
+    {
+        type            patch;
+        nFaces          0;
+        startFace       0;
+    }
+    aerofoil
+    {
+        type            patch;
+        nFaces          0;
+        startFace       0;
+    }
+)
+"""
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def read_geo_points(fname="airfoil.geo"):
+    """airfoil.geo中的翼型坐标, (n, 2)"""
+    with open(fname, "rt") as f:
+        text = f.read()
+    points = re.findall(r"Point\(\d+\)\s*=\s*\{\s*([-\d.eE+]+),\s*([-\d.eE+]+),", text)
+    return np.array(points, dtype=np.float64).reshape(-1, 2)
+
+
+def read_freestream(fname="0/U"):
+    """来流速度, 取自边界的freestreamValue, 热启动时internalField不是uniform"""
+    with open(fname, "rt") as f:
+        text = f.read()
+    m = re.search(r"freestreamValue\s+uniform\s+\(\s*(\S+)\s+(\S+)", text)
+    if m is None:
+        m = re.search(r"internalField\s+uniform\s+\(\s*(\S+)\s+(\S+)", text)
+    return float(m.group(1)), float(m.group(2))
+
+
+def read_dict_value(fname, key, default=None):
+    if not os.path.exists(fname):
+        return default
+    with open(fname, "rt") as f:
+        m = re.search(rf"^\s*{key}\s+([^;]+);", f.read(), re.MULTILINE)
+    return m.group(1).strip() if m else default
+
+
+def latest_time(case_dir="."):
+    times = []
+    for name in os.listdir(case_dir):
+        try:
+            times.append((float(name), name))
+        except ValueError:
+            continue
+    times = [t for t in times if t[0] > 0]
+    return max(times)[1] if times else None
+
+
+def read_points(fname="system/points"):
+    """set_sample_points写出的采样点, (n, 3)"""
+    with open(fname, "rt") as f:
+        text = f.read()
+    body = text[text.index("(") + 1 : text.rindex(")")]
+    return np.fromstring(body.replace("(", " ").replace(")", " "), sep=" ").reshape(-1, 3)
+
+
+def inside(px, py, poly):
+    """点是否在多边形内部, 奇偶规则"""
+    result = np.zeros(px.shape, dtype=bool)
+    x0, y0 = poly[:, 0], poly[:, 1]
+    x1, y1 = np.roll(x0, -1), np.roll(y0, -1)
+    for i in range(len(poly)):
+        cross = (y0[i] > py) != (y1[i] > py)
+        if not np.any(cross):
+            continue
+        xi = (x1[i] - x0[i]) * (py - y0[i]) / (y1[i] - y0[i] + 1e-300) + x0[i]
+        result ^= cross & (px < xi)
+    return result
+
+
+def flow(x, y, fsX, fsY):
+    """解析的流场 (p, Ux, Uy), 只用来生成大小和格式正确的数据"""
+    r2 = (x - 0.5) ** 2 + y**2 + 0.05
+    p = -0.5 * (fsX**2 + fsY**2) * np.exp(-r2) * np.cos(3 * x)
+    ux = fsX * (1 - 0.1 / r2) + 0.05 * y
+    uy = fsY * (1 - 0.1 / r2) - 0.05 * x
+    return p, ux, uy
+
+
+def cell_centres(n):
+    """网格中心只由网格数量决定, 同一个网格的求解器和postProcess得到相同的坐标"""
+    rng = np.random.default_rng(n)
+    r = 10 * rng.random(n) ** 2
+    theta = 2 * np.pi * rng.random(n)
+    return np.c_[0.5 + r * np.cos(theta), r * np.sin(theta), np.full(n, 0.5)]
+
+
+def write_field(fname, name, values, dims="[0 0 0 0 0 0 0]"):
+    values = np.asarray(values)
+    vector = values.ndim == 2
+    cls = "volVectorField" if vector else "volScalarField"
+    typ = "vector" if vector else "scalar"
+    buf = io.StringIO()
+    buf.write(FOAM_HEADER.format(cls=cls, location=os.path.dirname(fname), name=name, dims=dims))
+    buf.write(f"internalField   nonuniform List<{typ}> \n{len(values)}\n(\n")
+    np.savetxt(buf, values, fmt="(%.8g %.8g %.8g)" if vector else "%.8g")
+    buf.write(")\n;\n\nboundaryField\n{\n}\n\n\n")
+    with open(fname, "wt") as f:
+        f.write(buf.getvalue())
+
+
+def gmsh(argv):
+    out = argv[argv.index("-o") + 1] if "-o" in argv else "airfoil.msh"
+    points = read_geo_points(argv[0] if argv else "airfoil.geo")
+    with open(out, "wt") as f:
+        f.write(f"$MeshFormat\n2.2 0 8\n$EndMeshFormat\n// {len(points)} airfoil points\n")
+
+
+def gmshToFoam(argv):
+    os.makedirs("constant/polyMesh", exist_ok=True)
+    with open("constant/polyMesh/boundary", "wt") as f:
+        f.write(BOUNDARY)
+
+
+PROCESSOR_PATCH = """    procBoundary{i}to{j}
+    {{
+        type            processor;
+        nFaces          0;
+        startFace       0;
+        myProcNo        {i};
+        neighbProcNo    {j};
+    }}
+"""
+
+
+def decomposePar(argv):
+    """每个processor中的网格边界和场都多一个processor边界, -fields只分解场"""
+    n = int(read_dict_value("system/decomposeParDict", "numberOfSubdomains", 1))
+    for i in range(n):
+        proc = f"processor{i}"
+        j = (i + 1) % n
+        if "-fields" not in argv:
+            if os.path.exists(proc):
+                shutil.rmtree(proc)
+            os.makedirs(f"{proc}/constant/polyMesh")
+            with open("constant/polyMesh/boundary", "rt") as f:
+                text = f.read()
+            count = len(re.findall(r"^\s*type\s", text, re.MULTILINE))
+            text = text.replace(f"\n{count}\n(", f"\n{count + 1}\n(", 1)
+            text = text[: text.rindex(")")] + PROCESSOR_PATCH.format(i=i, j=j) + ")\n"
+            with open(f"{proc}/constant/polyMesh/boundary", "wt") as f:
+                f.write(text)
+        os.makedirs(f"{proc}/0", exist_ok=True)
+        for name in os.listdir("0"):
+            with open(f"0/{name}", "rt") as f:
+                text = f.read()
+            m = re.search(r"internalField\s+uniform\s+([^;]*);", text)
+            value = f"uniform {m.group(1)}" if m else "nonuniform List<scalar> 0()"
+            patch = f"    procBoundary{i}to{j}\n    {{\n        type processor;\n        value {value};\n    }}\n"
+            with open(f"{proc}/0/{name}", "wt") as f:
+                f.write(text[: text.rindex("}")] + patch + text[text.rindex("}") :])
+
+
+def reconstructPar(argv):
+    # 假求解器直接把结果写在case目录中, 不需要重构
+    pass
+
+
+def initial_residual(fsX, fsY, ncells, zero="0"):
+    """均匀初值为0.1, 非均匀初值(热启动)与解析解的相对误差越小初始残差越小"""
+    with open(f"{zero}/U", "rt") as f:
+        nonuniform = re.search(r"internalField\s+nonuniform", f.read()) is not None
+    if not nonuniform:
+        return 0.1
+    from ..process.reader import read_foam_field
+
+    U0 = read_foam_field(f"{zero}/U")
+    _, ux, uy = flow(*cell_centres(ncells)[:, :2].T, fsX, fsY)
+    err = np.linalg.norm(U0[:, :2] - np.c_[ux, uy]) / np.linalg.norm(np.c_[ux, uy])
+    return 0.1 * float(np.clip(err, 1e-3, 1.0))
+
+
+def solver(argv):
+    # 并行时和真实的求解器一样从processor*/0读取初值
+    zero = "processor0/0" if "-parallel" in argv else "0"
+    fsX, fsY = read_freestream(f"{zero}/U")
+    end_time = int(float(read_dict_value("system/controlDict", "endTime", "500")))
+    ncells = _env_int("FAKE_FOAM_CELLS", 20000)
+    res = _env_int("FAKE_FOAM_RES", 128)
+    iters = min(_env_int("FAKE_FOAM_ITERS", 100), end_time)
+    step = float(os.environ.get("FAKE_FOAM_STEP", 0))
+    r0 = initial_residual(fsX, fsY, ncells, zero)
+
+    # 日志, 格式与simpleFoam相同
+    for it in range(1, iters + 1):
+        r = max(r0 * np.exp(-it / 20.0), 1e-5) * (1 + 0.01 * np.sin(it))
+        lines = [f"Time = {it}\n\n"]
+        for field in ("Ux", "Uy", "p"):
+            lines.append(
+                f"smoothSolver:  Solving for {field}, Initial residual = {r:.6g}, "
+                f"Final residual = {r * 0.01:.6g}, No Iterations 2\n"
+            )
+        lines.append(f"ExecutionTime = {it * 0.01:.2f} s  ClockTime = {it // 100} s\n\n")
+        sys.stdout.write("".join(lines))
+        sys.stdout.flush()
+        if step > 0:
+            time.sleep(step)
+        if read_dict_value("system/controlDict", "stopAt") == "writeNow":
+            break
+    sys.stdout.write("End\n")
+    end_time = str(it)
+
+    # 采样点云, 像素坐标与coord2img一致, 先y后x, 翼型内部没有采样点
+    if os.path.exists("system/points"):
+        px, py = read_points()[:, :2].T
+    else:
+        idx = np.arange(res)
+        py, px = np.meshgrid((idx / res - 0.5) * 2, (idx / res - 0.5) * 2 + 0.5, indexing="ij")
+        px, py = px.ravel(), py.ravel()
+    if os.path.exists("airfoil.geo"):
+        keep = ~inside(px, py, read_geo_points())
+        px, py = px[keep], py[keep]
+    p, ux, uy = flow(px, py, fsX, fsY)
+    z = np.full(px.shape, 0.5)
+    cloud = f"postProcessing/internalCloud/{end_time}"
+    os.makedirs(cloud, exist_ok=True)
+    np.savetxt(f"{cloud}/cloud_p.xy", np.c_[px, py, z, p], fmt="%.8g")
+    np.savetxt(f"{cloud}/cloud_U.xy", np.c_[px, py, z, ux, uy, np.zeros_like(z)], fmt="%.8g")
+
+    # 翼型表面, 点的顺序是打乱的
+    surface = f"postProcessing/airfoilBoundary/{end_time}"
+    os.makedirs(surface, exist_ok=True)
+    if os.path.exists("airfoil.geo"):
+        points = read_geo_points()
+    else:
+        t = np.linspace(0, 2 * np.pi, 100, endpoint=False)
+        points = np.c_[0.5 + 0.5 * np.cos(t), 0.06 * np.sin(t)]
+    points = points[np.random.default_rng(len(points)).permutation(len(points))]
+    sp, _, _ = flow(points[:, 0], points[:, 1], fsX, fsY)
+    with open(f"{surface}/p_aerofoil.raw", "wt") as f:
+        f.write("# p  POINT_DATA %d\n#  x  y  z  p\n" % len(points))
+        np.savetxt(f, np.c_[points, np.full(len(points), 0.5), sp], fmt="%.8g")
+
+    # 网格上的场
+    os.makedirs(end_time, exist_ok=True)
+    C = cell_centres(ncells)
+    p, ux, uy = flow(C[:, 0], C[:, 1], fsX, fsY)
+    write_field(f"{end_time}/p", "p", p, "[0 2 -2 0 0 0 0]")
+    write_field(f"{end_time}/U", "U", np.c_[ux, uy, np.zeros(ncells)], "[0 1 -1 0 0 0 0]")
+
+
+def postProcess(argv):
+    func = argv[argv.index("-func") + 1] if "-func" in argv else ""
+    time = latest_time()
+    if time is None:
+        return
+    from ..process.reader import read_foam_header, read_foam_field
+
+    if func == "writeCellCentres":
+        n = read_foam_header(f"{time}/p")["n"]
+        write_field(f"{time}/C", "C", cell_centres(n), "[0 1 0 0 0 0 0]")
+    elif func.startswith("components"):
+        U = read_foam_field(f"{time}/U")
+        for i, c in enumerate("xyz"):
+            write_field(f"{time}/U{c}", f"U{c}", U[:, i], "[0 1 -1 0 0 0 0]")
+
+
+TOOLS = {
+    "gmsh": gmsh,
+    "gmshToFoam": gmshToFoam,
+    "decomposePar": decomposePar,
+    "reconstructPar": reconstructPar,
+    "simpleFoam": solver,
+    "postProcess": postProcess,
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    TOOLS[argv[0]](argv[1:])
+
+
+if __name__ == "__main__":
+    main()
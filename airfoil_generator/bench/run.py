@@ -0,0 +1,246 @@
+import contextlib
+import json
+import os
+import shlex
+import shutil
+import sys
+import time
+
+import configargparse
+import numpy as np
+
+from .. import trace
+from ..generate import generate_from_cli
+from ..process.postprocess import (coord2img, get_airfoil_data, get_grid_data,
+                                   get_raw_mesh)
+from ..process.preprocess import gen_mesh
+from ..process.reader import SampleData
+from ..utils.configarg import get_args
+from ..utils.utils import run_cmd
+from ..writer import MatWriter, NpzWriter, ShardWriter
+from .workspace import make_workspace, naca4
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+# 这些指标与外部命令的启动时间无关, 超过基准时判定为性能退化
+CHECKED = (
+    "e2e_seconds_per_sample",
+    "peak_rss_mb",
+    "read_cloud",
+    "coord2img",
+    "get_grid_data",
+    "get_airfoil_data",
+    "get_raw_mesh",
+    "save_mat",
+    "save_npz",
+    "save_shard",
+)
+# 小于这个差值的变化视为测量噪声, 时间单位为秒, 内存单位为MB
+NOISE = {"peak_rss_mb": 5.0}
+DEFAULT_NOISE = 0.005
+
+
+def peak_rss_mb(who="self"):
+    if resource is None:
+        return float("nan")
+    usage = resource.getrusage(resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN)
+    # linux上单位是KB, macOS上是字节
+    return usage.ru_maxrss / (1024**2 if sys.platform == "darwin" else 1024)
+
+
+def best_of(fn, repeat):
+    """运行repeat次, 返回最短时间和最后一次的结果"""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def bench_generate(root, n_samples, res, extra_args=()):
+    """在假的OpenFOAM环境中运行完整的generate, 返回吞吐量和每个阶段的p50"""
+    for name in ("outputs", "mesh_cache", "workers", "traces", "logs"):
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+    config = os.path.join(root, "config.yml")
+    with open(config, "wt") as f:
+        f.write("freestream-angle:\n  - -10\n  - 10\nfreestream-length:\n  - 1\n  - 10\n")
+    parser = get_args(configargparse.ArgumentParser())
+    args = parser.parse_args(
+        [
+            "--config", config,
+            "--seed", "0",
+            "--case-dir", f"{root}/caseSteadyState",
+            "--airfoil-database", f"{root}/airfoils",
+            "--fixed-airfoil", "False",
+            "--parallel-enable", "True",
+            "--subdomains", "2",
+            "--res", str(res),
+            "--n-samples", str(n_samples),
+            "--output-dir", f"{root}/outputs",
+            "--work-dir", f"{root}/workers",
+            "--mesh-cache", f"{root}/mesh_cache",
+            "--trace-dir", f"{root}/traces",
+            "--log-dir", f"{root}/logs",
+            *extra_args,
+        ]
+    )
+
+    t0 = time.perf_counter()
+    with open(os.path.join(root, "generate.log"), "wt") as log, contextlib.redirect_stdout(log):
+        generate_from_cli(args)
+    wall = time.perf_counter() - t0
+
+    metrics = {
+        "e2e_samples_per_second": n_samples / wall,
+        "e2e_seconds_per_sample": wall / n_samples,
+    }
+    for name, count, total, p50, p95, wmax, cpu in trace.get_tracer().summary():
+        metrics[f"stage_{name}_p50"] = p50
+    return metrics
+
+
+def make_sample_case(root):
+    """用假命令生成一个样本的仿真结果, 用于单独测试后处理和保存"""
+    case_dir = os.path.join(root, "sample_case")
+    shutil.rmtree(case_dir, ignore_errors=True)
+    shutil.copytree(os.path.join(root, "caseSteadyState"), case_dir)
+    gen_mesh(naca4("2412"), case_dir)
+    run_cmd("simpleFoam > foam.log", case_dir)
+    run_cmd("postProcess -func writeCellCentres -noZero >> foam.log", case_dir)
+    return case_dir
+
+
+def bench_postprocess(root, res, repeat):
+    """后处理函数和writer的最短运行时间"""
+    case_dir = make_sample_case(root)
+    args = configargparse.Namespace(case_dir=case_dir, res=res)
+    metrics = {}
+
+    def read_cloud():
+        data = SampleData(case_dir)
+        data.cloud_p, data.cloud_U, data.aerofoil_p
+        return data
+
+    metrics["read_cloud"], data = best_of(read_cloud, repeat)
+    metrics["coord2img"], data_img = best_of(lambda: coord2img(1.0, 0.1, args, data), repeat)
+    metrics["get_grid_data"], grid_data = best_of(lambda: get_grid_data(args, data), repeat)
+    metrics["get_airfoil_data"], airfoil_data = best_of(lambda: get_airfoil_data(case_dir, data), repeat)
+    metrics["get_raw_mesh"], raw_mesh_data = best_of(lambda: get_raw_mesh(case_dir), repeat)
+
+    data_dict = {
+        "freestream": np.array([1.0, 0.1, 1.005, 5.7]),
+        "data_img": data_img,
+        "grid_data": grid_data,
+        "raw_mesh_data": raw_mesh_data,
+        "airfoil_data": airfoil_data,
+    }
+    out_dir = os.path.join(root, "bench_outputs")
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(out_dir)
+    shard = ShardWriter(out_dir, "bench", shard_size=1)
+    for writer in (MatWriter(out_dir, "bench"), NpzWriter(out_dir, "bench"), shard):
+        metrics[f"save_{writer.name}"], _ = best_of(lambda: writer.write(0, data_dict), repeat)
+    return metrics
+
+
+def run_benchmarks(root, n_samples=8, cells=20000, res=128, iters=100, repeat=10, extra_args=()):
+    root = os.path.abspath(root)
+    env = make_workspace(root)
+    env.update(
+        {
+            "FAKE_FOAM_CELLS": str(cells),
+            "FAKE_FOAM_RES": str(res),
+            "FAKE_FOAM_ITERS": str(iters),
+        }
+    )
+    saved_env = {k: os.environ.get(k) for k in env}
+    os.environ.update(env)
+    try:
+        metrics = bench_generate(root, n_samples, res, extra_args)
+        metrics["peak_rss_mb"] = peak_rss_mb("self")
+        metrics["peak_rss_children_mb"] = peak_rss_mb("children")
+        metrics.update(bench_postprocess(root, res, repeat))
+    finally:
+        for k, v in saved_env.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+    return metrics
+
+
+def load_baseline(fname):
+    if not os.path.exists(fname):
+        return None
+    with open(fname, "rt") as f:
+        return json.load(f)
+
+
+def save_baseline(fname, metrics, config):
+    with open(fname, "wt") as f:
+        json.dump({"config": config, "metrics": metrics}, f, indent=2)
+
+
+def compare(metrics, baseline, tolerance):
+    """返回超过基准 (1 + tolerance) 倍且超出测量噪声的指标 [(name, value, base)]"""
+    regressions = []
+    for name in CHECKED:
+        base = baseline["metrics"].get(name)
+        value = metrics.get(name)
+        if base is None or value is None or not np.isfinite(base):
+            continue
+        if value > base * (1 + tolerance) and value - base > NOISE.get(name, DEFAULT_NOISE):
+            regressions.append((name, value, base))
+    return regressions
+
+
+def print_metrics(metrics, baseline=None):
+    width = max(len(name) for name in metrics)
+    print(f"\n{'metric':<{width}} {'value':>12} {'baseline':>12} {'ratio':>7}")
+    for name, value in metrics.items():
+        base = baseline["metrics"].get(name) if baseline else None
+        if base:
+            print(f"{name:<{width}} {value:>12.5g} {base:>12.5g} {value / base:>7.2f}")
+        else:
+            print(f"{name:<{width}} {value:>12.5g} {'-':>12} {'-':>7}")
+
+
+def bench_from_cli(args):
+    config = {
+        "samples": args.bench_samples,
+        "cells": args.bench_cells,
+        "res": args.bench_res,
+        "iters": args.bench_iters,
+        "repeat": args.bench_repeat,
+        "args": args.bench_args,
+    }
+    metrics = run_benchmarks(
+        args.bench_dir,
+        args.bench_samples,
+        args.bench_cells,
+        args.bench_res,
+        args.bench_iters,
+        args.bench_repeat,
+        shlex.split(args.bench_args),
+    )
+
+    baseline = load_baseline(args.bench_baseline)
+    if baseline is not None and baseline.get("config") != config:
+        print(f"baseline {args.bench_baseline} was recorded with {baseline.get('config')}, not compared")
+        baseline = None
+    print_metrics(metrics, baseline)
+
+    if args.bench_save:
+        save_baseline(args.bench_baseline, metrics, config)
+        print(f"baseline saved to {args.bench_baseline}")
+    elif baseline is not None:
+        regressions = compare(metrics, baseline, args.bench_tolerance)
+        for name, value, base in regressions:
+            print(f"REGRESSION {name}: {value:.5g} > {base:.5g} * {1 + args.bench_tolerance:.2f}")
+        if regressions:
+            sys.exit(1)
+        print(f"no regression against {args.bench_baseline}")
@@ -0,0 +1,159 @@
+import os
+import stat
+import sys
+
+import numpy as np
+
+# 由fake_foam实现的命令
+FAKE_TOOLS = ["gmsh", "gmshToFoam", "decomposePar", "reconstructPar", "simpleFoam", "postProcess"]
+
+MPIRUN = """#!/bin/sh
+# 跳过mpirun的参数, 直接运行求解器
+while [ $# -gt 0 ] && [ "$1" != "-np" ]; do shift; done
+shift 2
+exec "$@"
+"""
+
+RUN_FUNCTIONS = """getApplication() {
+    sed -ne 's/^ *application[ \\t]*\\([a-zA-Z]*\\)[ \\t]*;.*$/\\1/p' system/controlDict
+}
+"""
+
+HEADER = """FoamFile
+{{
+    version     2.0;
+    format      ascii;
+    class       {cls};
+    object      {name};
+}}
+
+"""
+
+CASE_FILES = {
+    "0/U": HEADER.format(cls="volVectorField", name="U")
+    + """dimensions      [0 1 -1 0 0 0 0];
+
+internalField   uniform (1 0 0);
+
+boundaryField
+{
+    inlet
+    {
+        type            freestream;
+        freestreamValue uniform (1 0 0);
+    }
+    aerofoil
+    {
+        type            noSlip;
+    }
+    "(front|back)"
+    {
+        type            empty;
+    }
+}
+""",
+    "constant/transportProperties": HEADER.format(cls="dictionary", name="transportProperties")
+    + """transportModel  Newtonian;
+
+rho             [1 -3 0 0 0 0 0] 1;
+
+nu              [0 2 -1 0 0 0 0] 1e-05;
+""",
+    "system/controlDict": HEADER.format(cls="dictionary", name="controlDict")
+    + """application     simpleFoam;
+
+startFrom       startTime;
+
+startTime       0;
+
+stopAt          endTime;
+
+endTime         500;
+
+deltaT          1;
+
+writeControl    timeStep;
+
+writeInterval   500;
+""",
+    "system/decomposeParDict": HEADER.format(cls="dictionary", name="decomposeParDict")
+    + """numberOfSubdomains 2;
+
+method          simple;
+
+coeffs
+{
+    n           (2 1 1);
+}
+""",
+    "airfoil_template.geo": """POINTS
+Spline(1) = {1000:LAST_POINT_INDEX,1000};
+""",
+    "Allclean": """cd ${0%/*} || exit
+rm -rf postProcessing processor* [1-9]*
+""",
+}
+
+
+def naca4(code, n=81):
+    """NACA四位数翼型, (2n-1, 2) Selig顺序"""
+    m, p, t = int(code[0]) / 100, int(code[1]) / 10, int(code[2:]) / 100
+    x = 0.5 * (1 - np.cos(np.linspace(0, np.pi, n)))
+    yt = 5 * t * (0.2969 * np.sqrt(x) - 0.126 * x - 0.3516 * x**2 + 0.2843 * x**3 - 0.1036 * x**4)
+    if m > 0:
+        yc = np.where(x < p, m / p**2 * (2 * p * x - x**2), m / (1 - p) ** 2 * (1 - 2 * p + 2 * p * x - x**2))
+    else:
+        yc = np.zeros_like(x)
+    upper = np.c_[x, yc + yt][::-1]
+    lower = np.c_[x, yc - yt][1:]
+    return np.concatenate([upper, lower], axis=0)
+
+
+def write_executable(fname, content):
+    with open(fname, "wt") as f:
+        f.write(content)
+    os.chmod(fname, os.stat(fname).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+
+def make_workspace(root, airfoils=("0012", "2412", "4415", "6409")):
+    """创建基准测试的工作目录
+
+    root/bin: 假的gmsh和OpenFOAM命令
+    root/foam: 假的 $WM_PROJECT_DIR, 只有RunFunctions
+    root/caseSteadyState: case模板
+    root/airfoils: NACA翼型数据库
+
+    :returns: 运行假命令需要的环境变量
+    """
+    root = os.path.abspath(root)
+    bin_dir = os.path.join(root, "bin")
+    foam_dir = os.path.join(root, "foam")
+    for d in (bin_dir, f"{foam_dir}/bin/tools", f"{root}/airfoils"):
+        os.makedirs(d, exist_ok=True)
+
+    for tool in FAKE_TOOLS:
+        write_executable(
+            f"{bin_dir}/{tool}",
+            f'#!/bin/sh\nexec "{sys.executable}" -m airfoil_generator.bench.fake_foam {tool} "$@"\n',
+        )
+    write_executable(f"{bin_dir}/mpirun", MPIRUN)
+    with open(f"{foam_dir}/bin/tools/RunFunctions", "wt") as f:
+        f.write(RUN_FUNCTIONS)
+
+    case_dir = f"{root}/caseSteadyState"
+    for name, content in CASE_FILES.items():
+        fname = os.path.join(case_dir, name)
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(fname, "wt") as f:
+            f.write(content)
+
+    for code in airfoils:
+        np.savetxt(f"{root}/airfoils/naca{code}.dat", naca4(code), fmt="%.6f", header=f"NACA {code}", comments="")
+
+    package_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    pythonpath = os.environ.get("PYTHONPATH", "")
+    return {
+        "PATH": f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+        "WM_PROJECT_DIR": foam_dir,
+        "PYTHONPATH": os.pathsep.join(filter(None, [package_root, pythonpath])),
+    }
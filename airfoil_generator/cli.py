@@ -3,11 +3,26 @@ import random
 from configargparse import ArgumentParser
 
 from .about import __desp__, __version__
-from .utils.configarg import get_args
+from .utils.configarg import (get_args, get_bench_args, get_db_args, get_fit_args,
+                              get_plan_args, get_preview_args, get_regrid_args)
+
+
+def default_seed(args):
+    """没有给出--seed时, resume使用manifest中的种子, 否则随机生成"""
+    if getattr(args, 'resume', False):
+        from .manifest import manifest_path, recorded_seed
+
+        seed = recorded_seed(manifest_path(args))
+        if seed is not None:
+            print(f"resume with seed {seed} from the manifest")
+            return seed
+    return random.randint(0, 2**32 - 1)
 
 
 def preprocess_args(args):
     if hasattr(args, 'seed'):
+        if args.seed is None:
+            args.seed = default_seed(args)
         random.seed(args.seed)
         print(f"set seed: {args.seed}")
     if hasattr(args, 'freestream_angle'):
@@ -29,6 +44,43 @@ def handle_generate(args):
     generate_from_cli(args)
 
 
+def handle_plan(args):
+    from .plan import plan_from_cli
+
+    preprocess_args(args)
+    plan_from_cli(args)
+
+
+def handle_regrid(args):
+    from .process.regrid import regrid_from_cli
+
+    regrid_from_cli(args)
+
+
+def handle_fit_cst(args):
+    from .cst_fit import fit_from_cli
+
+    fit_from_cli(args)
+
+
+def handle_build_db(args):
+    from .utils.database import build_db_from_cli
+
+    build_db_from_cli(args)
+
+
+def handle_build_preview(args):
+    from .preview import preview_from_cli
+
+    preview_from_cli(args)
+
+
+def handle_bench(args):
+    from .bench.run import bench_from_cli
+
+    bench_from_cli(args)
+
+
 def handle_cst_gui(args):
     from .cst_gui import MainApp
 
@@ -53,6 +105,18 @@ def main():
     generate_parser = get_args(generate_parser)
     generate_parser.set_defaults(handle=handle_generate, parser=generate_parser)
 
+    # handle sampling plan for generate
+    plan_parser = subparsers.add_parser('plan', help='write the experiment table for generate')
+    plan_parser = get_plan_args(plan_parser)
+    plan_parser.set_defaults(handle=handle_plan, parser=plan_parser)
+
+    # handle re-gridding a dataset from raw mesh data
+    regrid_parser = subparsers.add_parser(
+        'regrid', help='interpolate images of any resolution from saved raw mesh data'
+    )
+    regrid_parser = get_regrid_args(regrid_parser)
+    regrid_parser.set_defaults(handle=handle_regrid, parser=regrid_parser)
+
     # handle cst to simulation (with gui)
     cst_gui_parser = subparsers.add_parser(
         'cst_gui', help='cst parameters to simulation'
@@ -60,6 +124,34 @@ def main():
     cst_gui_parser = get_args(cst_gui_parser)
     cst_gui_parser.set_defaults(handle=handle_cst_gui, parser=cst_gui_parser)
 
+    # handle fitting cst parameters of the airfoil database
+    fit_cst_parser = subparsers.add_parser(
+        'fit-cst', help='fit cst parameters of airfoil database'
+    )
+    fit_cst_parser = get_fit_args(fit_cst_parser)
+    fit_cst_parser.set_defaults(handle=handle_fit_cst, parser=fit_cst_parser)
+
+    # handle packing airfoil database
+    build_db_parser = subparsers.add_parser(
+        'build-db', help='pack airfoil database into one indexed file'
+    )
+    build_db_parser = get_db_args(build_db_parser)
+    build_db_parser.set_defaults(handle=handle_build_db, parser=build_db_parser)
+
+    # handle building the preview index of the gui from a dataset
+    build_preview_parser = subparsers.add_parser(
+        'build-preview', help='add a generated dataset to the preview index of the gui'
+    )
+    build_preview_parser = get_preview_args(build_preview_parser)
+    build_preview_parser.set_defaults(handle=handle_build_preview, parser=build_preview_parser)
+
+    # handle benchmark with fake gmsh and OpenFOAM
+    bench_parser = subparsers.add_parser(
+        'bench', help='benchmark generate and postprocess with fake gmsh and OpenFOAM'
+    )
+    bench_parser = get_bench_args(bench_parser)
+    bench_parser.set_defaults(handle=handle_bench, parser=bench_parser)
+
     args, _ = parser.parse_known_args()
 
     if hasattr(args, 'handle'):
@@ -1,11 +1,81 @@
-import numpy as np
-from math import pi, cos, factorial
+from functools import lru_cache
+from math import factorial, pi
+
 import matplotlib.pyplot as plt
+import numpy as np
+
+
+@lru_cache(maxsize=32)
+def cst_basis(n, N):
+    """cached x distribution and Bernstein basis for n-th order CST with N points
+
+    返回的点已经按逆时针排列(从尾缘出发经上表面到前缘, 再经下表面回到尾缘, 首尾闭合)
+
+    :n: order of Bernstein polynomials, len(w) - 1
+    :N: number of points on the airfoil, before closing
+    :returns: (x, basis, sign)
+        x: (N+1,) x coordinate of every point
+        basis: (2(n+1), N+1) block basis, rows [:n+1] for wu, rows [n+1:] for wl
+        sign: (N+1,) +1 on upper surface, -1 on lower surface, used for dz
+    """
+    # cosine distribution, x from 1 to 0 (lower surface) then 0 to 1 (upper surface)
+    x = 0.5 * (np.cos(2 * pi / N * np.arange(N)) + 1)
+    center_loc = int(np.argmin(x))  # Used to separate upper and lower surfaces
+    upper = np.arange(N) >= center_loc
+
+    K = np.array(
+        [factorial(n) / (factorial(i) * factorial(n - i)) for i in range(n + 1)]
+    )
+    j = np.arange(n + 1)[:, None]
+    bernstein = K[:, None] * x ** j * (1 - x) ** (n - j)
+
+    basis = np.zeros((2 * (n + 1), N))
+    basis[: n + 1, upper] = bernstein[:, upper]
+    basis[n + 1 :, ~upper] = bernstein[:, ~upper]
+    sign = np.where(upper, 1.0, -1.0)
+
+    # 改成逆时针排列, 并闭合
+    order = np.r_[np.arange(N)[::-1], N - 1]
+    x, basis, sign = x[order], basis[:, order], sign[order]
+    for a in (x, basis, sign):
+        a.flags.writeable = False
+    return x, basis, sign
+
+
+def cst_batch(wu, wl, N1=0.5, N2=1.0, dz=0.0, N=200):
+    """calculate airfoil coordinates of a batch of CST parameters at once
+
+    :wu: (B, n+1) upper surface weights
+    :wl: (B, n+1) lower surface weights
+    :N1, N2, dz: scalar or (B,) class function exponents and trailing edge gap
+    :N: number of points on each airfoil
+    :returns: (B, N+1, 2) coordinates, same layout as CST_shape.coord
+
+    """
+    wu = np.atleast_2d(np.asarray(wu, dtype=float))
+    wl = np.atleast_2d(np.asarray(wl, dtype=float))
+    if wu.shape != wl.shape:
+        raise ValueError(f"wu and wl shape mismatch: {wu.shape} vs {wl.shape}")
+    B, n = wu.shape[0], wu.shape[1] - 1
+    N1 = np.broadcast_to(np.asarray(N1, dtype=float), (B,))[:, None]
+    N2 = np.broadcast_to(np.asarray(N2, dtype=float), (B,))[:, None]
+    dz = np.broadcast_to(np.asarray(dz, dtype=float), (B,))[:, None]
+
+    x, basis, sign = cst_basis(n, N)
+    # Shape function, one matrix product for the whole batch
+    S = np.concatenate([wu, wl], axis=1) @ basis
+    # Class function
+    C = x ** N1 * (1 - x) ** N2
+
+    coord = np.empty((B, N + 1, 2))
+    coord[:, :, 0] = x
+    coord[:, :, 1] = C * S + x * sign * dz
+    return coord
 
 
 class CST_shape(object):
     def __init__(self, wu=[1, 1, 1], wl=[-1, -1, -1], N1=0.5, N2=1.0, dz=0, N=200):
-        self.set_params(wl, wu, N1, N2, dz, N)
+        self.set_params(wu, wl, N1, N2, dz, N)
         self.cal_coord()
 
     def set_params(self, wu=[1, 1, 1], wl=[-1, -1, -1], N1=0.5, N2=1.0, dz=0, N=200):
@@ -22,75 +92,10 @@ class CST_shape(object):
     def cal_coord(self):
         """function to calculate airfoil coordinate [x, y]"""
         wl, wu, N1, N2, dz, N = self.get_params()
-
-        # Create x coordinate
-        x = np.ones((N, 1))
-        y = np.zeros((N, 1))
-        zeta = np.zeros((N, 1))
-
-        for i in range(0, N):
-            zeta[i] = 2 * pi / N * i
-            x[i] = 0.5 * (cos(zeta[i]) + 1)
-
-        center_loc = np.where(
-            x == np.min(x)
-        )  # Used to separate upper and lower surfaces
-        center_loc = center_loc[0][0]
-
-        xl = np.zeros(center_loc)
-        xu = np.zeros(N - center_loc)
-
-        for i in range(len(xl)):
-            xl[i] = x[i]  # Lower surface x-coordinates
-        for i in range(len(xu)):
-            xu[i] = x[i + center_loc]  # Upper surface x-coordinates
-
-        yl = self.__ClassShape(
-            wl, xl, N1, N2, -dz
-        )  # Call ClassShape function to determine lower surface y-coordinates
-        yu = self.__ClassShape(
-            wu, xu, N1, N2, dz
-        )  # Call ClassShape function to determine upper surface y-coordinates
-
-        y = np.concatenate([yl, yu])  # Combine upper and lower y coordinates
-        y = y.reshape(-1, 1)
-
-        # 改成逆时针排列
-        x = x[::-1]
-        y = y[::-1]
-        coord = np.concatenate([x, y], axis=1)
-        self.coord = np.concatenate([coord, coord[0:1]], axis=0)
+        self.coord = cst_batch([wu], [wl], N1, N2, dz, N)[0]
 
         return self.coord
 
-    def __ClassShape(self, w, x, N1, N2, dz):
-        """Function to calculate class and shape function"""
-
-        # Class function; taking input of N1 and N2
-        C = np.zeros(len(x))
-        for i in range(len(x)):
-            C[i] = x[i] ** N1 * ((1 - x[i]) ** N2)
-
-        # Shape function; using Bernstein Polynomials
-        n = len(w) - 1  # Order of Bernstein polynomials
-
-        K = np.zeros(n + 1)
-        for i in range(0, n + 1):
-            K[i] = factorial(n) / (factorial(i) * (factorial((n) - (i))))
-
-        S = np.zeros(len(x))
-        for i in range(len(x)):
-            S[i] = 0
-            for j in range(0, n + 1):
-                S[i] += w[j] * K[j] * x[i] ** (j) * ((1 - x[i]) ** (n - (j)))
-
-        # Calculate y output
-        y = np.zeros(len(x))
-        for i in range(len(y)):
-            y[i] = C[i] * S[i] + x[i] * dz
-
-        return y
-
     def writeToFile(self, fname):
         """write [x, y] to file"""
         with open(fname, "w") as f:
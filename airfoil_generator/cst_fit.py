@@ -0,0 +1,158 @@
+import os
+
+import numpy as np
+
+from .cst import cst_basis, cst_batch
+from .utils.utils import normalize_airfoil, read_airfoil
+
+
+def resample_airfoils(coords, n=5, N=200):
+    """把一组翼型插值到CST的余弦分布x坐标上
+
+    :coords: list of (n_i, 2) Selig顺序的坐标, 点数可以不同
+    :n: CST阶数
+    :N: CST点数
+    :returns: (N+1, B) 的y坐标, 与cst_basis(n, N)的x一一对应
+
+    """
+    x, _, sign = cst_basis(n, N)
+    upper_mask = sign > 0
+    Y = np.empty((N + 1, len(coords)))
+    for i, coord in enumerate(coords):
+        upper, lower = normalize_airfoil(coord)
+        Y[upper_mask, i] = np.interp(x[upper_mask], upper[:, 0], upper[:, 1])
+        Y[~upper_mask, i] = np.interp(x[~upper_mask], lower[:, 0], lower[:, 1])
+    return Y
+
+
+def fit_cst(Y, n=5, N=200, N1=0.5, N2=1.0):
+    """固定N1, N2时, 用最小二乘拟合一批翼型的CST参数
+
+    y = C(x) * S(x) + x * dz 对wu, wl, dz是线性的, 所以所有翼型共用一个设计矩阵,
+    一次lstsq即可求出整批的参数
+
+    :Y: (N+1, B) resample_airfoils的输出
+    :returns: dict, wu/wl为(B, n+1), dz/rmse为(B,)
+
+    """
+    x, basis, sign = cst_basis(n, N)
+    C = x**N1 * (1 - x) ** N2
+    A = np.concatenate([(C * basis).T, (x * sign)[:, None]], axis=1)
+
+    W, _, _, _ = np.linalg.lstsq(A, Y, rcond=None)
+    rmse = np.sqrt(np.mean((A @ W - Y) ** 2, axis=0))
+    B = Y.shape[1]
+    return {
+        "wu": W[: n + 1].T,
+        "wl": W[n + 1 : 2 * (n + 1)].T,
+        "N1": np.full(B, N1),
+        "N2": np.full(B, N2),
+        "dz": W[-1],
+        "rmse": rmse,
+    }
+
+
+def fit_cst_class(Y, n=5, N=200, N1_range=(0.5,), N2_range=(1.0,)):
+    """在N1, N2的候选值上逐一做批量拟合, 每个翼型取误差最小的一组"""
+    best = None
+    for N1 in N1_range:
+        for N2 in N2_range:
+            res = fit_cst(Y, n, N, N1, N2)
+            if best is None:
+                best = res
+                continue
+            better = res["rmse"] < best["rmse"]
+            for k, v in res.items():
+                best[k][better] = v[better]
+    return best
+
+
+def fit_database(dirs, n=5, N=200, N1_range=(0.5,), N2_range=(1.0,)):
+    """拟合翼型数据库中所有.dat文件的CST参数
+
+    :dirs: 翼型数据库路径列表
+    :returns: 参数表, dict of arrays, 每一行对应一个翼型
+
+    """
+    names, coords = [], []
+    for dir in dirs:
+        for fname in sorted(os.listdir(dir)):
+            if not fname.endswith(".dat"):
+                continue
+            try:
+                _, coord = read_airfoil(os.path.join(dir, fname))
+            except ValueError as e:
+                print(f"\tskip {fname}: {e}")
+                continue
+            names.append(os.path.splitext(fname)[0])
+            coords.append(coord)
+
+    Y = resample_airfoils(coords, n, N)
+    table = fit_cst_class(Y, n, N, N1_range, N2_range)
+    table["name"] = np.array(names)
+    return table
+
+
+def save_table(fname, table):
+    np.savez(fname, **table)
+
+
+def load_table(fname):
+    with np.load(fname) as data:
+        return {k: data[k] for k in data.files}
+
+
+def table_features(table):
+    """参数表中每个翼型的特征向量 [wu, wl, N1, N2, dz]"""
+    return np.concatenate(
+        [
+            table["wu"],
+            table["wl"],
+            table["N1"][:, None],
+            table["N2"][:, None],
+            table["dz"][:, None],
+        ],
+        axis=1,
+    )
+
+
+def find_duplicates(table, tol=1e-3):
+    """找出参数几乎相同的翼型对
+
+    :tol: 特征向量之间的欧氏距离阈值
+    :returns: list of (name_i, name_j)
+
+    """
+    from scipy.spatial import cKDTree
+
+    tree = cKDTree(table_features(table))
+    pairs = sorted(tree.query_pairs(tol))
+    return [(table["name"][i], table["name"][j]) for i, j in pairs]
+
+
+def nearest(table, features, k=1):
+    """在参数表中搜索与给定特征向量最接近的k个翼型, 返回名称"""
+    from scipy.spatial import cKDTree
+
+    tree = cKDTree(table_features(table))
+    _, idx = tree.query(np.atleast_2d(features), k=k)
+    return table["name"][idx]
+
+
+def table_coords(table, N=200):
+    """用参数表重建所有翼型的坐标, (B, N+1, 2)"""
+    return cst_batch(table["wu"], table["wl"], table["N1"], table["N2"], table["dz"], N)
+
+
+def fit_from_cli(args):
+    table = fit_database(
+        args.fit_database, args.cst_order, args.cst_points, args.fit_N1, args.fit_N2
+    )
+    save_table(args.fit_output, table)
+    print(f"fitted {len(table['name'])} airfoils, saved to {args.fit_output}")
+    print(
+        f"rmse: mean {table['rmse'].mean():.2e}, max {table['rmse'].max():.2e} "
+        f"({table['name'][np.argmax(table['rmse'])]})"
+    )
+    duplicates = find_duplicates(table, args.dedupe_tol)
+    print(f"{len(duplicates)} near-identical pairs (tol={args.dedupe_tol})")
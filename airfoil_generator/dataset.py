@@ -0,0 +1,246 @@
+"""按样本随机读取generate输出的数据集, 用于训练时的批量读取"""
+import json
+import os
+import struct
+import threading
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import scipy.io as scio
+
+from .writer import flatten_sample, sample_files, unflatten_sample
+
+# zip文件中每个成员的本地文件头, 固定30字节, 之后是文件名和扩展字段
+_LOCAL_HEADER = struct.Struct("<4s22xHH")
+
+
+def npz_members(fname):
+    """没有压缩的.npz中每个数组在文件中的位置
+
+    :returns: {数组名: (dtype, shape, fortran_order, 数据的偏移)}, 压缩的成员不包括在内
+    """
+    members = {}
+    with open(fname, "rb") as f, zipfile.ZipFile(f) as zf:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED or not info.filename.endswith(".npy"):
+                continue
+            f.seek(info.header_offset)
+            magic, name_len, extra_len = _LOCAL_HEADER.unpack(f.read(_LOCAL_HEADER.size))
+            if magic != b"PK\x03\x04":
+                continue
+            f.seek(info.header_offset + _LOCAL_HEADER.size + name_len + extra_len)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            elif version == (2, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            else:
+                continue
+            if dtype.hasobject:
+                continue
+            members[info.filename[: -len(".npy")]] = (dtype, shape, fortran, f.tell())
+    return members
+
+
+def parse_key(key):
+    """keys中的一项, "name" 或 (name, 选择), 选择作用在样本的第0维, 如data_img的通道"""
+    if isinstance(key, tuple):
+        return key[0], key[1]
+    return key, None
+
+
+def nested_get(data_dict, key):
+    """从嵌套字典中取出展开后的键, 如 "raw_mesh_data/cell_x" """
+    value = data_dict
+    for name in key.split("/"):
+        value = value[name]
+    return value
+
+
+def _select(value, sel):
+    value = np.asarray(value)
+    return value if sel is None else value[sel]
+
+
+def _collate(values):
+    """形状相同时堆叠成一个数组, 否则返回列表(如网格数量不同的raw_mesh_data)"""
+    shapes = {np.shape(v) for v in values}
+    if len(shapes) == 1:
+        return np.stack(values)
+    return values
+
+
+class Dataset(object):
+    """generate输出的数据集, 建立一次索引后可以按位置随机读取
+
+    支持三种存储:
+    shard: 没有压缩的分片直接内存映射, 只读取请求的数组和通道; 压缩的分片按数组解压并缓存最近的分片
+    npz: 每个样本一个pickle的压缩文件, 只能整体读取后再取出需要的数组
+    mat: 每个样本一个.mat, 只读取请求的顶层变量
+
+    ds[i] 返回第i个样本的数据字典, 与iter_dataset相同; ds.ids[i] 是它的样本编号.
+    ds.get(indices, keys) 批量读取, ds.batches(...) 在后台线程中预读之后的批.
+    :cache_size: 压缩分片时缓存的(分片, 数组)数量
+    """
+
+    def __init__(self, output_dir, prefix="sample", cache_size=8):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.cache_size = cache_size
+        self._lock = threading.Lock()
+        self._maps = {}
+        self._cache = OrderedDict()
+
+        index_path = f"{output_dir}/{prefix}index.json"
+        if os.path.exists(index_path):
+            with open(index_path, "rt") as f:
+                index = json.load(f)
+            self.format = "shard"
+            self.shards = [f"{output_dir}/{shard['file']}" for shard in index["shards"]]
+            # 样本编号 -> (分片, 在分片中的位置)
+            location = {}
+            for s, shard in enumerate(index["shards"]):
+                for i, n in enumerate(shard["samples"]):
+                    location[n] = (s, i)
+            self.ids = sorted(location)
+            self._location = [location[n] for n in self.ids]
+            self._offsets = {}
+        else:
+            files = sample_files(output_dir, prefix)
+            self.format = "npz" if any("npz" in v for v in files.values()) else "mat"
+            self.ids = sorted(n for n in files if self.format in files[n])
+            self._files = [files[n][self.format] for n in self.ids]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = range(len(self))[i]
+        if self.format == "shard":
+            return unflatten_sample({key: self._shard_value(i, key, None) for key in self.keys()})
+        return self._read_file(i)
+
+    def keys(self):
+        """数据集中展开后的键, 如 "data_img", "raw_mesh_data/cell_x" """
+        if self.format == "shard":
+            if not self.shards:
+                return []
+            with np.load(self.shards[0]) as shard:
+                return [k for k in shard.files if k != "__index__" and not k.endswith(".offsets")]
+        if not self.ids:
+            return []
+        return list(flatten_sample(self._read_file(0)))
+
+    def get(self, indices, keys=None):
+        """读取一批样本中的部分数组
+
+        :indices: 样本的位置
+        :keys: 展开后的键, 或 (键, 选择), 如 [("data_img", slice(3, 6)), "freestream"], 默认全部
+        :returns: {键: (len(indices), ...)的数组}, 各样本形状不同时为列表
+        """
+        keys = self.keys() if keys is None else keys
+        indices = [range(len(self))[i] for i in np.ravel(indices).tolist()]
+        batch = {}
+        if self.format == "shard":
+            for key in keys:
+                name, sel = parse_key(key)
+                batch[name] = _collate([self._shard_value(i, name, sel) for i in indices])
+            return batch
+
+        samples = [self._read_file(i, [parse_key(key)[0] for key in keys]) for i in indices]
+        for key in keys:
+            name, sel = parse_key(key)
+            batch[name] = _collate([_select(nested_get(d, name), sel) for d in samples])
+        return batch
+
+    def batches(self, batch_indices, keys=None, workers=4, depth=None):
+        """按顺序产生 get(indices, keys) 的结果, 后台线程同时读取之后的depth批
+
+        文件读取, 解压和内存映射的复制都会释放GIL, 多个线程可以并行读取
+        :batch_indices: 每一批样本的位置, 如打乱后切分的索引
+        :depth: 同时读取的批数, 默认为2 * workers
+        """
+        depth = 2 * workers if depth is None else depth
+        batch_indices = iter(batch_indices)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = deque()
+            for indices in batch_indices:
+                futures.append(pool.submit(self.get, indices, keys))
+                if len(futures) >= depth:
+                    break
+            while futures:
+                batch = futures.popleft().result()
+                for indices in batch_indices:
+                    futures.append(pool.submit(self.get, indices, keys))
+                    break
+                yield batch
+
+    def _read_file(self, i, names=None):
+        fname = self._files[i]
+        if self.format == "npz":
+            with np.load(fname, allow_pickle=True) as data:
+                return data["data"].item()
+        variables = None if names is None else sorted({name.split("/")[0] for name in names})
+        data = scio.loadmat(fname, variable_names=variables, simplify_cells=True)
+        return {k: v for k, v in data.items() if not k.startswith("__")}
+
+    def _shard_value(self, i, key, sel):
+        s, j = self._location[i]
+        offsets = self._shard_offsets(s, key)
+        start, stop = offsets[j], offsets[j + 1]
+        if sel is not None:
+            # 选择在样本内部, 换算成分片中的行, 只复制需要的部分
+            rows = np.arange(start, stop)[sel]
+            if isinstance(sel, slice) and rows.size and sel.step in (None, 1):
+                return np.array(self._shard_array(s, key)[rows[0] : rows[-1] + 1])
+            return np.array(self._shard_array(s, key)[rows])
+        return np.array(self._shard_array(s, key)[start:stop])
+
+    def _shard_offsets(self, s, key):
+        offsets = self._offsets.get((s, key))
+        if offsets is None:
+            offsets = np.asarray(self._shard_array(s, f"{key}.offsets"))
+            self._offsets[(s, key)] = offsets
+        return offsets
+
+    def _shard_array(self, s, key):
+        """分片中的一个数组, 没有压缩时内存映射, 否则解压后放入缓存"""
+        with self._lock:
+            members = self._maps.get(s)
+            if members is None:
+                members = self._maps[s] = {"layout": npz_members(self.shards[s]), "arrays": {}}
+            array = members["arrays"].get(key)
+            if array is None and key in members["layout"]:
+                dtype, shape, fortran, offset = members["layout"][key]
+                if int(np.prod(shape)) == 0:
+                    array = np.zeros(shape, dtype=dtype)
+                else:
+                    array = np.memmap(
+                        self.shards[s],
+                        dtype=dtype,
+                        mode="r",
+                        offset=offset,
+                        shape=shape,
+                        order="F" if fortran else "C",
+                    )
+                members["arrays"][key] = array
+            if array is not None:
+                return array
+
+            array = self._cache.get((s, key))
+            if array is not None:
+                self._cache.move_to_end((s, key))
+                return array
+        # 在锁外解压, 其他线程可以同时读取别的分片
+        with np.load(self.shards[s]) as shard:
+            array = shard[key]
+        with self._lock:
+            self._cache[(s, key)] = array
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return array
+
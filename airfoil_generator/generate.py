@@ -1,21 +1,346 @@
+import argparse
+import copy
+import functools
 import math
-import os
+import multiprocessing as mp
 import random
+import shutil
 import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import numpy as np
-import scipy.io as scio
 
+from . import trace
+from .manifest import Manifest, manifest_path
+from .pipeline import Pipeline, stage_results
+from .plan import load_plan
+from .process.meshcache import MeshCache
+from .process.monitor import RESIDUALS_FILE, ResidualMonitor, run_monitored
 from .process.postprocess import (coord2img, get_airfoil_data, get_grid_data,
-                                  get_raw_mesh)
-from .process.preprocess import (gen_mesh, set_decomposefile, set_runfile,
-                                 set_transfile, set_ufile)
-from .utils.utils import makeDirs, read_database
+                                  get_raw_mesh, get_residuals)
+from .process.preprocess import (clean_decomposed, decompose_fields,
+                                 decomposition_valid, gen_mesh, mesh_key,
+                                 remove_times, save_decomposition,
+                                 set_decomposefile, set_runfile,
+                                 set_sample_points, set_transfile, set_ufile)
+from .process.reader import SampleData, latest_time
+from .process.supervisor import StageFailed, Supervisor
+from .process.warmstart import FIELD_SCALING, WarmStartStore
+from .utils.database import open_database
+from .utils.utils import makeDirs, read_airfoil, read_database
+from .writer import get_writer
 
 
-def generate_from_cli(args):
+def sample_params(args, files, n):
+    """抽取第n个样本的来流和翼型
+
+    随机数只由(seed, n)决定, 与运行顺序, 进程数量和之前跳过的样本无关.
+    指定了plan时直接使用实验表的第n行, 包括这个样本的粘度nu
+    """
+    if args.plan:
+        row = load_plan(args.plan)[n]
+        return {"length": row["length"], "angle": row["angle"], "fname": row["fname"], "nu": row["nu"]}
+    rng = random.Random(f"{args.seed}:{n}")
+    # 设置流场参数
+    length = rng.uniform(args.freestream_length[0], args.freestream_length[1])
+    angle = rng.uniform(args.freestream_angle[0], args.freestream_angle[1])  # 单位：度
+    if args.fixed_airfoil:
+        fname = f"{args.airfoil_name}.dat"
+    else:
+        fname = rng.choice(files)
+    return {"length": length, "angle": angle, "fname": fname}
+
+
+def run_sample(n, case_dir, params, args, mpirun_args="", mesh_cache=None, warm_start=None):
+    """在case_dir中完成第n个样本的前处理, 画网格, 仿真和后处理
+
+    所有路径都是显式传入的, 不改变全局工作路径, 因此可以在多个进程中同时运行
+    :returns: (数据字典, 错误), 失败时数据字典为None, 错误同solve_supervised
+
+    """
+    freestream, error = solve_supervised(
+        n, case_dir, params, args, mpirun_args, mesh_cache, warm_start
+    )
+    if freestream is None:
+        return None, error
+    return postprocess_sample(case_dir, freestream, args, params.get("nu")), None
+
+
+def fallback_args(args, warm_start, fallback):
+    """重试时使用的参数和热启动, 重试时总是重新分解网格
+
+    :fallback: retry 使用相同的设置, cold 不使用热启动, serial 不并行计算
+    """
+    if fallback is None:
+        return args, warm_start
+    args = copy.copy(args)
+    args.reuse_decomposition = False
+    if fallback == "serial":
+        args.parallel_enable = False
+    elif fallback == "cold":
+        warm_start = None
+    return args, warm_start
+
+
+def solve_supervised(n, case_dir, params, args, mpirun_args="", mesh_cache=None, warm_start=None):
+    """求解第n个样本, 外部命令失败或超时后按args.fallback依次重试
+
+    所有尝试的输出都记录在样本的日志中, 结束后保存为 {log_dir}/{output_prefix}{n}.log,
+    失败的样本为 .failed.log. 网格生成失败时不重试.
+    :returns: (来流, 错误), 成功时错误为None; 失败时来流为None, 错误为失败命令的退出状态
+    """
+    supervisor = Supervisor(Path(case_dir) / "foam.log", args.stage_timeout)
+    freestream, error = None, None
+    for fallback in [None] + list(args.fallback):
+        if fallback is not None:
+            print(f"\tretrying with fallback {fallback}")
+        run_args, run_warm_start = fallback_args(args, warm_start, fallback)
+        try:
+            freestream = solve_sample(
+                case_dir, params, run_args, mpirun_args, mesh_cache, run_warm_start, supervisor
+            )
+        except StageFailed as e:
+            print(f"\t{e}")
+            error = dict(e.status, stage=e.stage)
+            continue
+        error = None
+        if freestream is None:
+            # 网格生成失败, 记下阶段, resume时只跳过确定的网格失败
+            error = dict(supervisor.last_failure() or {}, stage="gen_mesh")
+        break
+    if args.log_dir:
+        supervisor.archive(
+            args.log_dir, f"{args.output_prefix}{n}", args.log_keep, failed=freestream is None
+        )
+    return freestream, error
+
+
+def solve_sample(
+    case_dir, params, args, mpirun_args="", mesh_cache=None, warm_start=None, supervisor=None
+):
+    """前处理, 画网格和仿真, 返回来流 [fsX, fsY, length, angle], 网格生成失败时返回None
+
+    :warm_start: WarmStartStore, 从同一网格上最接近的已收敛解开始计算
+    :supervisor: 运行外部命令的Supervisor, 默认新建一个, 日志为case_dir/foam.log
+    :raises StageFailed: 外部命令返回非0或超时, 或求解器没有写出结果
+    """
     here = Path(".").absolute()
+    case_dir = Path(case_dir).absolute()
+    if supervisor is None:
+        supervisor = Supervisor(case_dir / "foam.log", args.stage_timeout)
+    length, angle = params["length"], params["angle"]
+    fsX = math.cos(angle / 180 * math.pi) * length
+    fsY = math.sin(angle / 180 * math.pi) * length
+    # freestream = {
+    #     "length": length,
+    #     "angle": angle,
+    #     "fsX": fsX,
+    #     "fsY": fsY,
+    # }
+    freestream = np.array([fsX, fsY, length, angle])
+    print("freestream: ", freestream)
+    if warm_start is not None:
+        # 上一个样本中断时0/中可能还是热启动的初值
+        warm_start.restore(case_dir)
+    with trace.stage("set_ufile"):
+        set_ufile(case_dir, fsX, fsY)
+    if "nu" in params:
+        with trace.stage("set_transfile"):
+            set_transfile(case_dir, args.rho, params["nu"])
+        print(f"\tUsing nu {params['nu']:.3g}")
+    print(f"\tUsing len {length:.2f} angle {angle:.2f}")
+    print(f"\tResulting freestream vel x,y: {fsX:.2f},{fsY:.2f}")
+
+    # 画网格
+    with trace.stage("load_airfoil"):
+        if args.airfoil_db:
+            print(f"\tusing {params['fname']} from {args.airfoil_db}")
+            coord = np.array(open_database(args.airfoil_db)[params["fname"]])
+        else:
+            fpath = here / f"{args.airfoil_database}/{params['fname']}"
+            print(f"\tusing {fpath}")
+            _, coord = read_airfoil(str(fpath))
+
+    with trace.stage("gen_mesh"):
+        ret = gen_mesh(coord, case_dir, mesh_cache, supervisor.run)
+    if ret != 0:
+        print("\tmesh generation failed, aborting")
+        return None
+
+    source = None
+    if warm_start is not None:
+        key = mesh_key(case_dir)
+        with trace.stage("warm_start"):
+            source = warm_start.apply(case_dir, key, angle, length)
+        if source is not None:
+            print(f"\twarm start from angle {source[0]:.2f} len {source[1]:.2f}")
+
+    steps = set_runfile(
+        case_dir,
+        args.subdomains,
+        args.parallel_enable,
+        mpirun_args,
+        reconstruct_fields(case_dir, warm_start is not None),
+    )
+    # 同一网格上的样本复用processor*中分解好的网格, 只需写入新的初值
+    reuse = args.parallel_enable and args.reuse_decomposition
+    decomposed = reuse and decomposition_valid(case_dir, args.subdomains)
+    # 运行仿真, 逐步运行Allrun以便分别计时
+    with trace.stage("Allclean", subprocess=True):
+        if decomposed:
+            clean_decomposed(case_dir)
+        else:
+            supervisor.run("sh ./Allclean >> foam.log", case_dir)
+            remove_times(case_dir)
+    iterations = None
+    try:
+        for step in steps:
+            if step == "decomposePar" and decomposed:
+                print("\treusing decomposition")
+                with trace.stage("decompose_fields", subprocess=True):
+                    ret = decompose_fields(case_dir, supervisor.run)
+                if ret != 0:
+                    raise supervisor.failure("decompose_fields")
+                continue
+            if step != "solver":
+                with trace.stage(step, subprocess=True):
+                    ret = supervisor.run(f"sh ./Allrun {step} >> foam.log", case_dir)
+                if ret != 0:
+                    raise supervisor.failure(step)
+                if step == "decomposePar" and reuse:
+                    save_decomposition(case_dir)
+                continue
+            # 求解时监控残差, 满足停止条件后让求解器写出结果并退出
+            monitor = ResidualMonitor(
+                f"{case_dir}/foam.log",
+                args.residual_tol,
+                args.plateau_window,
+                args.plateau_tol,
+                args.min_iters,
+            )
+            with trace.stage(step, subprocess=True):
+                ret = run_monitored(
+                    f"sh ./Allrun {step} >> foam.log",
+                    case_dir,
+                    monitor,
+                    args.monitor_interval,
+                    args.stop_timeout,
+                    functools.partial(supervisor.run, timeout=args.solver_timeout),
+                )
+            monitor.save(f"{case_dir}/{RESIDUALS_FILE}")
+            iterations = len(monitor.rows) or None
+            print(f"\tsolver ran {len(monitor.rows)} iterations")
+            # 要求停止后没有及时退出而被结束的求解器已经写出了结果
+            if supervisor.last["timed_out"] or (ret != 0 and monitor.stop_reason is None):
+                raise supervisor.failure(step)
+    finally:
+        if warm_start is not None:
+            warm_start.restore(case_dir)
+
+    if latest_time(case_dir) is None:
+        # 求解器正常退出但没有写出结果, 与网格失败不同, 可以重试
+        print("\tsolver wrote no results, aborting")
+        raise StageFailed("solver", dict(supervisor.last, reason="wrote no results"))
+
+    if warm_start is not None:
+        with trace.stage("warm_start"):
+            saved = warm_start.record(case_dir, key, angle, length, iterations, source)
+        if saved is not None:
+            print(f"\t{iterations} iterations, saved {saved:.0f} iterations")
+
+    # 后处理
+    if args.output_raw_mesh:
+        with trace.stage("postProcess", subprocess=True):
+            ret = supervisor.run("postProcess -func writeCellCentres -noZero >> foam.log", case_dir)
+        if ret != 0:
+            raise supervisor.failure("postProcess")
+    if args.output_airfoil_boundary:
+        with trace.stage("postProcess", subprocess=True):
+            ret = supervisor.run("postProcess -func 'components(U)' -noZero >> foam.log", case_dir)
+        if ret != 0:
+            raise supervisor.failure("postProcess")
+
+    return freestream
+
+
+def reconstruct_fields(case_dir, warm_start=False):
+    """并行计算后需要重构的场, 后处理只用到U和p, 热启动还需要保存其他场"""
+    fields = ["U", "p"]
+    if warm_start:
+        fields += [
+            name
+            for name in FIELD_SCALING
+            if name not in fields and Path(f"{case_dir}/0/{name}").exists()
+        ]
+    return fields
+
+
+def postprocess_sample(case_dir, freestream, args, nu=None):
+    """从case_dir中的仿真结果生成数据字典
+
+    :nu: 这个样本的运动粘度, 按实验表生成时保存到数据中
+    """
+    fsX, fsY = freestream[0], freestream[1]
+    # 外部流场，图片形式
+    case_args = copy.copy(args)
+    case_args.case_dir = str(case_dir)
+    data = SampleData(case_dir)
+    with trace.stage("coord2img"):
+        data_img = coord2img(fsX, fsY, case_args, data)
+    with trace.stage("get_grid_data"):
+        grid_data = get_grid_data(case_args, data)
+
+    data_dict = {
+        "freestream": freestream,
+        "data_img": data_img,
+        "grid_data": grid_data,
+    }
+
+    if args.output_raw_mesh:
+        with trace.stage("get_raw_mesh"):
+            raw_mesh_data = get_raw_mesh(case_dir)
+        data_dict.update({"raw_mesh_data": raw_mesh_data})
+    if args.output_airfoil_boundary:
+        with trace.stage("get_airfoil_data"):
+            airfoil_data = get_airfoil_data(case_dir, data)
+        data_dict.update({"airfoil_data": airfoil_data})
+
+    if nu is not None:
+        data_dict.update({"nu": np.array(nu)})
+
+    residuals = get_residuals(case_dir)
+    if residuals is not None:
+        data_dict.update({"residuals": residuals})
+
+    return data_dict
+
+
+def get_mesh_cache(args):
+    if not args.mesh_cache:
+        return None
+    return MeshCache(args.mesh_cache, args.mesh_cache_size * 1024**2)
+
+
+def get_warm_start(args):
+    if not args.warm_start:
+        return None
+    return WarmStartStore(
+        args.warm_start_dir,
+        args.warm_start_size * 1024**2,
+        args.freestream_angle,
+        args.freestream_length,
+    )
+
+
+def list_airfoils(args):
+    """可选的翼型文件名列表"""
+    if args.airfoil_db:
+        return [f"{name}.dat" for name in open_database(args.airfoil_db).names]
+    return read_database(args.airfoil_database)
+
+
+def generate_from_cli(args):
     case_dir = Path(args.case_dir).absolute()
     print("case_dir: ", case_dir)
     makeDirs(args.output_dir)
@@ -23,85 +348,191 @@ def generate_from_cli(args):
     set_transfile(case_dir, args.rho, args.nu)
     if args.parallel_enable:
         set_decomposefile(case_dir, args.subdomains)
-    files = read_database(args.airfoil_database)
+    set_sample_points(
+        case_dir,
+        (*args.sample_xrange, args.res),
+        (*args.sample_yrange, args.res),
+    )
+    files = list_airfoils(args)
+
+    n_samples = args.n_samples
+    if args.plan:
+        n_samples = len(load_plan(args.plan))
+        print(f"plan: {n_samples} samples from {args.plan}")
 
-    for n in range(args.n_samples):
+    manifest = Manifest(manifest_path(args), args.seed, args.resume)
+    done = manifest.completed()
+    todo = [n for n in range(n_samples) if n not in done]
+    if done:
+        print(f"resume: {len(done)} samples done, {len(todo)} left")
+
+    tracer = trace.open_tracer(args)
+    t_start = time.time()
+    writer = get_writer(args, on_saved=manifest.saved)
+    try:
+        if args.workers > 1:
+            generate_parallel(args, files, writer, manifest, todo)
+        elif args.pipeline_depth > 0:
+            generate_pipelined(args, files, writer, manifest, todo)
+        else:
+            generate_serial(args, files, writer, manifest, todo)
+    finally:
+        writer.close()
+        tracer.print_summary()
+        tracer.close()
+        warm_start = get_warm_start(args)
+        if warm_start is not None:
+            warm_start.report(since=t_start)
+
+
+def generate_serial(args, files, writer, manifest, todo):
+    case_dir = Path(args.case_dir).absolute()
+    mesh_cache = get_mesh_cache(args)
+    warm_start = get_warm_start(args)
+    for n in todo:
         t0 = time.time()
         print(f"\nRun {n}:")
 
-        # 设置流场参数
-        length = random.uniform(args.freestream_length[0], args.freestream_length[1])
-        angle = random.uniform(
-            args.freestream_angle[0], args.freestream_angle[1]
-        )  # 单位：度
-        fsX = math.cos(angle / 180 * math.pi) * length
-        fsY = math.sin(angle / 180 * math.pi) * length
-        # freestream = {
-        #     "length": length,
-        #     "angle": angle,
-        #     "fsX": fsX,
-        #     "fsY": fsY,
-        # }
-        freestream = np.array([fsX, fsY, length, angle])
-        print("freestream: ", freestream)
-        set_ufile(case_dir, fsX, fsY)
-        print(f"\tUsing len {length:.2f} angle {angle:.2f}")
-        print(f"\tResulting freestream vel x,y: {fsX:.2f},{fsY:.2f}")
+        params = sample_params(args, files, n)
+        manifest.start(n, params)
+        with trace.sample(n):
+            data_dict, error = run_sample(
+                n, case_dir, params, args, mesh_cache=mesh_cache, warm_start=warm_start
+            )
+            if data_dict is None:
+                manifest.failed(n, params, error)
+                continue
 
-        # 画网格
-        if args.fixed_airfoil:
-            fname = f"{args.airfoil_name}.dat"
-        else:
-            fname = random.choice(files)
-        fpath = here / f"{args.airfoil_database}/{fname}"
-        print(f"\tusing {fpath}")
-        try:
-            coord = np.loadtxt(str(fpath), skiprows=1)
-        except:
-            coord = np.loadtxt(str(fpath))
-
-        os.chdir(case_dir)
-        if gen_mesh(coord) != 0:
-            print("\tmesh generation failed, aborting")
-            os.chdir(str(here))
-            continue
+            writer.write(n, data_dict)
+        print("\tdone")
+        t1 = time.time()
+        print(f"\t{t1-t0:.2f}s")
 
-        set_runfile(case_dir, args.subdomains, args.parallel_enable)
-        # 运行仿真
-        os.system("sh ./Allclean > foam.log")
-        os.system("sh ./Allrun >> foam.log")
 
-        # 后处理
-        if args.output_raw_mesh:
-            os.system("postProcess -func writeCellCentres -noZero >> foam.log")
-        if args.output_airfoil_boundary:
-            os.system("postProcess -func 'components(U)' -noZero >> foam.log")
+def _postprocess_staged(n, staging_dir, freestream, args, nu=None):
+    try:
+        with trace.sample(n):
+            return postprocess_sample(staging_dir, freestream, args, nu)
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
 
-        os.chdir(str(here))
 
-        # 外部流场，图片形式
-        data_img = coord2img(fsX, fsY, args)
-        grid_data = get_grid_data(args)
+def generate_pipelined(args, files, writer, manifest, todo):
+    """仿真结束后把结果移到暂存目录, 后处理和保存在后台进行, 主线程立即开始下一个样本"""
+    case_dir = Path(args.case_dir).absolute()
+    staging_root = Path(args.work_dir).absolute() / "staging"
+    makeDirs(staging_root)
+    mesh_cache = get_mesh_cache(args)
+    warm_start = get_warm_start(args)
+    pipeline = Pipeline(writer, args.pipeline_depth, args.pipeline_workers)
+    try:
+        for n in todo:
+            t0 = time.time()
+            print(f"\nRun {n}:")
 
-        data_dict = {
-            "freestream": freestream,
-            "data_img": data_img,
-            "grid_data": grid_data,
-        }
+            params = sample_params(args, files, n)
+            manifest.start(n, params)
+            with trace.sample(n):
+                freestream, error = solve_supervised(
+                    n, case_dir, params, args, mesh_cache=mesh_cache, warm_start=warm_start
+                )
+            if freestream is None:
+                manifest.failed(n, params, error)
+                continue
 
-        if args.output_raw_mesh:
-            raw_mesh_data = get_raw_mesh(case_dir)
-            data_dict.update({"raw_mesh_data": raw_mesh_data})
-        if args.output_airfoil_boundary:
-            airfoil_data = get_airfoil_data(case_dir)
-            data_dict.update({"airfoil_data": airfoil_data})
+            staging_dir = stage_results(case_dir, staging_root / f"{n}")
+            pipeline.submit(
+                n, _postprocess_staged, n, staging_dir, freestream, args, params.get("nu")
+            )
+            print(f"\tsolved, {pipeline.pending} samples in queue")
+            t1 = time.time()
+            print(f"\t{t1-t0:.2f}s")
+    finally:
+        pipeline.close()
 
-        save_path = f"{args.output_dir}/{args.output_prefix}{n}.mat"
-        scio.savemat(save_path, data_dict, do_compression=True)
 
-        # when read the data with the key 'data' after loaded
-        save_path = f"{args.output_dir}/{args.output_prefix}{n}.npz"
-        np.savez_compressed(save_path, data=data_dict, allow_pickle=True)
-        print("\tdone")
-        t1 = time.time()
-        print(f"\t{t1-t0:.2f}s")
+def clone_case(case_dir, worker_dir):
+    """把case模板复制到worker_dir, 不复制上次运行留下的分解和后处理结果"""
+    if worker_dir.exists():
+        shutil.rmtree(worker_dir)
+    shutil.copytree(
+        case_dir, worker_dir, ignore=shutil.ignore_patterns("processor*", "postProcessing")
+    )
+
+
+_worker_case_dir = None
+_worker_args = None
+_worker_mesh_cache = None
+_worker_warm_start = None
+
+
+def _init_worker(case_dirs, args, profile_dir=None):
+    # 每个进程独占一个case目录, 网格缓存和热启动目录是共用的
+    global _worker_case_dir, _worker_args, _worker_mesh_cache, _worker_warm_start
+    # 不使用继承的tracer, 否则记录会通过共用的文件写入一次, 传回主进程后再写入一次
+    trace.set_tracer(trace.Tracer(profile_dir=profile_dir))
+    _worker_case_dir = case_dirs.get()
+    _worker_args = args
+    _worker_mesh_cache = get_mesh_cache(args)
+    _worker_warm_start = get_warm_start(args)
+
+
+def _run_worker(n, params):
+    t0 = time.time()
+    print(f"\nRun {n} in {_worker_case_dir}:")
+    # 多个mpirun同时运行时不能绑定到相同的核上
+    with trace.sample(n):
+        data_dict, error = run_sample(
+            n,
+            _worker_case_dir,
+            params,
+            _worker_args,
+            mpirun_args="--bind-to none",
+            mesh_cache=_worker_mesh_cache,
+            warm_start=_worker_warm_start,
+        )
+    print(f"\tRun {n} {time.time()-t0:.2f}s")
+    # 计时记录和分析结果随结果一起传回主进程
+    tracer = trace.get_tracer()
+    return data_dict, error, tracer.drain(), tracer.drain_profiles()
+
+
+def generate_parallel(args, files, writer, manifest, todo):
+    """多进程生成数据, 每个进程在自己的case副本中运行, 结果按样本顺序保存"""
+    case_dir = Path(args.case_dir).absolute()
+    work_dir = Path(args.work_dir).absolute()
+    makeDirs(work_dir)
+
+    ctx = mp.get_context()
+    case_dirs = ctx.Queue()
+    for i in range(args.workers):
+        worker_dir = work_dir / f"worker{i}"
+        clone_case(case_dir, worker_dir)
+        case_dirs.put(str(worker_dir))
+    print(f"cloned {args.workers} workers into {work_dir}")
+
+    # 每个样本的参数只由(seed, n)决定, 与串行模式得到相同的样本
+    params = [sample_params(args, files, n) for n in todo]
+    for n, p in zip(todo, params):
+        manifest.start(n, p)
+    # parser和handle不能被pickle, 只把参数传给子进程
+    worker_args = argparse.Namespace(
+        **{k: v for k, v in vars(args).items() if k not in ("parser", "handle")}
+    )
+
+    with ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=ctx,
+        initializer=_init_worker,
+        initargs=(case_dirs, worker_args, trace.get_tracer().profile_dir),
+    ) as executor:
+        results = executor.map(_run_worker, todo, params)
+        for n, p, (data_dict, error, records, profiles) in zip(todo, params, results):
+            trace.get_tracer().add(*records)
+            trace.get_tracer().add_profiles(profiles)
+            if data_dict is None:
+                manifest.failed(n, p, error)
+                continue
+            with trace.sample(n):
+                writer.write(n, data_dict)
+            print(f"\tsaved {n}")
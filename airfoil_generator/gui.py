@@ -1,5 +1,5 @@
 import math
-import os
+import time
 from pathlib import Path
 
 import matplotlib
@@ -7,23 +7,30 @@ import matplotlib.pyplot as plt
 import numpy as np
 import scipy.io as scio
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
-from PyQt5.QtCore import QCoreApplication, QThread, pyqtSignal
+from PyQt5.QtCore import QCoreApplication, Qt, QThread, QTimer, pyqtSignal
 from PyQt5.QtWidgets import QApplication, QFileDialog, QGraphicsScene, QMainWindow
 
-from cst import CST_shape
-from mainWindow import Ui_MainWindow
-from process.postprocess import coord2img
-from process.preprocess import (
+from .cst import CST_shape
+from .mainWindow import Ui_MainWindow
+from .process.postprocess import SAMPLE_XRANGE, SAMPLE_YRANGE, coord2img
+from .process.preprocess import (
     gen_mesh,
     set_decomposefile,
     set_runfile,
+    set_sample_points,
     set_transfile,
     set_ufile,
 )
+from .process.reader import latest_time
+from .preview import PreviewIndex, preview_features, results_from_img
+from .utils.utils import run_cmd
 
 matplotlib.use("Qt5Agg")
 
-here = Path(".").absolute()
+# 已仿真结果的预览索引, 可以用 airfoil_generator build-preview 从数据集生成
+PREVIEW_DIR = Path("./preview_index").absolute()
+# 滑块连续变化时, 每帧(约60fps)最多重新计算一次翼型和预览
+FRAME_INTERVAL = 16
 
 
 class QtFigure(FigureCanvasQTAgg):
@@ -40,6 +47,9 @@ class QtFigure(FigureCanvasQTAgg):
         self.graphics.setScene(self.graphyScene)
 
         self.init_flag = True
+        self.line = None
+        self.img = None
+        self.background = None
         self.axes = self.fig.add_subplot(111)
         self.axes.spines["top"].set_visible(False)
         self.axes.spines["right"].set_visible(False)
@@ -48,6 +58,14 @@ class QtFigure(FigureCanvasQTAgg):
         self.axes.set_xticks([])
         self.axes.set_yticks([])
         self.axes.set_aspect("equal")
+        # 每次完整重绘后保存不含翼型曲线的背景, 之后拖动滑块时只重画曲线
+        self.mpl_connect("draw_event", self._on_draw)
+
+    def _on_draw(self, event):
+        if self.line is None:
+            return
+        self.background = self.copy_from_bbox(self.axes.bbox)
+        self.axes.draw_artist(self.line)
 
     def update_plot(self, coord):
         x, y = coord[:, 0], coord[:, 1]
@@ -55,28 +73,43 @@ class QtFigure(FigureCanvasQTAgg):
             self.axes.grid(True)
             self.axes.set_xlim(xmin=-0.05, xmax=1.05)
             self.axes.set_ylim(ymin=-0.55, ymax=0.55)
-            (self.ax,) = self.axes.plot([], [], "b")
+            (self.line,) = self.axes.plot([], [], "b", animated=True)
             self.fig.tight_layout()
             self.init_flag = False
 
-        self.ax.set_data(x, y)
-        self.fig.canvas.draw()
+        self.line.set_data(x, y)
+        if self.background is None:
+            # 第一次绘制, draw_event中保存背景并画出曲线
+            self.draw()
+            return
+        self.restore_region(self.background)
+        self.axes.draw_artist(self.line)
+        self.blit(self.axes.bbox)
 
     def update_img(self, img, channel="magnitude"):
-        cmap = "jet"
-        #  if channel == 'vortex':
-        #  cmap = 'coolwarm'
-
-        nozero = img.nonzero()
-        m = img[nozero].min()
-        M = img[nozero].max()
-        print(f"min: {m:.4f}, Max: {M:.4f} in channel: {channel}")
+        """只创建一个图像, 之后更新它的数据和颜色范围, 不会累积图形对象"""
+        # 值为0的像素是翼型内部, 不参与颜色范围
+        nozero = img[img != 0]
+        if nozero.size:
+            m, M = float(nozero.min()), float(nozero.max())
+        else:
+            m, M = 0.0, 1.0
+        if M <= m:
+            M = m + 1e-12
 
-        self.axes.contourf(img, cmap=cmap, levels=30, vmin=m, vmax=M)
-        #  self.axes.imshow(img)
-        self.fig.tight_layout()
-        self.init_flag = False
-        self.fig.canvas.draw()
+        if self.img is None:
+            self.img = self.axes.imshow(
+                img, cmap="jet", origin="lower", interpolation="bilinear", vmin=m, vmax=M
+            )
+            self.fig.tight_layout()
+            self.init_flag = False
+        else:
+            if img.shape != self.img.get_array().shape:
+                # 分辨率变化时调整范围, 与contourf的像素坐标一致
+                self.img.set_extent((-0.5, img.shape[1] - 0.5, -0.5, img.shape[0] - 0.5))
+            self.img.set_data(img)
+            self.img.set_clim(m, M)
+        self.draw_idle()
 
 
 class Args(object):
@@ -109,30 +142,24 @@ class SimThread(QThread):
         set_ufile(case_dir, fsX, fsY)
         set_runfile(case_dir, subdomains=10, parallel_enable=True)
         # set_runfile(case_dir, args.subdomains, args.parallel_enable)
+        set_sample_points(case_dir, (*SAMPLE_XRANGE, Args.res), (*SAMPLE_YRANGE, Args.res))
 
-        # generate mesh
-        os.chdir(case_dir)
-        try:
-            gen_mesh(params["coord"])
-        except:
+        # generate mesh, 在线程中不改变全局工作路径
+        if gen_mesh(params["coord"], case_dir) != 0:
             print("\tmesh generation failed!")
-            os.chdir(str(here))
+            self.trigger.emit({})
+            return
 
         # 运行仿真
-        os.chdir(case_dir)
-        os.system("sh ./Allclean > foam.log")
-        os.system("sh ./Allrun >> foam.log")
-        os.chdir(str(here))
+        run_cmd("sh ./Allclean > foam.log", case_dir)
+        run_cmd("sh ./Allrun >> foam.log", case_dir)
+        if latest_time(case_dir) is None:
+            print("\tsolver wrote no results!")
+            self.trigger.emit({})
+            return
 
         data_img = coord2img(fsX, fsY, Args)
-
-        data_img = {k: np.rot90(v) for k, v in data_img.items()}
-        simulation_results = {
-            "magnitude": np.sqrt(data_img["Ux_img"] ** 2 + data_img["Uy_img"] ** 2),
-            "vortex": np.zeros((128, 128)),
-            "Ux": data_img["Ux_img"],
-            "Uy": data_img["Uy_img"],
-        }
+        simulation_results = results_from_img(data_img)
 
         self.trigger.emit(simulation_results)
 
@@ -142,8 +169,18 @@ class MainApp(Ui_MainWindow, QMainWindow):
         super(MainApp, self).__init__()
         self.setupUi(mainWindow)
         self.simulation_results = {}
+        # 正在显示的预览, 只用于显示, 不会被保存; 显示仿真结果时为None
+        self.preview_results = None
         self.channel = "magnitude"
         self.cst = CST_shape(wu=[0.5, 0.5, 0.5], wl=[-0.5, -0.5, -0.5], N1=0.5, N2=1)
+        self.preview = PreviewIndex(str(PREVIEW_DIR))
+        self._shape_dirty = False
+        self._preview_dirty = False
+        self.frame_timer = QTimer()
+        self.frame_timer.setSingleShot(True)
+        self.frame_timer.setTimerType(Qt.PreciseTimer)
+        self._last_frame = 0.0
+        self.frame_timer.timeout.connect(self._render_frame)
         self.sim_thread = SimThread(self.get_sim_params())
         self.sim_signal = pyqtSignal(dict)
         self.bind_actions()
@@ -166,6 +203,7 @@ class MainApp(Ui_MainWindow, QMainWindow):
 
         self.shape_fig.update_plot(self.cst.coord)
         self.flow_fig.update_img(np.random.rand(128, 128), self.channel)
+        self._update_preview()
         # self.flow_fig.update_img(np.zeros((128, 128)), self.channel)
 
     def get_cst_params(self):
@@ -193,6 +231,9 @@ class MainApp(Ui_MainWindow, QMainWindow):
         self.doubleSpinBox_velocity.valueChanged.connect(self._update_Re)
         self.doubleSpinBox_nu.valueChanged.connect(self._update_Re)
         self.doubleSpinBox_rho.valueChanged.connect(self._update_Re)
+        self.doubleSpinBox_angle.valueChanged.connect(self._schedule_preview)
+        self.doubleSpinBox_velocity.valueChanged.connect(self._schedule_preview)
+        self.doubleSpinBox_nu.valueChanged.connect(self._schedule_preview)
 
         self.flowFieldChannels.currentTextChanged.connect(self._update_flowfield)
         self.pushButton_sim.clicked.connect(self._simulate)
@@ -233,8 +274,28 @@ class MainApp(Ui_MainWindow, QMainWindow):
         else:
             pass
 
-        self.cst.cal_coord()
-        self.shape_fig.update_plot(self.cst.coord)
+        self._shape_dirty = True
+        self._schedule_preview()
+
+    def _schedule_preview(self):
+        """合并一帧内的多次变化, 定时器到期时只计算一次
+
+        定时器从上一帧开始时计时, 绘制本身的时间不会再加在帧间隔上; 空闲后的第一次变化立即绘制
+        """
+        self._preview_dirty = True
+        if not self.frame_timer.isActive():
+            elapsed = (time.perf_counter() - self._last_frame) * 1000
+            self.frame_timer.start(max(0, int(FRAME_INTERVAL - elapsed)))
+
+    def _render_frame(self):
+        self._last_frame = time.perf_counter()
+        if self._shape_dirty:
+            self._shape_dirty = False
+            self.cst.cal_coord()
+            self.shape_fig.update_plot(self.cst.coord)
+        if self._preview_dirty:
+            self._preview_dirty = False
+            self._update_preview()
 
     def _update_Re(self):
         _translate = QCoreApplication.translate
@@ -249,18 +310,38 @@ class MainApp(Ui_MainWindow, QMainWindow):
         self.label_Re.setText(_translate("MainWindow", string_Re))
 
     def _update_flowfield(self):
-        if len(self.simulation_results) == 0:
+        results = self.preview_results if self.preview_results is not None else self.simulation_results
+        if len(results) == 0:
             return
         sender_name = self.sender().objectName()
         if sender_name == "flowFieldChannels":
             self.channel = self.flowFieldChannels.currentText()
-            self.flow_fig.update_img(
-                self.simulation_results[self.channel], self.channel
-            )
+            self.flow_fig.update_img(results[self.channel], self.channel)
+
+    def _update_preview(self):
+        """仿真完成前, 显示索引中最接近的结果或最近几个结果的加权平均"""
+        if len(self.preview) == 0:
+            return
+        params = self.get_sim_params()
+        results, dist = self.preview.query(params["features"])
+        if results is None:
+            return
+        self.preview_results = results
+        self.label_sim_status.setText(f"Status: preview (distance {dist:.3f})")
+        self.flow_fig.update_img(results[self.channel], self.channel)
 
     def get_sim_params(self):
         params = {
             "coord": self.cst.coord,
+            "features": preview_features(
+                self.cst.wu,
+                self.cst.wl,
+                self.cst.N1,
+                self.cst.N2,
+                self.doubleSpinBox_angle.value(),
+                self.doubleSpinBox_velocity.value(),
+                self.doubleSpinBox_nu.value() * 1e-5,
+            ),
             "angle": self.doubleSpinBox_angle.value(),
             "velocity": self.doubleSpinBox_velocity.value(),
             "rho": self.doubleSpinBox_rho.value(),
@@ -272,16 +353,34 @@ class MainApp(Ui_MainWindow, QMainWindow):
         if self.sim_thread.isRunning():
             return
         else:
+            # 先完成还没有绘制的滑块变化, 仿真使用当前的翼型
+            self._render_frame()
             self.label_sim_status.setText("Status: simulating!")
             self.sim_thread.set_params(self.get_sim_params())
             self.sim_thread.start()
 
     def _simulate_over(self, simulation_results):
+        if len(simulation_results) == 0:
+            self.label_sim_status.setText("Status: failed!")
+            return
         self.simulation_results = simulation_results
+        self.preview_results = None
         self.label_sim_status.setText("Status done!")
         self.flow_fig.update_img(simulation_results[self.channel], self.channel)
+        try:
+            self.preview.add(self.sim_thread._params["features"], simulation_results)
+        except ValueError as e:
+            print(f"result not added to the preview index: {e}")
 
     def save(self):
+        # 预览是插值得到的, 不是仿真结果, 不保存
+        if self.preview_results is not None:
+            self.label_sim_status.setText("Status: preview, not saved")
+            print("the flow field shown is a preview, simulate before saving")
+            return
+        if len(self.simulation_results) == 0:
+            print("no simulation results to save")
+            return
         # [0] is outputfile path, [1] is filetype filter
         fpath = QFileDialog.getSaveFileName(self, "save", ".", "mat files(*.mat)")[0]
         if not fpath.endswith(".mat"):
@@ -0,0 +1,112 @@
+import json
+import os
+import threading
+
+
+def retryable(entry):
+    """失败的样本是否可能在重试时成功: 超时, 或网格生成以外的命令失败"""
+    error = entry.get("error")
+    if entry.get("status") != "failed" or not error:
+        return False
+    # 没有stage的失败记录是网格生成失败
+    return bool(error.get("timed_out")) or error.get("stage", "gen_mesh") != "gen_mesh"
+
+
+class Manifest(object):
+    """记录已经完成的样本, 中断后可以从这里继续生成
+
+    每个样本一行json: {"index", "seed", "status", "params", "outputs"},
+    status为done表示所有输出格式都已写入磁盘, failed表示网格生成失败或所有重试都失败,
+    failed的记录中有外部命令的退出状态时记在error中, 其中stage为失败的阶段.
+    样本参数只由(seed, index)决定, 所以跳过已完成的样本不影响其余样本.
+    """
+
+    def __init__(self, path, seed, resume=False):
+        self.path = path
+        self.seed = seed
+        self.entries = {}
+        self._params = {}
+        self._lock = threading.Lock()
+        if resume and os.path.exists(path):
+            with open(path, "rt") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 中断时最后一行可能不完整
+                        continue
+                    if entry.get("seed") != seed:
+                        raise ValueError(
+                            f"{path} was generated with seed {entry.get('seed')}, "
+                            f"resume with --seed {entry.get('seed')}"
+                        )
+                    self.entries[entry["index"]] = entry
+            # 去掉不完整的行, 后面的记录追加在完整的记录之后
+            self._rewrite()
+        else:
+            open(path, "wt").close()
+
+    def _rewrite(self):
+        with open(f"{self.path}.tmp", "wt") as f:
+            for n in sorted(self.entries):
+                f.write(json.dumps(self.entries[n]) + "\n")
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def _entry(self, n, status, params, outputs):
+        return {
+            "index": n,
+            "seed": self.seed,
+            "status": status,
+            "params": params,
+            "outputs": outputs,
+        }
+
+    def _append(self, entry):
+        with self._lock:
+            self.entries[entry["index"]] = entry
+            with open(self.path, "at") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def completed(self):
+        """已经完成或确定失败的样本编号
+
+        网格生成失败的样本重试结果相同, 不再重试; 命令超时或返回非0的样本在resume时重新生成
+        """
+        return {n for n, entry in self.entries.items() if not retryable(entry)}
+
+    def start(self, n, params):
+        """记录样本n的参数, 写入磁盘后由saved写入manifest"""
+        with self._lock:
+            self._params[n] = params
+
+    def saved(self, n, outputs):
+        with self._lock:
+            params = self._params.pop(n, None)
+        self._append(self._entry(n, "done", params, outputs))
+
+    def failed(self, n, params, error=None):
+        with self._lock:
+            self._params.pop(n, None)
+        entry = self._entry(n, "failed", params, [])
+        if error is not None:
+            entry["error"] = error
+        self._append(entry)
+
+
+def manifest_path(args):
+    return f"{args.output_dir}/{args.output_prefix}manifest.jsonl"
+
+
+def recorded_seed(path):
+    """manifest中记录的随机种子, 文件不存在或没有完整的记录时返回None"""
+    if not os.path.exists(path):
+        return None
+    with open(path, "rt") as f:
+        for line in f:
+            try:
+                return json.loads(line)["seed"]
+            except (ValueError, KeyError):
+                continue
+    return None
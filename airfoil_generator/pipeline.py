@@ -0,0 +1,71 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from . import trace
+from .process.reader import latest_time
+
+
+def stage_results(case_dir, staging_dir, time=None):
+    """把仿真结果移到暂存目录, 下一个样本的Allclean不会删掉还没后处理的结果
+
+    只移动后处理需要的时间步目录和postProcessing目录, 同一文件系统上只是改名
+    :time: 时间步, 默认为最后写出的时间步
+    """
+    if time is None:
+        time = latest_time(case_dir)
+    os.makedirs(staging_dir, exist_ok=True)
+    for name in (time, "postProcessing"):
+        src = os.path.join(case_dir, name)
+        if os.path.exists(src):
+            os.replace(src, os.path.join(staging_dir, name))
+    return staging_dir
+
+
+class Pipeline(object):
+    """有界的后台后处理和保存流水线
+
+    后处理在线程池中并行进行, 保存由单独的一个线程按提交顺序完成,
+    所以输出和顺序执行时一致. 队列中最多depth个样本, 满了以后submit会等待最早的样本.
+    后台的异常在下一次submit或close时在主线程抛出.
+    """
+
+    def __init__(self, writer, depth=2, workers=2):
+        self.writer = writer
+        self.depth = depth
+        self._post_pool = ThreadPoolExecutor(max_workers=workers)
+        self._write_pool = ThreadPoolExecutor(max_workers=1)
+        self._futures = deque()
+
+    @property
+    def pending(self):
+        return len(self._futures)
+
+    def _write(self, n, post):
+        data_dict = post.result()
+        if data_dict is not None:
+            with trace.sample(n):
+                self.writer.write(n, data_dict)
+
+    def _check(self):
+        # 弹出已完成的样本, 有异常时在这里抛出
+        while self._futures and self._futures[0].done():
+            self._futures.popleft().result()
+
+    def submit(self, n, fn, *args):
+        """提交样本n, fn(*args)返回数据字典"""
+        self._check()
+        while len(self._futures) >= self.depth:
+            self._futures.popleft().result()
+        post = self._post_pool.submit(fn, *args)
+        self._futures.append(self._write_pool.submit(self._write, n, post))
+
+    def close(self):
+        try:
+            while self._futures:
+                self._futures.popleft().result()
+        finally:
+            for future in self._futures:
+                future.cancel()
+            self._post_pool.shutdown(wait=True)
+            self._write_pool.shutdown(wait=True)
@@ -0,0 +1,125 @@
+import csv
+import math
+import warnings
+from functools import lru_cache
+
+import numpy as np
+
+PLAN_FIELDS = ["index", "fname", "angle", "length", "nu"]
+
+
+def latin_hypercube(n, d, rng):
+    """n个点的拉丁超立方设计, 每一维的n个分层中各有一个点"""
+    u = (rng.random((n, d)) + np.arange(n)[:, None]) / n
+    for j in range(d):
+        u[:, j] = rng.permutation(u[:, j])
+    return u
+
+
+def sobol(n, d, seed):
+    from scipy.stats import qmc
+
+    sampler = qmc.Sobol(d, scramble=True, seed=seed)
+    with warnings.catch_warnings():
+        # n不是2的幂时平衡性稍差, 仍然比随机抽样均匀
+        warnings.simplefilter("ignore")
+        return sampler.random(n)
+
+
+def grid(counts):
+    """每一维counts[i]个点的全因子设计, 点在分层的中心"""
+    axes = [(np.arange(c) + 0.5) / c for c in counts]
+    mesh = np.meshgrid(*axes, indexing="ij")
+    return np.stack([m.ravel() for m in mesh], axis=1)
+
+
+def design(name, n, d, seed, counts=None):
+    """[0, 1)^d 中的n个样本点"""
+    rng = np.random.default_rng(seed)
+    if name == "random":
+        return rng.random((n, d))
+    if name == "lhs":
+        return latin_hypercube(n, d, rng)
+    if name == "sobol":
+        return sobol(n, d, seed)
+    if name == "grid":
+        return grid(counts)
+    raise ValueError(f"unsupported design: {name}")
+
+
+def make_plan(args, files):
+    """生成完整的实验表, 每行 {index, fname, angle, length, nu}
+
+    lhs, sobol和random对(翼型, 角度, 大小, 粘度)整体做n_samples个点的设计,
+    翼型维度按区间均分到各个翼型; grid对每个翼型做plan_grid个点的全因子设计.
+    nu_range有两个值时粘度在范围内按对数均匀分布, 否则固定为nu.
+    结果按翼型(即网格)分组, 组内按角度和大小排序, 使网格缓存和热启动尽量命中.
+    """
+    airfoils = [f"{args.airfoil_name}.dat"] if args.fixed_airfoil else sorted(files)
+    m = len(airfoils)
+
+    if args.plan_design == "grid":
+        u = grid(args.plan_grid)
+        u = np.concatenate([np.c_[np.full(len(u), (i + 0.5) / m), u] for i in range(m)])
+    else:
+        u = design(args.plan_design, args.n_samples, 4, args.seed)
+
+    angle = args.freestream_angle[0] + u[:, 1] * (args.freestream_angle[1] - args.freestream_angle[0])
+    length = args.freestream_length[0] + u[:, 2] * (args.freestream_length[1] - args.freestream_length[0])
+    if args.nu_range and len(args.nu_range) == 2:
+        lo, hi = math.log(args.nu_range[0]), math.log(args.nu_range[1])
+        nu = np.exp(lo + u[:, 3] * (hi - lo))
+    else:
+        nu = np.full(len(u), args.nu)
+    airfoil = np.minimum((u[:, 0] * m).astype(int), m - 1)
+
+    order = np.lexsort((nu, length, angle, airfoil))
+    plan = []
+    for index, i in enumerate(order):
+        plan.append(
+            {
+                "index": index,
+                "fname": airfoils[airfoil[i]],
+                "angle": float(angle[i]),
+                "length": float(length[i]),
+                "nu": float(nu[i]),
+            }
+        )
+    return plan
+
+
+def save_plan(plan, fname):
+    with open(fname, "wt", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=PLAN_FIELDS)
+        writer.writeheader()
+        writer.writerows(plan)
+
+
+@lru_cache(maxsize=None)
+def load_plan(fname):
+    """读取实验表, 返回按index排列的行"""
+    with open(fname, "rt", newline="") as f:
+        plan = []
+        for row in csv.DictReader(f):
+            plan.append(
+                {
+                    "index": int(row["index"]),
+                    "fname": row["fname"],
+                    "angle": float(row["angle"]),
+                    "length": float(row["length"]),
+                    "nu": float(row["nu"]),
+                }
+            )
+    plan.sort(key=lambda row: row["index"])
+    if [row["index"] for row in plan] != list(range(len(plan))):
+        raise ValueError(f"plan {fname} must have indices 0..{len(plan) - 1}")
+    return tuple(plan)
+
+
+def plan_from_cli(args):
+    from .generate import list_airfoils
+
+    plan = make_plan(args, list_airfoils(args))
+    save_plan(plan, args.plan_output)
+    airfoils = len(set(row["fname"] for row in plan))
+    print(f"wrote {len(plan)} samples over {airfoils} airfoils to {args.plan_output}")
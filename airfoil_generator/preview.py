@@ -0,0 +1,183 @@
+import os
+import uuid
+
+import numpy as np
+
+# 特征中角度和速度的缩放, 角度差10度, 速度差10m/s与CST权重差1的距离相同
+ANGLE_SCALE = 10.0
+VELOCITY_SCALE = 10.0
+
+
+def preview_features(wu, wl, N1, N2, angle, velocity, nu):
+    """一次仿真的特征向量 [wu, wl, N1, N2, angle/10, velocity/10, log10(nu)], 用欧氏距离比较"""
+    return np.concatenate(
+        [
+            np.ravel(wu),
+            np.ravel(wl),
+            [N1, N2, angle / ANGLE_SCALE, velocity / VELOCITY_SCALE, np.log10(nu)],
+        ]
+    ).astype(np.float64)
+
+
+def results_from_img(data_img):
+    """coord2img的 (6, res, res) 图像转换为GUI显示的通道, 与SimThread一样旋转90度"""
+    Ux = np.rot90(data_img[4])
+    Uy = np.rot90(data_img[5])
+    return {
+        "magnitude": np.sqrt(Ux**2 + Uy**2),
+        "vortex": np.zeros_like(Ux),
+        "Ux": Ux,
+        "Uy": Uy,
+    }
+
+
+class PreviewIndex(object):
+    """已仿真结果的最近邻索引, GUI在仿真完成前用它预览流场
+
+    每个结果保存为 index_dir 中的一个 .npz, 包含特征向量和各个通道的流场.
+    启动时只读取特征向量, 流场在查询时才读取.
+    """
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        self.paths = []
+        self.features = np.zeros((0, 0))
+        self._fields = {}
+        if os.path.isdir(index_dir):
+            self.load()
+
+    def __len__(self):
+        return len(self.paths)
+
+    def load(self):
+        paths, features = [], []
+        for fname in sorted(os.listdir(self.index_dir)):
+            if not fname.endswith(".npz"):
+                continue
+            path = os.path.join(self.index_dir, fname)
+            try:
+                # 只解压特征向量
+                with np.load(path) as data:
+                    f = data["features"]
+            except (OSError, ValueError, KeyError):
+                continue
+            if features and f.shape != features[0].shape:
+                print(f"skip {path}: features of length {len(f)}, expected {len(features[0])}")
+                continue
+            paths.append(path)
+            features.append(f)
+        self.paths = paths
+        self.features = np.array(features) if features else np.zeros((0, 0))
+        self._fields = {}
+
+    def add(self, features, fields):
+        """保存一个结果
+
+        :features: preview_features的输出
+        :fields: {通道: (res, res)}
+        """
+        features = np.asarray(features, dtype=np.float64)
+        if len(self) and features.shape != self.features.shape[1:]:
+            raise ValueError(
+                f"features of length {len(features)} do not match the index ({self.features.shape[1]})"
+            )
+        os.makedirs(self.index_dir, exist_ok=True)
+        path = os.path.join(self.index_dir, f"{uuid.uuid4().hex}.npz")
+        tmp = f"{path}.tmp.npz"
+        np.savez(tmp, features=features, **{k: np.asarray(v, dtype=np.float32) for k, v in fields.items()})
+        os.replace(tmp, path)
+        self.paths.append(path)
+        self.features = np.concatenate([self.features.reshape(-1, len(features)), features[None]])
+        self._fields[path] = {k: np.asarray(v, dtype=np.float32) for k, v in fields.items()}
+
+    def fields(self, i):
+        path = self.paths[i]
+        if path not in self._fields:
+            with np.load(path) as data:
+                self._fields[path] = {k: data[k] for k in data.files if k != "features"}
+        return self._fields[path]
+
+    def query(self, features, k=4, power=2.0):
+        """最接近的结果, 或最近k个结果按距离倒数的power次方加权平均
+
+        :returns: (流场 {通道: (res, res)}, 最近的距离), 索引为空时返回 (None, inf)
+        """
+        if len(self) == 0:
+            return None, np.inf
+        dist = np.linalg.norm(self.features - np.asarray(features, dtype=np.float64), axis=1)
+        nearest = np.argsort(dist)[:k]
+        if dist[nearest[0]] < 1e-12:
+            return dict(self.fields(nearest[0])), 0.0
+
+        first = self.fields(nearest[0])
+        blend = {name: np.zeros_like(v) for name, v in first.items()}
+        total = 0.0
+        for i in nearest:
+            fields = self.fields(i)
+            # 分辨率不同的结果不能混合
+            if any(name not in fields or fields[name].shape != v.shape for name, v in blend.items()):
+                continue
+            w = 1.0 / dist[i] ** power
+            for name in blend:
+                blend[name] += w * fields[name]
+            total += w
+        for name in blend:
+            blend[name] /= total
+        return blend, float(dist[nearest[0]])
+
+    def add_dataset(self, output_dir, prefix, table, nu=1e-5):
+        """把generate的数据集加入索引
+
+        翼型的CST参数从fit-cst的参数表中按名称查找, 参数表的阶数需要与GUI相同(3个权重).
+        来流取自样本的freestream, 粘度取自样本的nu, 没有时为nu. 已经在索引中的结果跳过.
+        :returns: (加入的样本数, 跳过的样本数)
+        """
+        import json
+
+        from .writer import iter_dataset
+
+        names = {str(name): i for i, name in enumerate(table["name"])}
+        airfoils = {}
+        with open(os.path.join(output_dir, f"{prefix}manifest.jsonl"), "rt") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("status") == "done":
+                    airfoils[entry["index"]] = os.path.splitext(entry["params"]["fname"])[0]
+
+        added = skipped = 0
+        for n, data in iter_dataset(output_dir, prefix):
+            i = names.get(airfoils.get(n))
+            if i is None or "data_img" not in data:
+                skipped += 1
+                continue
+            _, _, length, angle = np.ravel(data["freestream"])
+            features = preview_features(
+                table["wu"][i],
+                table["wl"][i],
+                table["N1"][i],
+                table["N2"][i],
+                angle,
+                length,
+                float(np.ravel(data.get("nu", nu))[0]),
+            )
+            # 重复加入同一个数据集时跳过已有的结果
+            if len(self) and np.linalg.norm(self.features - features, axis=1).min() < 1e-12:
+                skipped += 1
+                continue
+            self.add(features, results_from_img(data["data_img"]))
+            added += 1
+        return added, skipped
+
+
+def preview_from_cli(args):
+    from .cst_fit import load_table
+
+    index = PreviewIndex(args.preview_dir)
+    before = len(index)
+    added, skipped = index.add_dataset(
+        args.preview_input, args.preview_prefix, load_table(args.preview_table), args.nu
+    )
+    print(f"added {added} samples to {args.preview_dir} ({before} before), skipped {skipped}")
@@ -0,0 +1,124 @@
+"""OpenFOAM字典文件的模板
+
+每个字典文件只解析一次, 记录需要修改的值在文本中的位置, 之后每次写入只是拼接字符串.
+文件的其余部分(格式, 注释, 其他条目)保持原样.
+"""
+import numbers
+import os
+import re
+
+_BRACE = re.compile(r'[{}]')
+_COMMENT = re.compile(r'//[^\n]*|/\*.*?\*/', re.DOTALL)
+_KEY = re.compile(r'\s*("[^"]*"|[^\s{};"]+)\s*')
+_LAST_TOKEN = re.compile(r'(\S+)\s*$')
+
+
+def block_end(text, start):
+    """text[start]是'{', 返回与之匹配的'}'的位置"""
+    depth = 0
+    for m in _BRACE.finditer(text, start):
+        depth += 1 if m.group() == '{' else -1
+        if depth == 0:
+            return m.start()
+    raise ValueError('unbalanced braces')
+
+
+def blank_comments(text):
+    """把注释替换为空格, 长度和换行不变, 位置可以直接用于原文"""
+    return _COMMENT.sub(lambda m: re.sub(r'[^\n]', ' ', m.group()), text)
+
+
+def entries(blank, start=0, end=None):
+    """blank[start:end]中的条目, {关键字: (值开始, 值结束, 是否子字典)}
+
+    普通条目的值不包括结尾的分号, 子字典的值是花括号内部, #开头的指令到行尾为止
+    :blank: 已经去掉注释的文本
+    """
+    end = len(blank) if end is None else end
+    result = {}
+    pos = start
+    while True:
+        m = _KEY.match(blank, pos, end)
+        if m is None:
+            return result
+        key, value = m.group(1), m.end()
+        if key.startswith('#'):
+            stop = blank.find('\n', value, end)
+            pos = end if stop < 0 else stop
+            continue
+        if blank.startswith('{', value):
+            close = block_end(blank, value)
+            result[key] = (value + 1, close, True)
+            pos = close + 1
+        else:
+            stop = blank.index(';', value, end)
+            result[key] = (value, stop, False)
+            pos = stop + 1
+
+
+def last_token(blank, start, end):
+    """blank[start:end]中最后一个词的位置, 如 [0 2 -1 0 0 0 0] 1e-05 中的 1e-05"""
+    m = _LAST_TOKEN.search(blank, start, end)
+    return m.start(1), m.end(1)
+
+
+class DictTemplate(object):
+    """把文本在需要修改的位置切开, render时依次填入新的值
+
+    :slots: [(名称, 开始, 结束)] 或 [(名称, 开始, 结束, 格式)], 同一名称可以出现多次;
+        开始等于结束时是插入新条目, 格式如 'value {};'
+    """
+
+    def __init__(self, text, slots):
+        self.parts = []
+        self.slots = []
+        pos = 0
+        for slot in sorted(slots, key=lambda slot: slot[1]):
+            name, start, end = slot[:3]
+            fmt = slot[3] if len(slot) > 3 else '{}'
+            self.parts.append(text[pos:start])
+            self.slots.append((name, fmt))
+            pos = end
+        self.parts.append(text[pos:])
+
+    def render(self, **values):
+        out = [self.parts[0]]
+        for (name, fmt), part in zip(self.slots, self.parts[1:]):
+            out.append(fmt.format(values[name]))
+            out.append(part)
+        return ''.join(out)
+
+
+# 文件名 -> (写入后的文件状态, 编译函数, 模板)
+_templates = {}
+
+
+def _signature(fname):
+    st = os.stat(fname)
+    return st.st_mtime_ns, st.st_size, st.st_ino
+
+
+def write_dict(fname, compile, **values):
+    """用模板改写字典文件中的值
+
+    第一次写入或文件被其他程序修改过时, 用compile(文本)重新生成模板
+    :compile: 由文件内容生成DictTemplate的函数
+    """
+    fname = os.path.abspath(fname)
+    cached = _templates.get(fname)
+    if cached is not None and cached[0] == _signature(fname) and cached[1] is compile:
+        template = cached[2]
+    else:
+        with open(fname, 'rt') as f:
+            template = compile(f.read())
+    text = template.render(**values)
+    with open(fname, 'wt') as f:
+        f.write(text)
+    _templates[fname] = (_signature(fname), compile, template)
+
+
+def format_value(value):
+    """数值在字典中的写法, 整数不带小数点, 浮点数用最短的精确表示"""
+    if isinstance(value, numbers.Integral):
+        return str(int(value))
+    return repr(float(value))
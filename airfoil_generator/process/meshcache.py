@@ -0,0 +1,92 @@
+import hashlib
+import os
+import shutil
+import uuid
+
+
+def dir_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for fname in files:
+            size += os.path.getsize(os.path.join(root, fname))
+    return size
+
+
+class MeshCache(object):
+    """以网格输入内容为键的polyMesh缓存
+
+    键是airfoil.geo内容(包含翼型坐标, 网格尺寸和airfoil_template.geo)和网格命令的哈希,
+    值是画完网格并改写好boundary的constant/polyMesh目录.
+    总大小超过max_size时按最近使用时间淘汰, 多个进程可以共用同一个缓存目录.
+    """
+
+    def __init__(self, cache_dir, max_size=2048 * 1024**2):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(*contents):
+        h = hashlib.sha256()
+        for content in contents:
+            if isinstance(content, str):
+                content = content.encode()
+            h.update(content)
+            h.update(b"\0")
+        return h.hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, key, case_dir):
+        """命中时把缓存的polyMesh恢复到case_dir中, 返回是否命中"""
+        entry = self._entry(key)
+        if not os.path.isdir(entry):
+            return False
+        poly_mesh = os.path.join(case_dir, "constant", "polyMesh")
+        if os.path.exists(poly_mesh):
+            shutil.rmtree(poly_mesh)
+        try:
+            shutil.copytree(entry, poly_mesh)
+        except FileNotFoundError:
+            # 恢复的同时被其他进程淘汰了
+            return False
+        # 更新最近使用时间
+        os.utime(entry)
+        return True
+
+    def put(self, key, case_dir):
+        """把case_dir中的polyMesh存入缓存"""
+        entry = self._entry(key)
+        if os.path.isdir(entry):
+            os.utime(entry)
+            return
+        # 先复制到临时目录再改名, 其他进程不会看到复制了一半的网格
+        tmp = os.path.join(self.cache_dir, f".tmp-{uuid.uuid4().hex}")
+        shutil.copytree(os.path.join(case_dir, "constant", "polyMesh"), tmp)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """淘汰最久未使用的网格, 直到总大小不超过max_size"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(".tmp-") or not os.path.isdir(path):
+                continue
+            try:
+                entries.append((os.path.getmtime(path), dir_size(path), path))
+            except FileNotFoundError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def __len__(self):
+        return len([n for n in os.listdir(self.cache_dir) if not n.startswith(".tmp-")])
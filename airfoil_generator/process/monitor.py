@@ -0,0 +1,169 @@
+import os
+import re
+import time
+
+import numpy as np
+
+from .supervisor import run_supervised
+
+_TIME_LINE = re.compile(rb"^Time = (\S+)")
+_RESIDUAL = re.compile(rb"Solving for (\w+), Initial residual = ([^,\s]+),")
+_STOP_AT = re.compile(r"^(\s*stopAt\s+)\w+(\s*;)", re.MULTILINE)
+
+# 残差历史在case中的保存位置, 随postProcessing一起移动和清理
+RESIDUALS_FILE = "postProcessing/solverResiduals/residuals.dat"
+
+
+class ResidualMonitor(object):
+    """增量读取求解器日志, 记录每步的初始残差并判断是否收敛
+
+    :log: 日志文件, 只读取创建monitor之后追加的内容
+    :tol: 所有场的初始残差都小于tol时收敛, 0表示不使用
+    :window: 最近window步中每个场的log10残差变化都小于plateau_tol时认为不再下降, 0表示不使用
+    :min_iters: 至少运行的步数
+    """
+
+    def __init__(self, log, tol=0.0, window=0, plateau_tol=0.05, min_iters=20):
+        self.log = log
+        self.tol = tol
+        self.window = window
+        self.plateau_tol = plateau_tol
+        self.min_iters = min_iters
+        self.offset = os.path.getsize(log) if os.path.exists(log) else 0
+        self._rest = b""
+        self.stop_reason = None
+        # 每步一行 {"Time": t, 场名: 初始残差}
+        self.rows = []
+
+    def update(self):
+        if not os.path.exists(self.log):
+            return
+        with open(self.log, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        self.offset += len(data)
+        lines = (self._rest + data).split(b"\n")
+        # 最后一行可能还没写完
+        self._rest = lines.pop()
+        for line in lines:
+            m = _TIME_LINE.match(line)
+            if m:
+                self.rows.append({"Time": float(m.group(1))})
+                continue
+            m = _RESIDUAL.search(line)
+            if m and self.rows:
+                # 每步只取每个场第一次求解的初始残差
+                self.rows[-1].setdefault(m.group(1).decode(), float(m.group(2)))
+
+    @property
+    def fields(self):
+        names = []
+        for row in self.rows:
+            for name in row:
+                if name != "Time" and name not in names:
+                    names.append(name)
+        return names
+
+    def history(self):
+        """残差历史 {"Time": (n,), 场名: (n,)}, 某一步没有求解的场为nan"""
+        names = ["Time"] + self.fields
+        return {
+            name: np.array([row.get(name, np.nan) for row in self.rows], dtype=np.float64)
+            for name in names
+        }
+
+    def converged(self):
+        """满足停止条件时返回原因, 否则返回None"""
+        # 最后一步可能还在求解中, 只使用完整的步
+        rows = self.rows[:-1]
+        if len(rows) < max(self.min_iters, 1):
+            return None
+        fields = [name for name in rows[-1] if name != "Time"]
+        if not fields:
+            return None
+        if self.tol > 0 and all(rows[-1][name] < self.tol for name in fields):
+            return f"residuals below {self.tol:g} at time {rows[-1]['Time']:g}"
+        if self.window > 0 and len(rows) >= self.window:
+            for name in fields:
+                r = np.array([row.get(name, np.nan) for row in rows[-self.window :]])
+                r = np.log10(r[np.isfinite(r) & (r > 0)])
+                if len(r) < self.window or np.ptp(r) >= self.plateau_tol:
+                    return None
+            return f"residuals stalled over {self.window} iterations at time {rows[-1]['Time']:g}"
+        return None
+
+    def save(self, fname):
+        history = self.history()
+        os.makedirs(os.path.dirname(fname), exist_ok=True)
+        with open(fname, "wt") as f:
+            f.write("# " + " ".join(history) + "\n")
+            if len(self.rows):
+                np.savetxt(f, np.column_stack(list(history.values())), fmt="%.8g")
+
+
+def read_residuals(fname):
+    """读取ResidualMonitor.save保存的残差历史, 返回 {名称: (n,)}"""
+    with open(fname, "rt") as f:
+        names = f.readline().lstrip("#").split()
+        data = np.loadtxt(f, ndmin=2)
+    if data.size == 0:
+        data = np.zeros((0, len(names)))
+    return {name: data[:, i] for i, name in enumerate(names)}
+
+
+def request_write_now(case_dir):
+    """把controlDict的stopAt改为writeNow, 求解器写出当前时间步后退出
+
+    依赖controlDict中的runTimeModifiable, 返回原来的内容用于恢复
+    """
+    fname = os.path.join(case_dir, "system", "controlDict")
+    with open(fname, "rt") as f:
+        original = f.read()
+    text, n = _STOP_AT.subn(r"\1writeNow\2", original, count=1)
+    if n == 0:
+        text = original + "\nstopAt writeNow;\n"
+    with open(fname, "wt") as f:
+        f.write(text)
+    return original
+
+
+def run_monitored(cmd, case_dir, monitor, interval=0.5, stop_timeout=60, run=None):
+    """运行求解器, 同时监控日志, 收敛后让求解器写出结果并退出
+
+    超过stop_timeout秒求解器还没有退出时, 结束整个进程组.
+    停止的原因记录在monitor.stop_reason中, 没有提前停止时为None
+    :run: 运行命令的函数 run(cmd, cwd, poll=, interval=), 返回退出码, 默认为run_supervised
+    :returns: 退出码
+    """
+    control_dict = os.path.join(case_dir, "system", "controlDict")
+    original = None
+    stopped = None
+    monitor.stop_reason = None
+
+    def poll():
+        nonlocal original, stopped
+        monitor.update()
+        if stopped is None:
+            reason = monitor.converged()
+            if reason is not None:
+                print(f"\t{reason}, stopping solver")
+                monitor.stop_reason = reason
+                original = request_write_now(case_dir)
+                stopped = time.time()
+        elif time.time() - stopped > stop_timeout:
+            print(f"\tsolver did not stop in {stop_timeout}s, killing it")
+            return True
+        return False
+
+    if run is None:
+        def run(cmd, cwd, poll, interval):
+            return run_supervised(cmd, cwd, poll=poll, interval=interval)["returncode"]
+
+    try:
+        returncode = run(cmd, case_dir, poll=poll, interval=interval)
+    finally:
+        if original is not None:
+            with open(control_dict, "wt") as f:
+                f.write(original)
+    monitor.update()
+    return returncode
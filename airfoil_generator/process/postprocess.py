@@ -1,13 +1,15 @@
 import numpy as np
 import scipy.io as scio
-from PyFoam.RunDictionary.ParsedParameterFile import ParsedParameterFile
 
+from .monitor import RESIDUALS_FILE, read_residuals
+from .reader import SampleData, latest_time, read_foam_field
 
-def read_sample(case_dir, xrange, yrange, res):
-    ufile = f"{case_dir}/postProcessing/internalCloud/500/cloud_U.xy"
-    pfile = f"{case_dir}/postProcessing/internalCloud/500/cloud_p.xy"
 
-    points = np.loadtxt(ufile)
+def read_sample(case_dir, xrange, yrange, res, data=None):
+    if data is None:
+        data = SampleData(case_dir)
+
+    points = data.cloud_U
     # 计算图像上的坐标
     px = points[:, 0]
     py = points[:, 1]
@@ -19,7 +21,7 @@ def read_sample(case_dir, xrange, yrange, res):
 
     ux = points[:, 3]
     uy = points[:, 4]
-    p = np.loadtxt(pfile)[:, 3]
+    p = data.cloud_p[:, 3]
     outputs = np.zeros((3, int(res[0]), int(res[1])))
     for i, (x, y) in enumerate(zip(coord_x, coord_y)):
         outputs[0, x - 1, y - 1] = ux[i]
@@ -37,10 +39,41 @@ def read_sample(case_dir, xrange, yrange, res):
 # read_sample(case_dir, xrange, yrange, res)
 
 
+# 采样区域的默认范围, 与set_sample_points的默认值相同
+SAMPLE_XRANGE = (-0.5, 1.5)
+SAMPLE_YRANGE = (-1.0, 1.0)
+
+
+def img_index(points, res, tol=1e-4, xrange=SAMPLE_XRANGE, yrange=SAMPLE_YRANGE):
+    """把采样点坐标映射到图像的像素索引
+
+    像素(x, y)对应的坐标为 xf = x0 + (x1 - x0) * x / res, yf = y0 + (y1 - y0) * y / res,
+    默认范围下即 xf = (x / res - 0.5) * 2 + 0.5, yf = (y / res - 0.5) * 2,
+    采样点按先y后x的顺序排列, 机翼内部的像素没有采样点.
+    与逐像素顺序匹配的结果一致: 一旦某个点对不上像素或顺序不对, 其后的点都不再使用.
+
+    :points: (n, >=2) 采样点, 前两列为x, y坐标
+    :returns: (valid, index), valid为(n,)的bool, index为有效点的展平像素索引 y * res + x
+    """
+    px = points[:, 0]
+    py = points[:, 1]
+    dx = (xrange[1] - xrange[0]) / res
+    dy = (yrange[1] - yrange[0]) / res
+    ix = np.rint((px - xrange[0]) / dx)
+    iy = np.rint((py - yrange[0]) / dy)
+    match = (np.abs(px - (xrange[0] + ix * dx)) < tol) & (np.abs(py - (yrange[0] + iy * dy)) < tol)
+    match &= (ix >= 0) & (ix < res) & (iy >= 0) & (iy < res)
+    index = (iy * res + ix).astype(np.int64)
+    match[1:] &= index[1:] > index[:-1]
+    valid = np.logical_and.accumulate(match)
+    return valid, index[valid]
+
+
 def coord2img(
     freestreamX,
     freestreamY,
     args,
+    data=None,
 ):
     # output layout channels:
     # [0] freestream field X + boundary
@@ -49,44 +82,30 @@ def coord2img(
     # [3] pressure output
     # [4] velocity X output
     # [5] velocity Y output
-    dir = f"{args.case_dir}/postProcessing/internalCloud/500/"
+    if data is None:
+        data = SampleData(args.case_dir)
     res = args.res
-    npOutput = np.zeros((6, res, res), dtype=np.float32)
-
-    pfile = f"{dir}/cloud_p.xy"
-    ar = np.loadtxt(pfile)
-    curIndex = 0
-
-    for y in range(res):
-        for x in range(res):
-            xf = (x / res - 0.5) * 2 + 0.5
-            yf = (y / res - 0.5) * 2
-            if abs(ar[curIndex][0] - xf) < 1e-4 and abs(ar[curIndex][1] - yf) < 1e-4:
-                npOutput[3][x][y] = ar[curIndex][3]
-                curIndex += 1
-                # fill input as well
-                npOutput[0][x][y] = freestreamX
-                npOutput[1][x][y] = freestreamY
-            else:
-                npOutput[3][x][y] = 0
-                # fill mask
-                npOutput[2][x][y] = 1.0
-
-    ufile = f"{dir}/cloud_U.xy"
-    ar = np.loadtxt(ufile)
-    curIndex = 0
-
-    for y in range(res):
-        for x in range(res):
-            xf = (x / res - 0.5) * 2 + 0.5
-            yf = (y / res - 0.5) * 2
-            if abs(ar[curIndex][0] - xf) < 1e-4 and abs(ar[curIndex][1] - yf) < 1e-4:
-                npOutput[4][x][y] = ar[curIndex][3]
-                npOutput[5][x][y] = ar[curIndex][4]
-                curIndex += 1
-            else:
-                npOutput[4][x][y] = 0
-                npOutput[5][x][y] = 0
+    xrange = getattr(args, "sample_xrange", SAMPLE_XRANGE)
+    yrange = getattr(args, "sample_yrange", SAMPLE_YRANGE)
+    # 采样点按先y后x排列, 先按[y][x]连续写入, 最后一次转置成[x][y]
+    buf = np.zeros((6, res * res), dtype=np.float32)
+
+    ar = data.cloud_p
+    valid, index = img_index(ar, res, xrange=xrange, yrange=yrange)
+    buf[3][index] = ar[valid, 3]
+    # fill input as well
+    buf[0][index] = freestreamX
+    buf[1][index] = freestreamY
+    # fill mask
+    buf[2] = 1.0
+    buf[2][index] = 0
+
+    ar = data.cloud_U
+    valid, index = img_index(ar, res, xrange=xrange, yrange=yrange)
+    buf[4][index] = ar[valid, 3]
+    buf[5][index] = ar[valid, 4]
+
+    npOutput = np.ascontiguousarray(buf.reshape(6, res, res).transpose(0, 2, 1))
 
     # data_img = {
     #     "fsX_img": npOutput[0],
@@ -99,13 +118,11 @@ def coord2img(
     return npOutput
 
 
-def get_airfoil_data(case_dir):
+def get_airfoil_data(case_dir, data=None):
+    if data is None:
+        data = SampleData(case_dir)
     # 机翼上测点的压强
-    aerofoil_p = np.loadtxt(
-        f"{case_dir}/postProcessing/airfoilBoundary/500/p_aerofoil.raw",
-        skiprows=2,
-        dtype=np.float32,
-    )
+    aerofoil_p = data.aerofoil_p.astype(np.float32)
     aerofoil_p = sort_points(aerofoil_p[:, [0, 1, 3]])
     airfoil_x = aerofoil_p[:, 0]
     airfoil_y = aerofoil_p[:, 1]
@@ -118,14 +135,12 @@ def get_airfoil_data(case_dir):
     return airfoil_data
 
 
-def get_grid_data(args):
+def get_grid_data(args, data=None):
+    if data is None:
+        data = SampleData(args.case_dir)
     # 外部流场的网格节点数据
-    cloud_p = np.loadtxt(
-        f"{args.case_dir}/postProcessing/internalCloud/500/cloud_p.xy", dtype=np.float32
-    )
-    cloud_U = np.loadtxt(
-        f"{args.case_dir}/postProcessing/internalCloud/500/cloud_U.xy", dtype=np.float32
-    )
+    cloud_p = data.cloud_p
+    cloud_U = data.cloud_U
     grid_x = cloud_p[:, 0]
     grid_y = cloud_p[:, 1]
     grid_p = cloud_p[:, 3]
@@ -141,24 +156,24 @@ def get_grid_data(args):
 
     grid_xyp = cloud_p[:, [0, 1, 3]]
     grid_uv = cloud_U[:, [3, 4]]
-    grid_data = np.concatenate([grid_xyp, grid_uv], axis=1)
+    grid_data = np.concatenate([grid_xyp, grid_uv], axis=1).astype(np.float32)
 
     return grid_data
 
 
-def get_raw_mesh(case_dir):
+def get_raw_mesh(case_dir, time=None):
     # 流场中网格的原始数据，网格中心坐标，对应的p,U
+    if time is None:
+        time = latest_time(case_dir)
 
-    cell_xyz = ParsedParameterFile(
-        f"{case_dir}/500/C").content["internalField"]
-    cell_p = ParsedParameterFile(f"{case_dir}/500/p").content["internalField"]
-    cell_U = ParsedParameterFile(f"{case_dir}/500/U").content["internalField"]
+    cell_xyz = read_foam_field(f"{case_dir}/{time}/C")
+    cell_p = read_foam_field(f"{case_dir}/{time}/p")
+    cell_U = read_foam_field(f"{case_dir}/{time}/U")
 
-    cell_x = np.array(cell_xyz)[:, 0]
-    cell_y = np.array(cell_xyz)[:, 1]
-    cell_p = np.array(cell_p)
-    cell_Ux = np.array(cell_U)[:, 0]
-    cell_Uy = np.array(cell_U)[:, 1]
+    cell_x = cell_xyz[:, 0]
+    cell_y = cell_xyz[:, 1]
+    cell_Ux = cell_U[:, 0]
+    cell_Uy = cell_U[:, 1]
 
     raw_mesh_data = {
         "cell_x": cell_x,
@@ -171,41 +186,142 @@ def get_raw_mesh(case_dir):
     return raw_mesh_data
 
 
+def get_residuals(case_dir):
+    """求解过程中每步的初始残差, {"Time": (n,), 场名: (n,)}, 没有记录时返回None"""
+    fname = f"{case_dir}/{RESIDUALS_FILE}"
+    try:
+        return read_residuals(fname)
+    except FileNotFoundError:
+        return None
+
+
+def _front_guess(x, y, nbins):
+    """初始猜测: 在y方向上下包络的中线以上的点放到前端, (b, n)"""
+    b, n = x.shape
+    lo, hi = x[:, :1], x[:, -1:]
+    bins = np.minimum(((x - lo) / np.maximum(hi - lo, 1e-30) * nbins).astype(np.int64), nbins - 1)
+    flat = (np.arange(b)[:, None] * nbins + bins).ravel()
+    ymax = np.full(b * nbins, -np.inf)
+    ymin = np.full(b * nbins, np.inf)
+    np.maximum.at(ymax, flat, y.ravel())
+    np.minimum.at(ymin, flat, y.ravel())
+    mid = (ymax[flat] + ymin[flat]).reshape(b, n) / 2
+    front = y > mid
+    front[:, 0] = False
+    return front
+
+
+def _front_update(y, front):
+    """在给定的分配下, 按逐点规则重新计算每个点的分配, (b, n)"""
+    b, n = y.shape
+    idx = np.broadcast_to(np.arange(n), (b, n))
+    # 每个点之前最后一个放到前端/后端的点, 前端为空时为第一个点
+    last_front = np.zeros((b, n), dtype=np.int64)
+    last_back = np.zeros((b, n), dtype=np.int64)
+    np.maximum.accumulate(np.where(front, idx, 0)[:, :-1], axis=1, out=last_front[:, 1:])
+    np.maximum.accumulate(np.where(front, 0, idx)[:, :-1], axis=1, out=last_back[:, 1:])
+    rows = np.arange(b)[:, None]
+    new = np.abs(y - y[rows, last_front]) < np.abs(y - y[rows, last_back])
+    # 第一个点放到后端, 第二个点按与第一个点的高低分配
+    new[:, :1] = False
+    new[:, 1:2] = y[:, 1:2] >= y[:, :1]
+    return new
+
+
+def _front_walk(yl, fl, start, last_front, last_back, window=0):
+    """从start开始逐点分配, 直到连续window个点与fl中原来的分配一致(window为0时算到最后)
+
+    :yl: 按x升序的y坐标列表
+    :fl: 分配列表, True表示放到前端, 原地修改
+    :last_front, last_back: start之前最后一个放到前端/后端的点
+    """
+    agree = 0
+    for i in range(start, len(yl)):
+        if i == 1:
+            to_front = yl[1] >= yl[0]
+        else:
+            to_front = abs(yl[i] - yl[last_front]) < abs(yl[i] - yl[last_back])
+        if to_front == fl[i]:
+            agree += 1
+            if window and agree >= window:
+                break
+        else:
+            agree = 0
+            fl[i] = to_front
+        if to_front:
+            last_front = i
+        else:
+            last_back = i
+    return fl
+
+
+def _front_repair(y, front, window=8):
+    """逐段修正一个样本的分配, 直到每个点都满足逐点规则
+
+    每一轮用整个数组找到第一个不满足规则的点, 从这里开始逐点计算, 然后再检查一次.
+    逐点计算用python浮点数, 与数组精度不同的极少数情况由下一轮的检查修正.
+    """
+    yl = y.tolist()
+    while True:
+        new = _front_update(y[None], front[None])[0]
+        mismatch = np.flatnonzero(new != front)
+        if len(mismatch) == 0:
+            return front
+        m = mismatch[0]
+        front[m] = new[m]
+        fronts = np.flatnonzero(front[: m + 1])
+        last_front = fronts[-1] if len(fronts) else 0
+        last_back = np.flatnonzero(~front[: m + 1])[-1]
+        front[:] = _front_walk(yl, front.tolist(), m + 1, last_front, last_back, window)
+
+
+def sort_order(points):
+    """sort_points的排列顺序, 可以批量计算
+
+    按x升序逐点分配: 第一个点(前缘)放到后端, 之后每个点放到y更接近的一端,
+    前端的点组成上表面(从后缘到前缘), 后端的点组成下表面(从前缘到后缘).
+    逐点分配的每一步都依赖之前的结果, 点数较多时先按上下包络的中线猜测分配, 用整个数组检查每个点是否满足规则,
+    只在不满足的地方(一般在前缘和后缘附近)逐点修正, 结果与逐点计算完全相同.
+
+    :points: (n, >=2) 或 (b, n, >=2) 的散乱点, 前两列为x, y, 批量计算时每个样本的点数相同
+    :returns: (n,) 或 (b, n) 的索引
+    """
+    points = np.asarray(points)
+    batch = points[None] if points.ndim == 2 else points
+    idx = np.argsort(batch[:, :, 0], axis=1)  # 升序
+    rows = np.arange(len(batch))[:, None]
+    x = batch[rows, idx, 0]
+    y = batch[rows, idx, 1]
+
+    n = x.shape[1]
+    if n < 1024:
+        # 点数较少时直接逐点计算更快, 之后同样用整个数组检查
+        front = np.array([_front_walk(yk.tolist(), [False] * n, 1, 0, 0) for yk in y], dtype=bool)
+        front = front.reshape(x.shape)
+        window = 0
+    else:
+        front = _front_guess(x, y, int(np.sqrt(n)))
+        window = 8
+    done = np.all(_front_update(y, front) == front, axis=1)
+    order = np.empty_like(idx)
+    for k in range(len(batch)):
+        if not done[k]:
+            front[k] = _front_repair(y[k], front[k], window)
+        f = idx[k][front[k]]
+        order[k] = np.concatenate([f[::-1], idx[k][~front[k]]])
+    return order[0] if points.ndim == 2 else order
+
+
 def sort_points(points):
     """将散乱的点按照机翼表面轮廓的顺序排列
     输入输出都是二维array，每一行都是一个样本点
     排序后最右侧点为起点，绕逆时针一周
+    也可以输入 (b, n, m) 的三维array, 对每个样本分别排序
     """
-    sorted_points = [[], [], []]
-    idx = np.argsort(points[:, 0]).tolist()  # 升序
-    x = points[idx, 0]
-    y = points[idx, 1]
-    p = points[idx, 2]
-
-    for i, (_x, _y, _p) in enumerate(zip(x, y, p)):
-        if i == 0:
-            sorted_points[0].append(x[i])
-            sorted_points[1].append(y[i])
-            sorted_points[2].append(p[i])
-        elif i == 1:
-            if _y >= sorted_points[1][-1]:
-                sorted_points[0].insert(0, x[i])
-                sorted_points[1].insert(0, y[i])
-                sorted_points[2].insert(0, p[i])
-            else:
-                sorted_points[0].append(_x)
-                sorted_points[1].append(_y)
-                sorted_points[2].append(_p)
-        else:
-            if abs(_y - sorted_points[1][0]) < abs(_y - sorted_points[1][-1]):
-                sorted_points[0].insert(0, x[i])
-                sorted_points[1].insert(0, y[i])
-                sorted_points[2].insert(0, p[i])
-            else:
-                sorted_points[0].append(x[i])
-                sorted_points[1].append(y[i])
-                sorted_points[2].append(p[i])
-    return np.array(sorted_points).T
+    order = sort_order(points)
+    if order.ndim == 1:
+        return points[order]
+    return np.take_along_axis(points, order[..., None], axis=-2)
 
 
 def read(fname, suffix):
@@ -1,81 +1,282 @@
+import hashlib
 import os
+import re
+import shutil
 
 import numpy as np
-from PyFoam.RunDictionary.ParsedParameterFile import ParsedParameterFile
+
+from .. import trace
+from ..utils.utils import run_cmd
+from .foamdict import (DictTemplate, blank_comments, block_end, entries,
+                       format_value, last_token, write_dict)
+from .reader import time_dirs
+
+
+def _transfile_template(text):
+    # rho和nu的值是 [量纲] 数值, 只替换最后的数值
+    blank = blank_comments(text)
+    top = entries(blank)
+    slots = [(key, *last_token(blank, *top[key][:2])) for key in ('rho', 'nu')]
+    return DictTemplate(text, slots)
 
 
 def set_transfile(case_dir, rho, nu):
     # 设置物性参数
-    transFile = ParsedParameterFile(f'{case_dir}/constant/transportProperties')
-    transFile['rho'][1] = rho
-    transFile['nu'][1] = nu
-    transFile.writeFile()
+    write_dict(f'{case_dir}/constant/transportProperties', _transfile_template,
+               rho=format_value(rho), nu=format_value(nu))
     print(f'set rho={rho}, nu={nu}')
 
 
+def _decomposefile_template(text):
+    start, end, _ = entries(blank_comments(text))['numberOfSubdomains']
+    return DictTemplate(text, [('subdomains', start, end)])
+
+
 def set_decomposefile(case_dir, subdomains):
     # 设置计算域分解文件
-    decomposeParDict = ParsedParameterFile(
-        f'{case_dir}/system/decomposeParDict')
-    decomposeParDict['numberOfSubdomains'] = subdomains
-    decomposeParDict.writeFile()
+    write_dict(f'{case_dir}/system/decomposeParDict', _decomposefile_template,
+               subdomains=format_value(subdomains))
     print(f'set subdomains={subdomains}')
 
 
-def set_runfile(case_dir, subdomains, parallel_enable):
+def run_steps(subdomains, parallel_enable, mpirun_args="", fields=None):
+    """Allrun中依次运行的步骤, [(名称, 命令)]
+
+    :fields: 需要重构的场, 默认重构所有场; 只重构最后一个时间步
+    """
+    if not parallel_enable:
+        return [("solver", "$application")]
+    mpirun = " ".join(filter(None, ["mpirun", mpirun_args, f"-np {subdomains}"]))
+    reconstruct = "reconstructPar -latestTime"
+    if fields:
+        reconstruct += " -fields '({})'".format(" ".join(fields))
+    return [
+        ("decomposePar", "decomposePar -force"),
+        ("solver", f"{mpirun} $application -parallel"),
+        ("reconstructPar", reconstruct),
+    ]
+
+
+def set_runfile(case_dir, subdomains, parallel_enable, mpirun_args="", fields=None):
+    """写Allrun, 不带参数时运行所有步骤, sh ./Allrun 名称 只运行其中一步
+
+    :returns: 步骤名称列表
+    """
+    steps = run_steps(subdomains, parallel_enable, mpirun_args, fields)
     cmd = ""
     cmd += "cd ${0%/*} || exit\n"
     cmd += ". $WM_PROJECT_DIR/bin/tools/RunFunctions\n"
     cmd += "application=`getApplication`\n"
-    if parallel_enable:
-        cmd += "decomposePar -force >> foam.log\n"
-        cmd += f"mpirun -np {subdomains} $application -parallel >> foam.log\n"
-        cmd += "reconstructPar >> foam.log\n"
-    else:
-        cmd += "$application >> foam.log\n"
+    cmd += "step=${1:-all}\n"
+    for name, step in steps:
+        cmd += f'if [ "$step" = all ] || [ "$step" = {name} ]; then {step} >> foam.log; fi\n'
 
     with open(f'{case_dir}/Allrun', 'w') as f:
         f.write(cmd)
+    return [name for name, _ in steps]
+
+
+def _ufile_template(text):
+    # internalField和所有freestream边界的freestreamValue, 没有freestreamValue时在边界的最后插入
+    blank = blank_comments(text)
+    top = entries(blank)
+    slots = [('U', *top['internalField'][:2])]
+    start, end, _ = top['boundaryField']
+    for name, (pstart, pend, sub) in entries(blank, start, end).items():
+        if not sub:
+            continue
+        patch = entries(blank, pstart, pend)
+        if 'type' not in patch or blank[slice(*patch['type'][:2])].strip() != 'freestream':
+            continue
+        if 'freestreamValue' in patch:
+            slots.append(('U', *patch['freestreamValue'][:2]))
+        else:
+            slots.append(('U', pend, pend, '    freestreamValue {};\n    '))
+    return DictTemplate(text, slots)
 
 
 def set_ufile(case_dir, fsX, fsY):
-    ufile = ParsedParameterFile(f'{case_dir}/0/U')
-    ufile['internalField'] = f'uniform ({fsX:.4f} {fsY:.4f} 0)'
-    for bname, bdict in ufile['boundaryField'].items():
-        if bdict.get('type') == 'freestream':
-            bdict['freestreamValue'] = f'uniform ({fsX:.4f} {fsY:.4f} 0)'
-    ufile.writeFile()
+    write_dict(f'{case_dir}/0/U', _ufile_template, U=f'uniform ({fsX:.4f} {fsY:.4f} 0)')
+
+
+def remove_times(case_dir):
+    """删除上一个样本留下的时间步目录, 求解器提前停止时最后的时间步才是本次的结果"""
+    for name in time_dirs(case_dir):
+        shutil.rmtree(os.path.join(case_dir, name))
+
+
+# processor0中记录分解时的网格和decomposeParDict
+DECOMPOSITION_FILE = '.decomposition'
+
+_ENTRY = re.compile(r'("[^"]*"|[^\s{}";()]+)\s*\{')
+_BOUNDARY_FIELD = re.compile(r'^boundaryField\s*\{', re.MULTILINE)
+_UNIFORM_FIELD = re.compile(r'^internalField\s+uniform\s+([^;]*);', re.MULTILINE)
+_PATCH_TYPE = re.compile(r'\btype\s+(\w+)\s*;')
+
+
+def dict_entries(text, start=0, end=None):
+    """text[start:end]中的子字典 名称 { 内容 }, 返回 [(名称, 内容)], 名称保留引号"""
+    end = len(text) if end is None else end
+    entries = []
+    pos = start
+    while True:
+        m = _ENTRY.search(text, pos, end)
+        if m is None:
+            return entries
+        close = block_end(text, m.end() - 1)
+        entries.append((m.group(1), text[m.end():close]))
+        pos = close + 1
+
+
+def read_patches(fname):
+    """polyMesh/boundary中的边界, [(名称, 类型)]"""
+    with open(fname, 'rt') as f:
+        text = f.read()
+    return [(name, _PATCH_TYPE.search(body).group(1))
+            for name, body in dict_entries(text) if name != 'FoamFile']
+
+
+def _patch_body(entries, name):
+    """边界条件中名称为name的条目, 引号中的名称按正则表达式匹配, 后面的优先"""
+    for key, body in entries:
+        if key == name:
+            return body
+    for key, body in reversed(entries):
+        if key.startswith('"') and re.fullmatch(key.strip('"'), name):
+            return body
+    return None
+
+
+def processor_field(text, value, patches):
+    """由case的场文件生成processor中的场文件
+
+    内部场和原有的边界条件不变, processor边界的值取内部场的均匀值,
+    没有写出的边界(如setConstraintTypes中的empty)只写类型
+    :text: 0/中的场文件, 内部场是uniform
+    :value: 内部场的值, 如 (1 0 0)
+    :patches: processor网格的边界 [(名称, 类型)]
+    """
+    m = _BOUNDARY_FIELD.search(text)
+    close = block_end(text, m.end() - 1)
+    entries = dict_entries(text, m.end(), close)
+    lines = ['\n']
+    for name, typ in patches:
+        if typ in ('processor', 'processorCyclic'):
+            body = f'\n        type            {typ};\n        value           uniform {value};\n    '
+        else:
+            body = _patch_body(entries, name)
+            if body is None:
+                body = f'\n        type            {typ};\n    '
+        lines.append(f'    {name}\n    {{{body}}}\n')
+    return text[:m.end()] + ''.join(lines) + text[close:]
+
+
+def processor_dirs(case_dir):
+    """case_dir中的processor*目录, 按编号排序"""
+    names = [name for name in os.listdir(case_dir) if re.fullmatch(r'processor\d+', name)]
+    return [os.path.join(case_dir, name) for name in sorted(names, key=lambda name: int(name[9:]))]
+
+
+def decomposition_key(case_dir):
+    """网格分解的标识, 网格和decomposeParDict都相同时processor*中的网格可以复用"""
+    h = hashlib.sha256(mesh_key(case_dir).encode())
+    with open(f'{case_dir}/system/decomposeParDict', 'rb') as f:
+        h.update(f.read())
+    return h.hexdigest()
+
+
+def save_decomposition(case_dir):
+    """decomposePar之后记录分解的标识"""
+    with open(f'{case_dir}/processor0/{DECOMPOSITION_FILE}', 'wt') as f:
+        f.write(decomposition_key(case_dir))
 
 
-def set_sample_points(case_dir, xrange=(-0.5, 1.5, 128), yrange=(-1.0, 1.0, 128)):
+def decomposition_valid(case_dir, subdomains):
+    """processor*是否是当前网格和decomposeParDict的分解结果"""
+    procs = processor_dirs(case_dir)
+    if len(procs) != subdomains:
+        return False
+    try:
+        with open(f'{procs[0]}/{DECOMPOSITION_FILE}', 'rt') as f:
+            return f.read().strip() == decomposition_key(case_dir)
+    except FileNotFoundError:
+        return False
+
+
+def clean_decomposed(case_dir):
+    """代替Allclean, 删除上一个样本的结果, 保留processor*中分解好的网格"""
+    remove_times(case_dir)
+    for proc in processor_dirs(case_dir):
+        remove_times(proc)
+    shutil.rmtree(f'{case_dir}/postProcessing', ignore_errors=True)
+
+
+def decompose_fields(case_dir, run=run_cmd):
+    """把0/中的场写入已经分解好的processor*/0, 不重新分解网格
+
+    均匀初值的场直接改写各个processor中的文件, 不需要启动OpenFOAM;
+    有非均匀的场时(热启动)运行 decomposePar -fields, 只分解场
+    :run: 运行外部命令的函数, 参数和返回值与run_cmd相同
+    :returns: 0表示成功
+    """
+    zero = f'{case_dir}/0'
+    fields = {}
+    for name in sorted(os.listdir(zero)):
+        # 跳过热启动的备份等文件
+        if '.' in name or not os.path.isfile(f'{zero}/{name}'):
+            continue
+        with open(f'{zero}/{name}', 'rt') as f:
+            text = f.read()
+        m = _UNIFORM_FIELD.search(text)
+        if m is None:
+            return run('decomposePar -fields >> foam.log', case_dir)
+        fields[name] = (text, m.group(1).strip())
+
+    for proc in processor_dirs(case_dir):
+        patches = read_patches(f'{proc}/constant/polyMesh/boundary')
+        for name, (text, value) in fields.items():
+            fname = f'{proc}/0/{name}'
+            with open(f'{fname}.tmp', 'wt') as f:
+                f.write(processor_field(text, value, patches))
+            os.replace(f'{fname}.tmp', fname)
+    return 0
+
+
+def set_sample_points(case_dir, xrange=(-0.5, 1.5, 128), yrange=(-1.0, 1.0, 128), z=0.5):
     """set sample dict x,y coordinates according to range and resolution.
 
+    第i个采样点的坐标为 lower + (upper - lower) * i / resolution, 不包含upper,
+    与coord2img中的像素一一对应, 点按先y后x排列.
+    文件第一行记录参数的哈希, 与已有的文件相同时不再重写.
+
     :case_dir: case directory
     :xrange: x range for sampling: (x_lower, x_upper, x_resolution)
     :yrange: y range for sampling: (y_lower, y_upper, y_resolution)
-    :returns: None
+    :returns: True表示重写了system/points
 
     """
-    xrange = (-0.5, 0.5, 96)
-    yrange = (-1.0, 1.0, 306)
-    x = np.linspace(*xrange)
-    y = np.linspace(*yrange)
-    X, Y = np.meshgrid(x, y)
-    X_ = X.reshape(-1, 1)
-    Y_ = Y.reshape(-1, 1)
-    XY = np.hstack((X_, Y_))
+    xrange = (float(xrange[0]), float(xrange[1]), int(xrange[2]))
+    yrange = (float(yrange[0]), float(yrange[1]), int(yrange[2]))
+    fname = f'{case_dir}/system/points'
+    key = hashlib.sha256(repr((xrange, yrange, float(z))).encode()).hexdigest()
+    header = f'// sample points {key}\n'
+    if os.path.exists(fname):
+        with open(fname, 'rt') as f:
+            if f.readline() == header:
+                return False
 
-    precesion = 6  # TODO: set precesion in string format
+    x = xrange[0] + (xrange[1] - xrange[0]) * np.arange(xrange[2]) / xrange[2]
+    y = yrange[0] + (yrange[1] - yrange[0]) * np.arange(yrange[2]) / yrange[2]
+    # 每一行的x都相同, 先格式化一行的模板, 再逐行填入y
+    row = ''.join(f'({xi:.6f} {{0}} {z})\n' for xi in x)
+    body = ''.join(row.format(f'{yi:.6f}') for yi in y)
 
-    point_list = []
-    for i, point in enumerate(XY):
-        point_list.append(f'({point[0]:.6f} {point[1]:.6f} {0.5})')
-
-    cloud_file = ParsedParameterFile(
-        f'{case_dir}/system/points', noHeader=True)
-    cloud_file['points'] = point_list
-    cloud_file.writeFile()
-    cloud_file.closeFile()
+    tmp = f'{fname}.tmp'
+    with open(tmp, 'wt') as f:
+        f.write(f'{header}points\n(\n{body});\n')
+    os.replace(tmp, fname)
+    print(f'set sample points {xrange[2]}x{yrange[2]} in [{xrange[0]}, {xrange[1]}) x [{yrange[0]}, {yrange[1]})')
+    return True
 
 
 def pre_process(args):
@@ -85,7 +286,29 @@ def pre_process(args):
     set_runfile(args, args.case_dir, args.subdomains)
 
 
-def gen_mesh(ar):
+GMSH_CMD = "gmsh airfoil.geo -3 -o airfoil.msh > /dev/null"
+GMSH_TO_FOAM_CMD = "gmshToFoam airfoil.msh > /dev/null"
+
+
+def mesh_key(case_dir="."):
+    """网格的标识, airfoil.geo内容和网格命令的哈希, 相同的键对应相同的网格"""
+    h = hashlib.sha256()
+    with open(f"{case_dir}/airfoil.geo", "rb") as f:
+        h.update(f.read())
+    for cmd in (GMSH_CMD, GMSH_TO_FOAM_CMD):
+        h.update(b"\0")
+        h.update(cmd.encode())
+    h.update(b"\0")
+    return h.hexdigest()
+
+
+def gen_mesh(ar, case_dir=".", cache=None, run=run_cmd):
+    """根据翼型坐标画网格, 结果在case_dir/constant/polyMesh中
+
+    :cache: MeshCache, 相同的airfoil.geo直接恢复缓存的网格, 不再运行gmsh
+    :run: 运行外部命令的函数, 参数和返回值与run_cmd相同, 如Supervisor.run
+    :returns: 0表示成功, -1表示失败
+    """
     # removing duplicate end point
     if np.max(np.abs(ar[0] - ar[-1])) < 1e-6:
         ar = ar[:-1]
@@ -98,24 +321,35 @@ def gen_mesh(ar):
             pointIndex, ar[n][0], ar[n][1])
         pointIndex += 1
 
-    with open("airfoil_template.geo", "rt") as inFile:
-        with open("airfoil.geo", "wt") as outFile:
+    with open(f"{case_dir}/airfoil_template.geo", "rt") as inFile:
+        with open(f"{case_dir}/airfoil.geo", "wt") as outFile:
             for line in inFile:
                 line = line.replace("POINTS", "{}".format(output))
                 line = line.replace("LAST_POINT_INDEX",
                                     "{}".format(pointIndex - 1))
                 outFile.write(line)
 
-    if os.system("gmsh airfoil.geo -3 -o airfoil.msh > /dev/null") != 0:
+    if cache is not None:
+        key = mesh_key(case_dir)
+        if cache.get(key, case_dir):
+            print("\tmesh cache hit")
+            return 0
+
+    with trace.stage("gmsh", subprocess=True):
+        ret = run(GMSH_CMD, case_dir)
+    if ret != 0:
         print("error during mesh creation!")
         return -1
 
-    if os.system("gmshToFoam airfoil.msh > /dev/null") != 0:
+    with trace.stage("gmshToFoam", subprocess=True):
+        ret = run(GMSH_TO_FOAM_CMD, case_dir)
+    if ret != 0:
         print("error during conversion to OpenFoam mesh!")
         return -1
 
-    with open("constant/polyMesh/boundary", "rt") as inFile:
-        with open("constant/polyMesh/boundaryTemp", "wt") as outFile:
+    boundary = f"{case_dir}/constant/polyMesh/boundary"
+    with open(boundary, "rt") as inFile:
+        with open(f"{boundary}Temp", "wt") as outFile:
             inBlock = False
             inAerofoil = False
             for line in inFile:
@@ -131,6 +365,9 @@ def gen_mesh(ar):
                     line = line.replace("patch", "wall")
                     inAerofoil = False
                 outFile.write(line)
-    os.rename("constant/polyMesh/boundaryTemp", "constant/polyMesh/boundary")
+    os.rename(f"{boundary}Temp", boundary)
+
+    if cache is not None:
+        cache.put(key, case_dir)
 
     return 0
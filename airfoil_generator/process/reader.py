@@ -0,0 +1,231 @@
+import os
+import re
+from itertools import islice
+
+import numpy as np
+
+# numpy>=1.23的loadtxt由C实现, 比其他纯numpy的文本解析都快;
+# 旧版本的loadtxt是逐行的python循环, 改用fromstring一次解析整个文件
+_C_LOADTXT = tuple(int(v) for v in np.__version__.split(".")[:2]) >= (1, 23)
+
+
+def read_table(fname, skiprows=0, dtype=np.float64):
+    """一次性读取空白分隔的数值表格
+
+    :fname: 文件路径
+    :skiprows: 跳过开头的行数, 开头以#开始的注释行也会被跳过
+    :returns: (n, ncols) 的array
+
+    """
+    with open(fname, "rt") as f:
+        for _ in range(skiprows):
+            f.readline()
+        pos = f.tell()
+        line = f.readline()
+        while line.startswith("#"):
+            pos = f.tell()
+            line = f.readline()
+        ncols = len(line.split())
+        if ncols == 0:
+            return np.zeros((0, 0), dtype=dtype)
+        f.seek(pos)
+        if _C_LOADTXT:
+            return np.loadtxt(f, dtype=dtype, ndmin=2)
+        data = np.fromstring(f.read(), dtype=dtype, sep=" ")
+
+    if data.size % ncols != 0:
+        raise ValueError(f"inconsistent columns in {fname}")
+    return data.reshape(-1, ncols)
+
+
+def time_dirs(case_dir):
+    """case_dir中大于0的时间步目录名, 按时间排序"""
+    times = []
+    for name in os.listdir(case_dir):
+        try:
+            t = float(name)
+        except ValueError:
+            continue
+        if t > 0 and os.path.isdir(os.path.join(case_dir, name)):
+            times.append((t, name))
+    return [name for _, name in sorted(times)]
+
+
+def latest_time(case_dir):
+    """最后写出的时间步目录名, 没有时返回None
+
+    求解器提前收敛或停止时不一定是endTime, 只有postProcessing时从其中的时间步目录判断
+    """
+    times = time_dirs(case_dir)
+    if times:
+        return times[-1]
+    cloud = os.path.join(case_dir, "postProcessing", "internalCloud")
+    if os.path.isdir(cloud):
+        times = time_dirs(cloud)
+        if times:
+            return times[-1]
+    return None
+
+
+class SampleData(object):
+    """一个样本的OpenFOAM后处理结果
+
+    每个文件在第一次访问时解析一次并保存在内存中, coord2img, get_grid_data,
+    read_sample和get_airfoil_data都从这里取数据, 不再重复读文件
+    :time: 结果的时间步, 默认为最后写出的时间步
+    """
+
+    def __init__(self, case_dir, time=None):
+        self.case_dir = case_dir
+        self.time = latest_time(case_dir) if time is None else time
+        self._cache = {}
+
+    def _read(self, fname, skiprows=0):
+        if fname not in self._cache:
+            self._cache[fname] = read_table(
+                f"{self.case_dir}/{fname}", skiprows=skiprows
+            )
+        return self._cache[fname]
+
+    @property
+    def cloud_p(self):
+        """(n, 4) x y z p"""
+        return self._read(f"postProcessing/internalCloud/{self.time}/cloud_p.xy")
+
+    @property
+    def cloud_U(self):
+        """(n, 6) x y z Ux Uy Uz"""
+        return self._read(f"postProcessing/internalCloud/{self.time}/cloud_U.xy")
+
+    @property
+    def aerofoil_p(self):
+        """(m, 4) x y z p"""
+        return self._read(
+            f"postProcessing/airfoilBoundary/{self.time}/p_aerofoil.raw", skiprows=2
+        )
+
+
+_N_COMPONENTS = {
+    "scalar": 1,
+    "vector": 3,
+    "symmTensor": 6,
+    "tensor": 9,
+}
+
+
+def read_foam_header(fname):
+    """读取OpenFOAM场文件的头部和internalField的位置, 不读取数据本身
+
+    :fname: 场文件路径, 如 case/500/U
+    :returns: dict
+        format: ascii 或 binary
+        ncomp: 每个网格的分量数, scalar为1, vector为3
+        dtype: binary格式下数据的numpy类型
+        n: 网格数量, uniform场为None
+        offset: 数据在文件中的起始字节位置
+        uniform: uniform场的值, nonuniform场为None
+
+    """
+    header = {"format": "ascii", "ncomp": None, "dtype": "<f8", "uniform": None}
+    with open(fname, "rb") as f:
+        while True:
+            start = f.tell()
+            line = f.readline()
+            if not line:
+                raise ValueError(f"no internalField found in {fname}")
+            s = line.strip().rstrip(b";").decode(errors="ignore")
+            key, _, value = s.partition(" ")
+            value = value.strip().strip('"')
+            if key == "format":
+                header["format"] = value
+            elif key == "class":
+                for typ, ncomp in _N_COMPONENTS.items():
+                    if value.endswith(typ[0].upper() + typ[1:] + "Field"):
+                        header["ncomp"] = ncomp
+            elif key == "arch":
+                endian = "<" if "LSB" in value else ">"
+                bits = re.search(r"scalar=(\d+)", value)
+                size = int(bits.group(1)) // 8 if bits else 8
+                header["dtype"] = f"{endian}f{size}"
+            elif key == "internalField":
+                break
+
+        if value.startswith("uniform"):
+            uniform = value[len("uniform"):].strip().strip("()")
+            header["uniform"] = np.array(uniform.split(), dtype=np.float64)
+            header["ncomp"] = header["uniform"].size
+            header["n"] = None
+            header["offset"] = None
+            return header
+
+        # nonuniform List<type> 后面是 数量 和 "("
+        i = line.index(b"List<")
+        j = line.index(b">", i)
+        typ = line[i + 5 : j].decode()
+        header["ncomp"] = _N_COMPONENTS[typ]
+        f.seek(start + j + 1)
+        m = re.match(rb"\s*(\d+)\s*\(", f.read(64))
+        if m is None:
+            raise ValueError(f"unsupported internalField in {fname}")
+        header["n"] = int(m.group(1))
+        header["offset"] = start + j + 1 + m.end()
+    return header
+
+
+def read_foam_field(fname, mmap=False, n=None, chunk=65536):
+    """读取OpenFOAM场文件的internalField
+
+    数据直接流式写入预先分配好的array, 不生成中间的python对象.
+    支持ascii和binary两种writeFormat, binary格式可以用内存映射
+
+    :fname: 场文件路径
+    :mmap: binary格式下是否用np.memmap映射文件而不是读入内存
+    :n: uniform场展开成的网格数量
+    :chunk: ascii格式每次解析的行数
+    :returns: (n,) 的标量场 或 (n, ncomp) 的矢量场
+
+    """
+    header = read_foam_header(fname)
+    ncomp = header["ncomp"]
+
+    if header["uniform"] is not None:
+        if n is None:
+            raise ValueError(f"uniform internalField in {fname}, n is required")
+        value = header["uniform"] if ncomp > 1 else header["uniform"][0]
+        shape = (n,) if ncomp == 1 else (n, ncomp)
+        return np.broadcast_to(value, shape).copy()
+
+    n = header["n"]
+    shape = (n,) if ncomp == 1 else (n, ncomp)
+    if header["format"] == "binary":
+        if mmap:
+            return np.memmap(
+                fname,
+                dtype=header["dtype"],
+                mode="r",
+                offset=header["offset"],
+                shape=shape,
+            )
+        with open(fname, "rb") as f:
+            f.seek(header["offset"])
+            data = np.fromfile(f, dtype=header["dtype"], count=n * ncomp)
+        return data.astype(np.float64, copy=False).reshape(shape)
+
+    out = np.empty(n * ncomp)
+    k = 0
+    with open(fname, "rb") as f:
+        f.seek(header["offset"])
+        # ascii格式中每个网格的值占一行
+        lines = [f.readline()]
+        while True:
+            text = b"".join(lines).translate(None, b"();").strip()
+            if text:
+                values = np.fromstring(text.decode(), sep=" ")
+                out[k : k + values.size] = values
+                k += values.size
+            if k >= n * ncomp:
+                break
+            lines = list(islice(f, min(chunk, -(-(n * ncomp - k) // ncomp))))
+            if not lines:
+                raise ValueError(f"unexpected end of file in {fname}")
+    return out.reshape(shape)
@@ -0,0 +1,230 @@
+import argparse
+import hashlib
+import os
+import shutil
+import time
+import uuid
+
+import numpy as np
+from matplotlib.path import Path as PolyPath
+from scipy import sparse
+from scipy.spatial import Delaunay
+
+from .meshcache import dir_size
+from .postprocess import SAMPLE_XRANGE, SAMPLE_YRANGE
+
+
+def mesh_hash(cell_x, cell_y, airfoil=None):
+    """网格的标识, 网格中心坐标和翼型轮廓的哈希, 同一个网格上的样本得到相同的键"""
+    h = hashlib.sha256()
+    for values in (cell_x, cell_y) + (() if airfoil is None else (airfoil,)):
+        h.update(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def grid_key(res, xrange, yrange):
+    return f"{int(res)}_{float(xrange[0]):g}_{float(xrange[1]):g}_{float(yrange[0]):g}_{float(yrange[1]):g}"
+
+
+def pixel_points(res, xrange=SAMPLE_XRANGE, yrange=SAMPLE_YRANGE):
+    """像素坐标, 与set_sample_points相同, 按先y后x排列, (res * res, 2)"""
+    x = xrange[0] + (xrange[1] - xrange[0]) * np.arange(res) / res
+    y = yrange[0] + (yrange[1] - yrange[0]) * np.arange(res) / res
+    X, Y = np.meshgrid(x, y)
+    return np.c_[X.ravel(), Y.ravel()]
+
+
+def interp_weights(tri, points, airfoil=None):
+    """在Delaunay三角形内线性插值的权重矩阵
+
+    :tri: 网格中心的Delaunay三角剖分
+    :points: (m, 2) 插值点
+    :airfoil: (k, 2) 翼型轮廓, 轮廓内部的点没有权重
+    :returns: (m, 网格数量)的CSR矩阵, 每行最多3个非零元素, 三角剖分以外和翼型内部的行为空
+    """
+    simplex = tri.find_simplex(points)
+    valid = simplex >= 0
+    if airfoil is not None and len(airfoil) > 2:
+        valid &= ~PolyPath(airfoil).contains_points(points)
+    rows = np.flatnonzero(valid)
+    simplex = simplex[rows]
+    # 重心坐标
+    T = tri.transform[simplex]
+    b = np.einsum("ijk,ik->ij", T[:, :2], points[rows] - T[:, 2])
+    weights = np.c_[b, 1 - b.sum(axis=1)]
+    cols = tri.simplices[simplex]
+    return sparse.csr_matrix(
+        (weights.ravel(), (np.repeat(rows, 3), cols.ravel())),
+        shape=(len(points), tri.npoints),
+    )
+
+
+class WeightCache(object):
+    """按网格保存插值权重, 每个网格一个目录 {mesh_hash}/, 每种分辨率和范围一个 {grid_key}.npz
+
+    总大小超过max_size时按最近使用时间淘汰, 多个进程可以共用同一个目录.
+    """
+
+    def __init__(self, cache_dir, max_size=4096 * 1024**2):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_size = max_size
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, mesh, grid):
+        return os.path.join(self.cache_dir, mesh, f"{grid}.npz")
+
+    def get(self, mesh, grid):
+        path = self._path(mesh, grid)
+        try:
+            with np.load(path) as data:
+                W = sparse.csr_matrix(
+                    (data["data"], data["indices"], data["indptr"]), shape=tuple(data["shape"])
+                )
+        except (FileNotFoundError, OSError, ValueError):
+            return None
+        os.utime(os.path.dirname(path))
+        return W
+
+    def put(self, mesh, grid, W):
+        mesh_dir = os.path.join(self.cache_dir, mesh)
+        os.makedirs(mesh_dir, exist_ok=True)
+        # 先写临时文件再改名, 其他进程不会读到写了一半的权重
+        tmp = os.path.join(mesh_dir, f".tmp-{uuid.uuid4().hex}.npz")
+        np.savez(tmp, data=W.data, indices=W.indices, indptr=W.indptr, shape=np.array(W.shape))
+        os.replace(tmp, self._path(mesh, grid))
+        os.utime(mesh_dir)
+        self.evict()
+
+    def evict(self):
+        """淘汰最久未使用的网格目录, 直到总大小不超过max_size"""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if not os.path.isdir(path):
+                continue
+            try:
+                entries.append((os.path.getmtime(path), dir_size(path), path))
+            except FileNotFoundError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+class Regridder(object):
+    """从网格中心的原始数据插值出任意分辨率和范围的图像, 格式与coord2img相同
+
+    每个网格的三角剖分只建立一次, 每种分辨率和范围的权重只计算一次并保存在cache中,
+    之后每个样本只需要一次稀疏矩阵乘法.
+    样本按网格分组排列时(如plan生成的实验表), 三角剖分和权重都能连续命中.
+    """
+
+    def __init__(self, cache=None):
+        self.cache = cache
+        self._mesh = None
+        self._tri = None
+        self._weights = {}
+
+    def weights(self, cell_x, cell_y, res, xrange=SAMPLE_XRANGE, yrange=SAMPLE_YRANGE, airfoil=None):
+        """插值权重, (res * res, 网格数量), 行按先y后x排列"""
+        mesh = mesh_hash(cell_x, cell_y, airfoil)
+        if mesh != self._mesh:
+            self._mesh, self._tri, self._weights = mesh, None, {}
+        grid = grid_key(res, xrange, yrange)
+        W = self._weights.get(grid)
+        if W is None and self.cache is not None:
+            W = self.cache.get(mesh, grid)
+        if W is None:
+            if self._tri is None:
+                self._tri = Delaunay(np.c_[cell_x, cell_y])
+            W = interp_weights(self._tri, pixel_points(res, xrange, yrange), airfoil)
+            if self.cache is not None:
+                self.cache.put(mesh, grid, W)
+        self._weights[grid] = W
+        return W
+
+    def image(self, data_dict, res, xrange=SAMPLE_XRANGE, yrange=SAMPLE_YRANGE):
+        """由generate保存的样本生成 (6, res, res) 的图像, 通道与coord2img相同
+
+        样本需要包含raw_mesh_data, 有airfoil_data时翼型内部的像素记为边界
+        """
+        mesh = data_dict["raw_mesh_data"]
+        airfoil = None
+        if "airfoil_data" in data_dict:
+            airfoil = np.c_[
+                np.ravel(data_dict["airfoil_data"]["airfoil_x"]),
+                np.ravel(data_dict["airfoil_data"]["airfoil_y"]),
+            ]
+        cell_x, cell_y = np.ravel(mesh["cell_x"]), np.ravel(mesh["cell_y"])
+        W = self.weights(cell_x, cell_y, res, xrange, yrange, airfoil)
+
+        values = np.c_[np.ravel(mesh["cell_p"]), np.ravel(mesh["cell_Ux"]), np.ravel(mesh["cell_Uy"])]
+        freestream = np.ravel(data_dict["freestream"])
+        valid = np.diff(W.indptr) > 0
+        buf = np.zeros((6, res * res), dtype=np.float32)
+        buf[0][valid] = freestream[0]
+        buf[1][valid] = freestream[1]
+        buf[2][~valid] = 1.0
+        buf[3:] = (W @ values).T
+        # 与coord2img相同, 转置成[x][y]
+        return np.ascontiguousarray(buf.reshape(6, res, res).transpose(0, 2, 1))
+
+
+def parse_windows(values):
+    """[x0, x1, y0, y1, ...] -> [((x0, x1), (y0, y1)), ...]"""
+    if len(values) == 0 or len(values) % 4 != 0:
+        raise ValueError(f"window needs groups of 4 values (x0 x1 y0 y1), got {values}")
+    return [((values[i], values[i + 1]), (values[i + 2], values[i + 3])) for i in range(0, len(values), 4)]
+
+
+def regrid_from_cli(args):
+    from ..utils.utils import makeDirs
+    from ..writer import get_writer, iter_dataset
+
+    windows = parse_windows(args.regrid_window)
+    grids = [(res, xrange, yrange) for res in args.regrid_res for xrange, yrange in windows]
+    cache = None
+    if args.regrid_cache:
+        cache = WeightCache(args.regrid_cache, args.regrid_cache_size * 1024**2)
+    regridder = Regridder(cache)
+
+    # 每种分辨率和范围输出到一个子目录
+    writers = []
+    for res, xrange, yrange in grids:
+        output_dir = os.path.join(args.regrid_output, grid_key(res, xrange, yrange))
+        makeDirs(output_dir)
+        writer_args = argparse.Namespace(
+            output_dir=output_dir,
+            output_prefix=args.regrid_prefix,
+            output_format=args.regrid_format,
+            shard_size=args.shard_size,
+            shard_compress=args.shard_compress,
+            resume=False,
+        )
+        writers.append(get_writer(writer_args))
+
+    t0 = time.time()
+    count = 0
+    try:
+        for n, data_dict in iter_dataset(args.regrid_input, args.regrid_prefix):
+            if "raw_mesh_data" not in data_dict:
+                print(f"sample {n} has no raw_mesh_data, skipped")
+                continue
+            for (res, xrange, yrange), writer in zip(grids, writers):
+                sample = {
+                    "freestream": data_dict["freestream"],
+                    "data_img": regridder.image(data_dict, res, xrange, yrange),
+                }
+                if "nu" in data_dict:
+                    sample["nu"] = data_dict["nu"]
+                writer.write(n, sample)
+            count += 1
+            print(f"regridded sample {n}")
+    finally:
+        for writer in writers:
+            writer.close()
+    print(f"regridded {count} samples to {len(grids)} grids in {time.time() - t0:.1f}s, saved in {args.regrid_output}")
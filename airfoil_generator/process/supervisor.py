@@ -0,0 +1,176 @@
+import os
+import shutil
+import signal
+import subprocess
+import time
+
+
+class StageFailed(Exception):
+    """外部命令返回非0或超时"""
+
+    def __init__(self, stage, status):
+        self.stage = stage
+        self.status = status
+        super().__init__(f"{stage} {describe(status)}")
+
+
+def describe(status):
+    if status["timed_out"]:
+        text = f"timed out after {status['elapsed']:.0f}s"
+    else:
+        text = f"exited with {status['returncode']} after {status['elapsed']:.1f}s"
+    # 命令正常退出但结果不对, 如求解器没有写出时间步
+    if status.get("reason"):
+        text = f"{status['reason']} ({text})"
+    return text
+
+
+def kill_group(proc, grace=5.0):
+    """结束proc所在的整个进程组(如mpirun和它启动的求解器), 先SIGTERM, grace秒后SIGKILL"""
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    try:
+        proc.wait(timeout=grace)
+    except subprocess.TimeoutExpired:
+        pass
+    # 组中可能还有没有响应SIGTERM的进程
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    proc.wait()
+
+
+def run_supervised(cmd, cwd=".", timeout=0, log=None, poll=None, interval=0.5, grace=5.0):
+    """在新的进程组中运行shell命令, 超时后结束整个进程组
+
+    :timeout: 墙钟时间上限, 单位秒, 0表示不限制
+    :log: 标准输出和标准错误追加到这个文件, 命令中自己的重定向优先
+    :poll: 等待期间每interval秒调用一次, 返回True时结束进程组
+    :returns: 退出状态 {"cmd", "returncode", "timed_out", "killed", "elapsed"}
+    """
+    t0 = time.time()
+    timed_out = killed = False
+    out = open(log, "ab") if log else None
+    try:
+        proc = subprocess.Popen(
+            cmd, shell=True, cwd=cwd, stdout=out, stderr=out, start_new_session=True
+        )
+        try:
+            while True:
+                wait = interval if poll is not None else None
+                if timeout > 0:
+                    remaining = timeout - (time.time() - t0)
+                    if remaining <= 0:
+                        timed_out = True
+                        kill_group(proc, grace)
+                        break
+                    wait = remaining if wait is None else min(wait, remaining)
+                try:
+                    proc.wait(timeout=wait)
+                    break
+                except subprocess.TimeoutExpired:
+                    pass
+                if poll is not None and poll():
+                    killed = True
+                    kill_group(proc, grace)
+                    break
+        except BaseException:
+            if proc.poll() is None:
+                kill_group(proc, grace)
+            raise
+    finally:
+        if out is not None:
+            out.close()
+    return {
+        "cmd": cmd,
+        "returncode": proc.returncode,
+        "timed_out": timed_out,
+        "killed": killed,
+        "elapsed": time.time() - t0,
+    }
+
+
+def rotate_logs(log_dir, keep):
+    """只保留log_dir中最新的keep个样本日志, 失败样本的日志(*.failed.log)不删除"""
+    logs = []
+    for name in os.listdir(log_dir):
+        if not name.endswith(".log") or name.endswith(".failed.log"):
+            continue
+        path = os.path.join(log_dir, name)
+        try:
+            logs.append((os.path.getmtime(path), path))
+        except FileNotFoundError:
+            continue
+    for _, path in sorted(logs)[:-keep]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class Supervisor(object):
+    """运行一个样本的所有外部命令, 每个命令都有超时限制, 并记录退出状态
+
+    所有命令的输出都追加到样本的日志文件中, 样本结束后由archive保存到日志目录.
+    run的参数与run_cmd相同, 可以直接传给gen_mesh等函数.
+    :log: 样本的日志文件, 创建时清空
+    :timeout: 每个命令默认的超时, 单位秒, 0表示不限制
+    """
+
+    def __init__(self, log, timeout=0, grace=5.0):
+        self.log = str(log)
+        self.timeout = timeout
+        self.grace = grace
+        self.history = []
+        open(self.log, "wb").close()
+
+    def run(self, cmd, cwd=".", timeout=None, poll=None, interval=0.5):
+        """运行命令, 返回退出码, 超时时为结束进程的信号(负数)"""
+        status = run_supervised(
+            cmd,
+            cwd,
+            self.timeout if timeout is None else timeout,
+            self.log,
+            poll,
+            interval,
+            self.grace,
+        )
+        self.history.append(status)
+        with open(self.log, "at") as f:
+            f.write(f"# supervisor: {cmd} {describe(status)}\n")
+        return status["returncode"]
+
+    @property
+    def last(self):
+        return self.history[-1] if self.history else None
+
+    def failure(self, stage):
+        """最后一个命令失败的异常"""
+        return StageFailed(stage, self.last)
+
+    def last_failure(self):
+        """最后一个失败的命令的退出状态, 没有时返回None"""
+        for status in reversed(self.history):
+            if status["timed_out"] or status["returncode"] != 0:
+                return status
+        return None
+
+    def archive(self, log_dir, name, keep=0, failed=False):
+        """把样本日志复制到 log_dir/name.log, 失败的样本为 name.failed.log
+
+        成功样本的日志只保留最新的keep个, 0表示全部保留
+        :returns: 保存的日志路径
+        """
+        os.makedirs(log_dir, exist_ok=True)
+        dst = os.path.join(log_dir, name + (".failed.log" if failed else ".log"))
+        # 重新生成的样本替换之前的日志
+        other = os.path.join(log_dir, name + (".log" if failed else ".failed.log"))
+        if os.path.exists(other):
+            os.remove(other)
+        shutil.copyfile(self.log, dst)
+        if keep > 0:
+            rotate_logs(log_dir, keep)
+        return dst
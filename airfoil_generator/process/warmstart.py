@@ -0,0 +1,245 @@
+import io
+import json
+import math
+import os
+import re
+import shutil
+import time
+import uuid
+
+import numpy as np
+
+from .meshcache import dir_size
+from .reader import latest_time, read_foam_field
+
+# 来流大小变为s倍时各个场近似变为 s**k 倍
+FIELD_SCALING = {
+    "U": 1,
+    "p": 2,
+    "k": 2,
+    "epsilon": 3,
+    "omega": 1,
+    "nut": 1,
+    "nuTilda": 1,
+}
+
+# 热启动前原场文件的备份后缀
+BACKUP = ".coldstart"
+
+_INTERNAL_FIELD = re.compile(rb"^internalField\s[^;]*;", re.MULTILINE)
+
+
+def write_internal_field(fname, values):
+    """把场文件的internalField替换为nonuniform列表, boundaryField保持不变"""
+    values = np.asarray(values)
+    buf = io.StringIO()
+    if values.ndim == 2:
+        buf.write(f"internalField   nonuniform List<vector> \n{len(values)}\n(\n")
+        np.savetxt(buf, values, fmt="(%.8g %.8g %.8g)")
+    else:
+        buf.write(f"internalField   nonuniform List<scalar> \n{len(values)}\n(\n")
+        np.savetxt(buf, values, fmt="%.8g")
+    buf.write(")\n;")
+    with open(fname, "rb") as f:
+        text = f.read()
+    text, n = _INTERNAL_FIELD.subn(lambda _: buf.getvalue().encode(), text, count=1)
+    if n == 0:
+        raise ValueError(f"no internalField found in {fname}")
+    with open(fname, "wb") as f:
+        f.write(text)
+
+
+def map_fields(fields, angle, length, new_angle, new_length):
+    """把(angle, length)下收敛的场旋转和缩放到新的来流
+
+    速度矢量绕z轴旋转来流角度之差, 各个场按来流大小之比的 FIELD_SCALING 次方缩放
+    """
+    s = new_length / length if length > 0 else 1.0
+    mapped = {}
+    for name, values in fields.items():
+        values = np.array(values, dtype=np.float64)
+        if name == "U":
+            theta = (new_angle - angle) / 180 * math.pi
+            c, d = math.cos(theta), math.sin(theta)
+            ux, uy = values[:, 0].copy(), values[:, 1].copy()
+            values[:, 0] = c * ux - d * uy
+            values[:, 1] = d * ux + c * uy
+        mapped[name] = values * s ** FIELD_SCALING.get(name, 0)
+    return mapped
+
+
+class WarmStartStore(object):
+    """按网格保存收敛的流场, 新样本从最接近的(angle, length)的解开始计算
+
+    每个网格一个目录 {mesh_key}/, 每个解一个 {angle}_{length}.npz.
+    每个样本的迭代步数追加到 iterations.jsonl 中, 用于统计热启动节省的步数.
+    总大小超过max_size时按最近使用时间淘汰, 多个进程可以共用同一个目录.
+    """
+
+    def __init__(self, store_dir, max_size=4096 * 1024**2, angle_range=(-10, 10), length_range=(0, 10)):
+        self.store_dir = os.path.abspath(store_dir)
+        self.max_size = max_size
+        # 计算距离时按参数范围归一化
+        self.angle_scale = max(abs(angle_range[1] - angle_range[0]), 1e-12)
+        self.length_scale = max(abs(length_range[1] - length_range[0]), 1e-12)
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    def _entries(self, key):
+        mesh_dir = os.path.join(self.store_dir, key)
+        if not os.path.isdir(mesh_dir):
+            return []
+        entries = []
+        for fname in os.listdir(mesh_dir):
+            if fname.startswith(".") or not fname.endswith(".npz"):
+                continue
+            angle, length = fname[: -len(".npz")].split("_")
+            entries.append((float(angle), float(length), os.path.join(mesh_dir, fname)))
+        return entries
+
+    def nearest(self, key, angle, length):
+        """同一网格上最接近的解, (angle, length, path), 没有时返回None"""
+        best, best_dist = None, float("inf")
+        for entry in self._entries(key):
+            dist = ((entry[0] - angle) / self.angle_scale) ** 2 + (
+                (entry[1] - length) / self.length_scale
+            ) ** 2
+            if dist < best_dist:
+                best, best_dist = entry, dist
+        return best
+
+    def put(self, key, angle, length, fields):
+        mesh_dir = os.path.join(self.store_dir, key)
+        os.makedirs(mesh_dir, exist_ok=True)
+        fname = os.path.join(mesh_dir, f"{angle:.6f}_{length:.6f}.npz")
+        # 先写临时文件再改名, 其他进程不会读到写了一半的解
+        tmp = os.path.join(mesh_dir, f".tmp-{uuid.uuid4().hex}.npz")
+        np.savez(tmp, **{name: v.astype(np.float32) for name, v in fields.items()})
+        os.replace(tmp, fname)
+        os.utime(mesh_dir)
+        self.evict()
+
+    def load(self, path):
+        with np.load(path) as data:
+            fields = {name: data[name] for name in data.files}
+        os.utime(os.path.dirname(path))
+        return fields
+
+    def evict(self):
+        """淘汰最久未使用的网格目录, 直到总大小不超过max_size"""
+        entries = []
+        for name in os.listdir(self.store_dir):
+            path = os.path.join(self.store_dir, name)
+            if not os.path.isdir(path):
+                continue
+            try:
+                entries.append((os.path.getmtime(path), dir_size(path), path))
+            except FileNotFoundError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_size:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def apply(self, case_dir, key, angle, length):
+        """把最接近的解映射到新来流, 写入case_dir/0中作为初值
+
+        原来的场文件备份为 0/{name}.coldstart, 求解结束后用restore恢复
+        :returns: 使用的解的 (angle, length), 没有可用的解时返回None
+        """
+        entry = self.nearest(key, angle, length)
+        if entry is None:
+            return None
+        try:
+            fields = self.load(entry[2])
+        except (FileNotFoundError, OSError, ValueError):
+            # 读取的同时被其他进程淘汰了
+            return None
+        fields = map_fields(fields, entry[0], entry[1], angle, length)
+        for name, values in fields.items():
+            fname = os.path.join(case_dir, "0", name)
+            if not os.path.exists(fname):
+                continue
+            if not os.path.exists(f"{fname}{BACKUP}"):
+                shutil.copyfile(fname, f"{fname}{BACKUP}")
+            write_internal_field(fname, values)
+        return entry[0], entry[1]
+
+    @staticmethod
+    def restore(case_dir):
+        """恢复apply之前的场文件"""
+        zero = os.path.join(case_dir, "0")
+        for fname in os.listdir(zero):
+            if fname.endswith(BACKUP):
+                shutil.copyfile(os.path.join(zero, fname), os.path.join(zero, fname[: -len(BACKUP)]))
+
+    def _history(self):
+        fname = os.path.join(self.store_dir, "iterations.jsonl")
+        if not os.path.exists(fname):
+            return []
+        with open(fname, "rt") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def cold_iterations(self, key=None):
+        """冷启动的平均迭代步数, 优先使用同一网格的记录"""
+        cold = [e for e in self._history() if not e["source"] and e["iterations"] is not None]
+        same = [e["iterations"] for e in cold if e["mesh"] == key]
+        if same:
+            return float(np.mean(same))
+        if cold:
+            return float(np.mean([e["iterations"] for e in cold]))
+        return None
+
+    def record(self, case_dir, key, angle, length, iterations, source, time_dir=None):
+        """保存求解结果, 并记录这个样本的迭代步数和热启动来源
+
+        :returns: 与冷启动平均步数相比节省的迭代步数, 无法比较时返回None
+        """
+        saved = None
+        if source and iterations is not None:
+            cold = self.cold_iterations(key)
+            saved = None if cold is None else cold - iterations
+
+        if time_dir is None:
+            time_dir = latest_time(case_dir)
+        fields = {}
+        for name in FIELD_SCALING:
+            if time_dir is None:
+                break
+            fname = os.path.join(case_dir, time_dir, name)
+            if os.path.exists(fname) and os.path.exists(os.path.join(case_dir, "0", name)):
+                fields[name] = read_foam_field(fname)
+        if "U" in fields:
+            self.put(key, angle, length, fields)
+
+        entry = {
+            "time": time.time(),
+            "mesh": key,
+            "angle": angle,
+            "length": length,
+            "iterations": iterations,
+            "source": source,
+        }
+        # 单行追加写入, 多个进程同时写也不会交错
+        with open(os.path.join(self.store_dir, "iterations.jsonl"), "at") as f:
+            f.write(json.dumps(entry) + "\n")
+        return saved
+
+    def report(self, since=0):
+        """统计since之后的样本, 打印冷启动和热启动的平均迭代步数"""
+        cold, warm = [], []
+        for entry in self._history():
+            if entry["time"] < since or entry["iterations"] is None:
+                continue
+            (warm if entry["source"] else cold).append(entry["iterations"])
+        if not warm:
+            print(f"\nwarm start: {len(cold)} cold starts, no warm starts")
+            return
+        print(f"\nwarm start: {len(warm)} warm starts, mean {np.mean(warm):.1f} iterations")
+        if cold:
+            saved = np.mean(cold) - np.mean(warm)
+            print(
+                f"\t{len(cold)} cold starts, mean {np.mean(cold):.1f} iterations, "
+                f"saved {saved:.1f} iterations per warm start, {saved * len(warm):.0f} in total"
+            )
@@ -0,0 +1,197 @@
+import cProfile
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+_local = threading.local()
+# python3.6没有time.thread_time
+_thread_time = getattr(time, "thread_time", time.process_time)
+# cProfile同一时间只能有一个在运行, 多个线程同时进入python阶段时只分析先进入的那个
+_profile_lock = threading.Lock()
+
+
+def _children_cpu():
+    t = os.times()
+    return t.children_user + t.children_system
+
+
+class Tracer(object):
+    """记录每个样本各个阶段的墙钟时间和CPU时间
+
+    每个阶段一条记录 {"sample", "stage", "start", "wall", "cpu", "pid", "thread"},
+    设置path时立即追加写入jsonl文件. python阶段的cpu是当前线程的CPU时间,
+    外部命令阶段的cpu是子进程的CPU时间.
+    设置profile_dir时python阶段用cProfile分析, 每个阶段的结果累加后保存为 {stage}.prof.
+    子进程的tracer不写文件, 记录和分析结果用drain, drain_profiles传回主进程合并.
+    """
+
+    def __init__(self, path=None, profile_dir=None):
+        self.path = path
+        self.profile_dir = profile_dir
+        self.records = []
+        self._profiles = {}
+        # 子进程传回的分析结果, {stage: [pstats的stats字典]}
+        self._merged = {}
+        self._lock = threading.Lock()
+        self._file = open(path, "wt") if path else None
+
+    @contextmanager
+    def stage(self, name, subprocess=False):
+        """计时一个阶段, subprocess为True表示阶段中运行的是外部命令"""
+        profile = None
+        if self.profile_dir and not subprocess and _profile_lock.acquire(blocking=False):
+            with self._lock:
+                profile = self._profiles.setdefault(name, cProfile.Profile())
+        start = time.time()
+        wall0 = time.perf_counter()
+        cpu0 = _children_cpu() if subprocess else _thread_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                _profile_lock.release()
+            cpu1 = _children_cpu() if subprocess else _thread_time()
+            self.add(
+                {
+                    "sample": getattr(_local, "sample", None),
+                    "stage": name,
+                    "start": start,
+                    "wall": time.perf_counter() - wall0,
+                    "cpu": cpu1 - cpu0,
+                    "pid": os.getpid(),
+                    "thread": threading.current_thread().name,
+                }
+            )
+
+    def add(self, *records):
+        with self._lock:
+            self.records.extend(records)
+            if self._file is not None:
+                for record in records:
+                    self._file.write(json.dumps(record) + "\n")
+                self._file.flush()
+
+    def drain(self):
+        """取出并清空已有的记录, 用于把子进程的记录传回主进程"""
+        with self._lock:
+            records, self.records = self.records, []
+        return records
+
+    def drain_profiles(self):
+        """取出并清空各阶段的分析结果, 返回 {stage: stats字典}, 可以pickle"""
+        with self._lock:
+            profiles, self._profiles = self._profiles, {}
+        return {name: pstats.Stats(profile).stats for name, profile in profiles.items()}
+
+    def add_profiles(self, profiles):
+        """合并drain_profiles的结果, close时与本进程的结果一起保存"""
+        with self._lock:
+            for name, stats in profiles.items():
+                self._merged.setdefault(name, []).append(stats)
+
+    def summary(self):
+        """按阶段统计, 返回 [(stage, count, total, p50, p95, max, cpu)], 按总时间排序"""
+        stages = {}
+        for record in self.records:
+            stages.setdefault(record["stage"], []).append((record["wall"], record["cpu"]))
+        rows = []
+        for name, values in stages.items():
+            wall, cpu = np.array(values).T
+            rows.append(
+                (
+                    name,
+                    len(wall),
+                    wall.sum(),
+                    np.percentile(wall, 50),
+                    np.percentile(wall, 95),
+                    wall.max(),
+                    cpu.sum(),
+                )
+            )
+        return sorted(rows, key=lambda row: -row[2])
+
+    def print_summary(self):
+        rows = self.summary()
+        if not rows:
+            return
+        width = max(len("stage"), max(len(row[0]) for row in rows))
+        print(
+            f"\n{'stage':<{width}} {'count':>6} {'total':>9} {'p50':>8} {'p95':>8} {'max':>8} {'cpu':>9}"
+        )
+        for name, count, total, p50, p95, wmax, cpu in rows:
+            print(
+                f"{name:<{width}} {count:>6d} {total:>9.2f} {p50:>8.3f} {p95:>8.3f} {wmax:>8.3f} {cpu:>9.2f}"
+            )
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            print(f"trace saved to {self.path}")
+        if self.profile_dir:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            for name in set(self._profiles) | set(self._merged):
+                sources = [self._profiles[name]] if name in self._profiles else []
+                sources += [_StatsData(stats) for stats in self._merged.get(name, [])]
+                merged = pstats.Stats(sources[0])
+                for source in sources[1:]:
+                    merged.add(source)
+                merged.dump_stats(os.path.join(self.profile_dir, f"{name}.prof"))
+            print(f"profiles saved to {self.profile_dir}")
+
+
+class _StatsData(object):
+    """把stats字典包装成pstats.Stats可以读取的对象"""
+
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+# 当前进程使用的tracer, 默认只在内存中记录
+_tracer = Tracer()
+
+
+def get_tracer():
+    return _tracer
+
+
+def set_tracer(tracer):
+    global _tracer
+    _tracer = tracer
+    return tracer
+
+
+def stage(name, subprocess=False):
+    return _tracer.stage(name, subprocess)
+
+
+@contextmanager
+def sample(n):
+    """当前线程中的阶段记录都属于样本n"""
+    prev = getattr(_local, "sample", None)
+    _local.sample = n
+    try:
+        yield
+    finally:
+        _local.sample = prev
+
+
+def open_tracer(args):
+    """根据参数创建本次运行的tracer, 每次运行一个 {trace_dir}/{时间}-{pid}.jsonl"""
+    if not args.trace_dir:
+        return set_tracer(Tracer())
+    os.makedirs(args.trace_dir, exist_ok=True)
+    run = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}"
+    profile_dir = os.path.join(args.trace_dir, f"{run}-profile") if args.profile else None
+    return set_tracer(Tracer(os.path.join(args.trace_dir, f"{run}.jsonl"), profile_dir))
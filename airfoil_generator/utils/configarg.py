@@ -1,5 +1,4 @@
 import configargparse
-import random
 
 
 def str2bool(v):
@@ -17,13 +16,14 @@ def get_args(parser: configargparse.ArgumentParser):
 
     parser.add_argument('--config', is_config_file=True, default='config.yml', help='config file path')
 
-    parser.add_argument('--seed', type=int, default=random.randint(0,2**32-1), help='随机种子')
+    parser.add_argument('--seed', type=int, default=None, help='随机种子, 默认随机, resume时默认使用manifest中记录的种子')
     parser.add_argument('--case-dir', type=str, default='caseSteadyState', help='case路径')
 
     # 机翼设置
     parser.add_argument('--airfoil-database', type=str, default='airfoil_database', help='翼型数据库')
     parser.add_argument('--fixed-airfoil', type=str2bool, default=True, help='是否固定翼型')
     parser.add_argument('--airfoil-name', type=str, default='falcon', help='固定的翼型名称')
+    parser.add_argument('--airfoil-db', type=str, default='', help='build-db打包的翼型数据库, 设置后代替airfoil-database目录')
 
     # 来流设置
     parser.add_argument('--freestream-angle', type=float, nargs='+', help='来流角度范围')
@@ -36,16 +36,57 @@ def get_args(parser: configargparse.ArgumentParser):
     # 并行设置
     parser.add_argument('--parallel-enable', type=str2bool, default=False, help='并行设置')
     parser.add_argument('--subdomains', type=int, default=4, help='计算域分解数量')
+    parser.add_argument('--reuse-decomposition', type=str2bool, default=False, help='并行时同一网格上的样本复用processor*中分解好的网格, 只写入新的初值')
+    parser.add_argument('--workers', type=int, default=1, help='同时运行的仿真数量, 大于1时每个进程使用独立的case副本')
+    parser.add_argument('--work-dir', type=str, default='workers', help='多进程模式下case副本的存放路径')
+    parser.add_argument('--pipeline-depth', type=int, default=0, help='后台后处理和保存的队列长度, 0表示不使用后台处理')
+    parser.add_argument('--pipeline-workers', type=int, default=2, help='后台后处理的线程数')
+
+    # 网格缓存
+    parser.add_argument('--mesh-cache', type=str, default='mesh_cache', help='网格缓存路径, 为空时不缓存')
+    parser.add_argument('--mesh-cache-size', type=float, default=2048, help='网格缓存的最大容量, 单位MB')
+
+    # 热启动
+    parser.add_argument('--warm-start', type=str2bool, default=False, help='是否从同一网格上最接近的已收敛解开始计算')
+    parser.add_argument('--warm-start-dir', type=str, default='warm_start', help='已收敛解的保存路径')
+    parser.add_argument('--warm-start-size', type=float, default=4096, help='已收敛解的最大容量, 单位MB')
+
+    # 收敛监控
+    parser.add_argument('--residual-tol', type=float, default=0, help='所有场的初始残差都小于该值时提前停止求解, 0表示不使用')
+    parser.add_argument('--plateau-window', type=int, default=0, help='最近这么多步残差不再下降时提前停止求解, 0表示不使用')
+    parser.add_argument('--plateau-tol', type=float, default=0.05, help='判定残差不再下降的log10残差变化幅度')
+    parser.add_argument('--min-iters', type=int, default=20, help='提前停止前至少运行的步数')
+    parser.add_argument('--monitor-interval', type=float, default=0.5, help='读取求解器日志的间隔, 单位秒')
+    parser.add_argument('--stop-timeout', type=float, default=60, help='要求求解器停止后等待的最长时间, 超时后结束进程, 单位秒')
+
+    # 外部命令的监管
+    parser.add_argument('--stage-timeout', type=float, default=0, help='gmsh, decomposePar, postProcess等命令的超时, 超时后结束整个进程组, 单位秒, 0表示不限制')
+    parser.add_argument('--solver-timeout', type=float, default=0, help='求解器的超时, 单位秒, 0表示不限制')
+    parser.add_argument('--fallback', type=str, nargs='*', default=[], choices=['retry', 'cold', 'serial'],
+                        help='命令失败或超时后依次重试的方式: retry 相同设置, cold 不使用热启动, serial 不并行; 为空时直接记为失败')
+    parser.add_argument('--log-dir', type=str, default='logs', help='每个样本的日志保存路径, 为空时不保存')
+    parser.add_argument('--log-keep', type=int, default=100, help='保留最新的多少个成功样本的日志, 失败样本的日志都保留, 0表示全部保留')
 
     # 后处理
     parser.add_argument('--res', type=int, default=128, help='输出图像分辨率')
+    parser.add_argument('--sample-xrange', type=float, nargs=2, default=[-0.5, 1.5], help='采样区域的x范围, 按res生成system/points')
+    parser.add_argument('--sample-yrange', type=float, nargs=2, default=[-1.0, 1.0], help='采样区域的y范围, 按res生成system/points')
     parser.add_argument('--output-raw-mesh', type=str2bool, default=True, help='是否输出网格数据')
     parser.add_argument('--output-airfoil-boundary', type=str2bool, default=True, help='是否输出机翼表面数据')
 
     # 输出设置
     parser.add_argument('--n-samples', type=int, default=2, help='生成样本的数量')
+    parser.add_argument('--plan', type=str, default='', help='plan命令生成的实验表, 指定时按表中的参数生成, 样本数量为表的行数')
     parser.add_argument('--output-dir', type=str, default='outputs', help='数据输出路径')
     parser.add_argument('--output-prefix', type=str, default='sample', help='输出样本前缀')
+    parser.add_argument('--output-format', type=str, nargs='+', default=['mat', 'npz'], choices=['mat', 'npz', 'shard'], help='输出格式, mat和npz每个样本一个文件, shard把样本追加到分片中')
+    parser.add_argument('--shard-size', type=int, default=256, help='每个分片的样本数量')
+    parser.add_argument('--shard-compress', type=str2bool, default=False, help='分片是否压缩')
+    parser.add_argument('--resume', type=str2bool, default=False, help='根据输出路径中的manifest跳过已完成的样本, 继续生成')
+
+    # 计时
+    parser.add_argument('--trace-dir', type=str, default='traces', help='每次运行各阶段的计时记录保存路径, 为空时不保存')
+    parser.add_argument('--profile', type=str2bool, default=False, help='是否用cProfile分析python阶段, 结果保存在trace-dir中')
 
     return parser
 
@@ -63,5 +104,74 @@ def get_cst_args(parser: configargparse.ArgumentParser):
     return parser
 
 
+def get_fit_args(parser: configargparse.ArgumentParser):
+    parser.add_argument('--fit-database', type=str, nargs='+', default=['airfoil_database', 'airfoil_database_test'], help='需要拟合的翼型数据库')
+    parser.add_argument('--cst-order', type=int, default=5, help='CST中Bernstein多项式的阶数')
+    parser.add_argument('--cst-points', type=int, default=200, help='拟合时每个翼型的采样点数')
+    parser.add_argument('--fit-N1', type=float, nargs='+', default=[0.5], help='N1的候选值, 多个值时逐一拟合取最优')
+    parser.add_argument('--fit-N2', type=float, nargs='+', default=[1.0], help='N2的候选值, 多个值时逐一拟合取最优')
+    parser.add_argument('--fit-output', type=str, default='cst_table.npz', help='CST参数表输出路径')
+    parser.add_argument('--dedupe-tol', type=float, default=1e-3, help='判定翼型重复的参数距离阈值')
+
+    return parser
+
+
+def get_db_args(parser: configargparse.ArgumentParser):
+    parser.add_argument('--airfoil-database', type=str, nargs='+', default=['airfoil_database'], help='需要打包的翼型数据库目录')
+    parser.add_argument('--db-output', type=str, default='airfoil_db', help='打包输出路径, 生成.npy坐标文件和.index.npy索引文件')
+
+    return parser
+
+
+def get_plan_args(parser: configargparse.ArgumentParser):
+    parser = get_args(parser)
+    parser.add_argument('--plan-design', type=str, default='lhs', choices=['lhs', 'sobol', 'grid', 'random'], help='实验设计方法, lhs为拉丁超立方, sobol为Sobol序列, grid为全因子网格')
+    parser.add_argument('--plan-grid', type=int, nargs=3, default=[5, 5, 1], help='grid设计中每个翼型的角度, 大小和粘度的取值个数')
+    parser.add_argument('--nu-range', type=float, nargs='+', default=[], help='运动粘度范围, 两个值时按对数均匀分布, 否则固定为nu')
+    parser.add_argument('--plan-output', type=str, default='plan.csv', help='实验表输出路径')
+
+    return parser
+
+
+def get_regrid_args(parser: configargparse.ArgumentParser):
+    parser.add_argument('--regrid-input', type=str, default='outputs', help='generate输出的数据集路径, 样本需要包含raw_mesh_data')
+    parser.add_argument('--regrid-prefix', type=str, default='sample', help='数据集的样本前缀')
+    parser.add_argument('--regrid-output', type=str, default='regrid', help='输出路径, 每种分辨率和范围一个子目录')
+    parser.add_argument('--regrid-res', type=int, nargs='+', default=[256], help='输出图像的分辨率, 可以有多个')
+    parser.add_argument('--regrid-window', type=float, nargs='+', default=[-0.5, 1.5, -1.0, 1.0], help='输出图像的范围 x0 x1 y0 y1, 每4个值一个范围')
+    parser.add_argument('--regrid-format', type=str, nargs='+', default=['npz'], choices=['mat', 'npz', 'shard'], help='输出格式')
+    parser.add_argument('--regrid-cache', type=str, default='regrid_cache', help='插值权重的缓存路径, 为空时不缓存')
+    parser.add_argument('--regrid-cache-size', type=float, default=4096, help='插值权重缓存的最大容量, 单位MB')
+    parser.add_argument('--shard-size', type=int, default=256, help='每个分片的样本数量')
+    parser.add_argument('--shard-compress', type=str2bool, default=False, help='分片是否压缩')
+
+    return parser
+
+
+def get_preview_args(parser: configargparse.ArgumentParser):
+    parser.add_argument('--preview-input', type=str, default='outputs', help='generate输出的数据集路径')
+    parser.add_argument('--preview-prefix', type=str, default='sample', help='数据集的样本前缀')
+    parser.add_argument('--preview-table', type=str, default='cst_table.npz', help='fit-cst的参数表, 需要用 --cst-order 2 拟合, 与GUI的3个权重对应')
+    parser.add_argument('--preview-dir', type=str, default='preview_index', help='GUI预览索引的路径')
+    parser.add_argument('--nu', type=float, default=1e-5, help='样本中没有nu时使用的运动粘度')
+
+    return parser
+
+
+def get_bench_args(parser: configargparse.ArgumentParser):
+    parser.add_argument('--bench-dir', type=str, default='bench_workspace', help='基准测试的工作目录, 包含假的gmsh和OpenFOAM命令')
+    parser.add_argument('--bench-samples', type=int, default=8, help='端到端测试生成的样本数量')
+    parser.add_argument('--bench-cells', type=int, default=20000, help='假网格的网格数量')
+    parser.add_argument('--bench-res', type=int, default=128, help='假采样点云和输出图像的分辨率')
+    parser.add_argument('--bench-iters', type=int, default=100, help='假求解器输出到日志的迭代步数')
+    parser.add_argument('--bench-repeat', type=int, default=10, help='后处理和保存重复运行的次数, 取最短时间')
+    parser.add_argument('--bench-args', type=str, default='', help='传给generate的其他参数, 如 "--pipeline-depth 2"')
+    parser.add_argument('--bench-baseline', type=str, default='bench_baseline.json', help='基准结果文件')
+    parser.add_argument('--bench-save', type=str2bool, default=False, help='是否把本次结果保存为基准')
+    parser.add_argument('--bench-tolerance', type=float, default=0.3, help='超过基准的比例大于该值时判定为性能退化')
+
+    return parser
+
+
 def make_config(args, output_path):
     pass
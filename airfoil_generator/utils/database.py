@@ -0,0 +1,102 @@
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from .utils import airfoil_geometry, read_airfoil
+
+INDEX_DTYPE = np.dtype(
+    [
+        ("name", "U64"),
+        ("header", "U128"),
+        ("offset", "i8"),
+        ("npoints", "i8"),
+        ("thickness", "f8"),
+        ("camber", "f8"),
+    ]
+)
+
+
+def db_paths(db):
+    """打包数据库的坐标文件和索引文件路径"""
+    if db.endswith(".npy"):
+        db = db[: -len(".npy")]
+    return f"{db}.npy", f"{db}.index.npy"
+
+
+def build_database(dirs, db):
+    """把翼型目录中的所有.dat文件解析一次, 打包成一个坐标数组和一个索引
+
+    :dirs: 翼型目录列表
+    :db: 输出路径前缀, 生成 {db}.npy 和 {db}.index.npy
+    :returns: 索引, 结构化数组, 每行一个翼型
+
+    """
+    coords, index = [], []
+    offset = 0
+    for dir in dirs:
+        for fname in sorted(os.listdir(dir)):
+            if not fname.endswith(".dat"):
+                continue
+            try:
+                header, coord = read_airfoil(os.path.join(dir, fname))
+                thickness, camber = airfoil_geometry(coord)
+            except ValueError as e:
+                print(f"\tskip {fname}: {e}")
+                continue
+            name = os.path.splitext(fname)[0]
+            index.append((name, header, offset, len(coord), thickness, camber))
+            coords.append(coord)
+            offset += len(coord)
+
+    coord_file, index_file = db_paths(db)
+    np.save(coord_file, np.concatenate(coords, axis=0))
+    index = np.array(index, dtype=INDEX_DTYPE)
+    np.save(index_file, index)
+    return index
+
+
+class AirfoilDatabase(object):
+    """打包好的翼型数据库, 坐标文件以内存映射方式打开, 读取翼型时不解析文本
+
+    多个进程打开同一个数据库时共用操作系统的页缓存
+    """
+
+    def __init__(self, db):
+        coord_file, index_file = db_paths(db)
+        self.coords = np.load(coord_file, mmap_mode="r")
+        self.index = np.load(index_file)
+        self.names = self.index["name"].tolist()
+        self._ids = {name: i for i, name in enumerate(self.names)}
+
+    def __len__(self):
+        return len(self.index)
+
+    def _id(self, key):
+        if isinstance(key, str):
+            key = os.path.splitext(key)[0] if key.endswith(".dat") else key
+            if key not in self._ids:
+                raise KeyError(f"airfoil {key} not found in database")
+            return self._ids[key]
+        return int(key)
+
+    def __getitem__(self, key):
+        """按名称或序号取翼型坐标, (n, 2) Selig顺序"""
+        row = self.index[self._id(key)]
+        return self.coords[row["offset"] : row["offset"] + row["npoints"]]
+
+    def info(self, key):
+        row = self.index[self._id(key)]
+        return {name: row[name].item() for name in INDEX_DTYPE.names}
+
+
+@lru_cache(maxsize=None)
+def open_database(db):
+    """每个进程只打开一次同一个数据库"""
+    return AirfoilDatabase(db)
+
+
+def build_db_from_cli(args):
+    index = build_database(args.airfoil_database, args.db_output)
+    coord_file, index_file = db_paths(args.db_output)
+    print(f"packed {len(index)} airfoils into {coord_file}, {index_file}")
@@ -1,4 +1,7 @@
 import os
+import subprocess
+
+import numpy as np
 
 
 def makeDirs(*dirs):
@@ -6,9 +9,95 @@ def makeDirs(*dirs):
         if not os.path.exists(dir):
             os.makedirs(dir)
 
+
+def run_cmd(cmd, cwd="."):
+    """在cwd中运行shell命令, 不改变全局工作路径, 返回退出码"""
+    return subprocess.call(cmd, shell=True, cwd=cwd)
+
+
 def read_database(dir):
     files = os.listdir(dir)
     files.sort()
     if len(files) == 0:
         print(f"error - no airfoils found in {dir}")
     return files
+
+
+def read_airfoil(fpath):
+    """读取Selig或Lednicer格式的翼型文件
+
+    :fpath: 翼型文件路径
+    :returns: (header, coord), coord为(n, 2)的array, 统一为Selig顺序,
+        即从尾缘出发经上表面到前缘, 再经下表面回到尾缘
+
+    """
+    header = ""
+    blocks = [[]]
+    with open(fpath, "rt", errors="ignore") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 0:
+                if len(blocks[-1]) > 0:
+                    blocks.append([])
+                continue
+            try:
+                row = [float(v) for v in parts[:2]]
+            except ValueError:
+                row = []
+            if len(row) != 2:
+                if not header and not any(blocks):
+                    header = line.strip()
+                continue
+            blocks[-1].append(row)
+
+    rows = [row for block in blocks for row in block]
+    if len(rows) == 0:
+        raise ValueError(f"no coordinates found in {fpath}")
+
+    if rows[0][0] > 1.5 and rows[0][1] > 1.5:
+        # Lednicer格式, 第一行为上下表面点数, 两个表面均从前缘到尾缘
+        n_upper, n_lower = int(rows[0][0]), int(rows[0][1])
+        upper = np.array(rows[1 : 1 + n_upper])
+        lower = np.array(rows[1 + n_upper : 1 + n_upper + n_lower])
+        if np.max(np.abs(upper[0] - lower[0])) < 1e-6:
+            lower = lower[1:]
+        coord = np.concatenate([upper[::-1], lower], axis=0)
+    else:
+        coord = np.array(rows)
+
+    return header, coord
+
+
+def normalize_airfoil(coord):
+    """把翼型平移缩放到前缘(0, 0), 弦长为1
+
+    :coord: (n, 2) Selig顺序的坐标
+    :returns: (upper, lower) 两个表面, 均按x升序排列
+
+    """
+    le = int(np.argmin(coord[:, 0]))
+    x_le, y_le = coord[le]
+    chord = np.max(coord[:, 0]) - x_le
+    coord = (coord - [x_le, y_le]) / chord
+
+    upper = coord[: le + 1]
+    lower = coord[le:]
+    upper = upper[np.argsort(upper[:, 0], kind="stable")]
+    lower = lower[np.argsort(lower[:, 0], kind="stable")]
+    return upper, lower
+
+
+def airfoil_geometry(coord, nx=201):
+    """翼型的最大相对厚度和最大相对弯度
+
+    :coord: (n, 2) Selig顺序的坐标
+    :returns: (thickness, camber), camber带符号
+    """
+    upper, lower = normalize_airfoil(coord)
+    x = 0.5 * (1 - np.cos(np.linspace(0, np.pi, nx)))
+    yu = np.interp(x, upper[:, 0], upper[:, 1])
+    yl = np.interp(x, lower[:, 0], lower[:, 1])
+    thickness = np.max(yu - yl)
+    mean_line = (yu + yl) / 2
+    camber = mean_line[np.argmax(np.abs(mean_line))]
+    return thickness, camber
@@ -0,0 +1,252 @@
+import json
+import os
+import re
+
+import numpy as np
+import scipy.io as scio
+
+from . import trace
+
+
+def flatten_sample(data_dict, prefix=""):
+    """把嵌套的数据字典展开成 {"raw_mesh_data/cell_x": array} 的形式"""
+    flat = {}
+    for k, v in data_dict.items():
+        if isinstance(v, dict):
+            flat.update(flatten_sample(v, f"{prefix}{k}/"))
+        else:
+            flat[f"{prefix}{k}"] = np.asarray(v)
+    return flat
+
+
+def unflatten_sample(flat):
+    data_dict = {}
+    for k, v in flat.items():
+        d = data_dict
+        *parents, name = k.split("/")
+        for parent in parents:
+            d = d.setdefault(parent, {})
+        d[name] = v
+    return data_dict
+
+
+class MatWriter(object):
+    """每个样本一个压缩的.mat文件"""
+
+    name = "mat"
+
+    def __init__(self, output_dir, prefix):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        # 样本真正写入磁盘后调用 on_saved(n, path)
+        self.on_saved = None
+
+    def path(self, n):
+        return f"{self.output_dir}/{self.prefix}{n}.mat"
+
+    def saved(self, n, path):
+        if self.on_saved is not None:
+            self.on_saved(n, path)
+
+    def write(self, n, data_dict):
+        save_path = self.path(n)
+        scio.savemat(save_path, data_dict, do_compression=True)
+        self.saved(n, save_path)
+        return save_path
+
+    def close(self):
+        pass
+
+
+class NpzWriter(MatWriter):
+    """每个样本一个压缩的.npz文件, 读取时用键'data'取出嵌套字典"""
+
+    name = "npz"
+
+    def path(self, n):
+        return f"{self.output_dir}/{self.prefix}{n}.npz"
+
+    def write(self, n, data_dict):
+        # when read the data with the key 'data' after loaded
+        save_path = self.path(n)
+        np.savez_compressed(save_path, data=data_dict, allow_pickle=True)
+        self.saved(n, save_path)
+        return save_path
+
+
+class ShardWriter(MatWriter):
+    """把样本追加到固定大小的分片中, 减少小文件数量
+
+    每个分片是一个.npz, 对每个键保存所有样本沿第0维拼接后的数组 "{key}"
+    和每个样本的起止位置 "{key}.offsets", 以及样本编号 "__index__".
+    所有数组都是普通类型, 读取时不需要pickle. 同一分片中所有样本的键必须相同.
+    分片列表保存在 {prefix}index.json 中, resume时在已有的分片后继续追加.
+    """
+
+    name = "shard"
+
+    def __init__(self, output_dir, prefix, shard_size=256, compress=False, resume=False):
+        super(ShardWriter, self).__init__(output_dir, prefix)
+        self.shard_size = shard_size
+        self.compress = compress
+        self.index_path = f"{output_dir}/{prefix}index.json"
+        if resume and os.path.exists(self.index_path):
+            with open(self.index_path, "rt") as f:
+                self.index = json.load(f)
+        else:
+            self.index = {"shard_size": shard_size, "shards": []}
+        self._buffer = []
+
+    def path(self, n):
+        return f"{self.output_dir}/{self.prefix}shard{len(self.index['shards']):05d}.npz"
+
+    def write(self, n, data_dict):
+        flat = flatten_sample(data_dict)
+        # 同一分片中所有样本的键必须相同, 在加入缓冲区前检查, 已缓冲的样本仍然可以写入
+        if self._buffer and flat.keys() != self._buffer[0][1].keys():
+            first, keys = self._buffer[0][0], self._buffer[0][1].keys()
+            raise ValueError(
+                f"sample {n} does not match the keys of sample {first} in the same shard: "
+                f"missing {sorted(keys - flat.keys())}, extra {sorted(flat.keys() - keys)}"
+            )
+        self._buffer.append((n, flat))
+        save_path = self.path(n)
+        if len(self._buffer) >= self.shard_size:
+            self.flush()
+        return save_path
+
+    def flush(self):
+        if len(self._buffer) == 0:
+            return
+        with trace.stage("flush_shard"):
+            self._flush()
+
+    def _flush(self):
+        ids = [n for n, _ in self._buffer]
+        keys = list(self._buffer[0][1].keys())
+        arrays = {"__index__": np.array(ids, dtype=np.int64)}
+        for key in keys:
+            values = [np.atleast_1d(flat[key]) for _, flat in self._buffer]
+            lengths = [len(v) for v in values]
+            arrays[key] = np.concatenate(values, axis=0)
+            arrays[f"{key}.offsets"] = np.cumsum([0] + lengths, dtype=np.int64)
+
+        fname = os.path.basename(self.path(ids[0]))
+        save = np.savez_compressed if self.compress else np.savez
+        # 先写临时文件再改名, 中断时不会留下不完整的分片
+        tmp = f"{self.output_dir}/.{fname}"
+        with open(tmp, "wb") as f:
+            save(f, **arrays)
+        os.replace(tmp, f"{self.output_dir}/{fname}")
+
+        self.index["shards"].append({"file": fname, "samples": ids})
+        with open(f"{self.index_path}.tmp", "wt") as f:
+            json.dump(self.index, f)
+        os.replace(f"{self.index_path}.tmp", self.index_path)
+        self._buffer = []
+        for n in ids:
+            self.saved(n, f"{self.output_dir}/{fname}")
+
+    def close(self):
+        self.flush()
+
+
+def read_shard(fname):
+    """读取一个分片, 返回 {样本编号: 数据字典}"""
+    samples = {}
+    with np.load(fname) as shard:
+        keys = [k for k in shard.files if k != "__index__" and not k.endswith(".offsets")]
+        arrays = {k: shard[k] for k in keys}
+        offsets = {k: shard[f"{k}.offsets"] for k in keys}
+        for i, n in enumerate(shard["__index__"].tolist()):
+            flat = {k: arrays[k][offsets[k][i] : offsets[k][i + 1]] for k in keys}
+            samples[n] = unflatten_sample(flat)
+    return samples
+
+
+def sample_files(output_dir, prefix):
+    """每个样本一个文件的数据集, 返回 {样本编号: {"npz" 或 "mat": 路径}}"""
+    pattern = re.compile(rf"^{re.escape(prefix)}(\d+)\.(npz|mat)$")
+    files = {}
+    for fname in os.listdir(output_dir):
+        m = pattern.match(fname)
+        if m:
+            files.setdefault(int(m.group(1)), {})[m.group(2)] = f"{output_dir}/{fname}"
+    return files
+
+
+def iter_dataset(output_dir, prefix):
+    """遍历generate输出的数据集, 逐个产生 (样本编号, 数据字典)
+
+    有分片索引时读取分片, 否则读取每个样本一个的.npz, 没有.npz时读取.mat
+    """
+    index_path = f"{output_dir}/{prefix}index.json"
+    if os.path.exists(index_path):
+        with open(index_path, "rt") as f:
+            index = json.load(f)
+        for shard in index["shards"]:
+            samples = read_shard(f"{output_dir}/{shard['file']}")
+            for n in sorted(samples):
+                yield n, samples[n]
+        return
+
+    files = sample_files(output_dir, prefix)
+    for n in sorted(files):
+        if "npz" in files[n]:
+            with np.load(files[n]["npz"], allow_pickle=True) as data:
+                yield n, data["data"].item()
+        else:
+            data = scio.loadmat(files[n]["mat"], simplify_cells=True)
+            yield n, {k: v for k, v in data.items() if not k.startswith("__")}
+
+
+class MultiWriter(object):
+    """依次调用多个writer, 所有writer都写完一个样本后调用 on_saved(n, paths)"""
+
+    def __init__(self, writers, on_saved=None):
+        self.writers = writers
+        self.on_saved = on_saved
+        self._saved = {}
+        for writer in writers:
+            writer.on_saved = self._writer_saved
+
+    def _writer_saved(self, n, path):
+        paths = self._saved.setdefault(n, [])
+        paths.append(path)
+        if len(paths) == len(self.writers):
+            del self._saved[n]
+            if self.on_saved is not None:
+                self.on_saved(n, paths)
+
+    def write(self, n, data_dict):
+        paths = []
+        for writer in self.writers:
+            with trace.stage(f"save_{writer.name}"):
+                paths.append(writer.write(n, data_dict))
+        return paths
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+
+def get_writer(args, on_saved=None):
+    writers = []
+    for fmt in args.output_format:
+        if fmt == "mat":
+            writers.append(MatWriter(args.output_dir, args.output_prefix))
+        elif fmt == "npz":
+            writers.append(NpzWriter(args.output_dir, args.output_prefix))
+        elif fmt == "shard":
+            writers.append(
+                ShardWriter(
+                    args.output_dir,
+                    args.output_prefix,
+                    args.shard_size,
+                    args.shard_compress,
+                    args.resume,
+                )
+            )
+        else:
+            raise ValueError(f"unsupported output format: {fmt}")
+    return MultiWriter(writers, on_saved)